@@ -1,11 +1,18 @@
 import os
-from litellm import completion
+import asyncio
+from litellm import completion, acompletion
 import litellm
 litellm.set_verbose = False
 from typing import Dict, List
 import time, traceback
-from crm_sandbox.agents.prompts import SCHEMA_STRING, REACT_RULE_STRING, ACT_RULE_STRING, SYSTEM_METADATA, REACT_EXTERNAL_INTERACTIVE_PROMPT, REACT_INTERNAL_INTERACTIVE_PROMPT, REACT_INTERNAL_PROMPT, REACT_EXTERNAL_PROMPT, REACT_PRIVACY_AWARE_EXTERNAL_PROMPT, REACT_PRIVACY_AWARE_EXTERNAL_INTERACTIVE_PROMPT, ACT_PROMPT
-from crm_sandbox.agents.utils import parse_wrapped_response, BEDROCK_MODELS_MAP, TOGETHER_MODELS_MAP, VERTEX_MODELS_MAP, ANTHROPIC_MODELS_MAP, CUSTOM_SERVER_MODELS_MAP, get_dynamic_max_tokens, estimate_input_tokens
+from crm_sandbox.agents.prompts import REACT_RULE_STRING, ACT_RULE_STRING, SYSTEM_METADATA, REACT_EXTERNAL_INTERACTIVE_PROMPT, REACT_INTERNAL_INTERACTIVE_PROMPT, REACT_INTERNAL_PROMPT, REACT_EXTERNAL_PROMPT, REACT_PRIVACY_AWARE_EXTERNAL_PROMPT, REACT_PRIVACY_AWARE_EXTERNAL_INTERACTIVE_PROMPT, ACT_PROMPT
+from crm_sandbox.agents.utils import parse_wrapped_response, BEDROCK_MODELS_MAP, TOGETHER_MODELS_MAP, VERTEX_MODELS_MAP, ANTHROPIC_MODELS_MAP, CUSTOM_SERVER_MODELS_MAP, get_dynamic_max_tokens
+from crm_sandbox.agents.rate_limiter import get_rate_limiter, is_rate_limit_error, retry_after_seconds, RATE_LIMIT_RETRIES
+from crm_sandbox.agents.llm_cache import cache_lookup, cache_store
+from crm_sandbox.agents.schema_prompts import get_system_prompt, render_schema
+from crm_sandbox.agents.prompt_caching import supports_cache_control, system_content, cache_token_usage
+from crm_sandbox.agents.context import OBSERVATION_PREFIX, build_context_manager
+from crm_sandbox.agents.tracing import trace, span, current_span, record_usage
 import together
 import logging
 
@@ -17,9 +24,8 @@ logger = logging.getLogger(__name__)
 
 class ChatAgent:
     def __init__(
-        self, schema_obj, model: str = "gpt-4o", max_turns: int = 20, eval_mode="default", strategy="react", provider="bedrock", interactive=False, agent_type="internal", privacy_aware_prompt=False
+        self, schema_obj, model: str = "gpt-4o", max_turns: int = 20, eval_mode="default", strategy="react", provider="bedrock", interactive=False, agent_type="internal", privacy_aware_prompt=False, prompt_caching=False, context_budget=None
     ):
-        schema = self._build_schema(schema_obj)
         assert strategy in ["react", "act"], "Only react and act strategies supported for now"
         assert agent_type in ["internal", "external"], "Invalid agent type"
         
@@ -28,23 +34,22 @@ class ChatAgent:
             # react strategy
             if not interactive:
                 if agent_type == "internal":
-                    self.sys_prompt = REACT_INTERNAL_PROMPT.format(system_description=schema, system="Salesforce instance") # add strategy template and schema description
+                    template = REACT_INTERNAL_PROMPT
                 else:
-                    if privacy_aware_prompt:
-                        self.sys_prompt = REACT_PRIVACY_AWARE_EXTERNAL_PROMPT.format(system_description=schema, system="Salesforce instance") # add strategy template and schema description
-                    else:
-                        self.sys_prompt = REACT_EXTERNAL_PROMPT.format(system_description=schema, system="Salesforce instance") # add strategy template and schema description
+                    template = REACT_PRIVACY_AWARE_EXTERNAL_PROMPT if privacy_aware_prompt else REACT_EXTERNAL_PROMPT
             else:
                 if agent_type == "internal":
-                    self.sys_prompt = REACT_INTERNAL_INTERACTIVE_PROMPT.format(system_description=schema, system="Salesforce instance") # add strategy template and schema description
+                    template = REACT_INTERNAL_INTERACTIVE_PROMPT
                 else:
-                    if privacy_aware_prompt:
-                        self.sys_prompt = REACT_PRIVACY_AWARE_EXTERNAL_INTERACTIVE_PROMPT.format(system_description=schema, system="Salesforce instance") # add strategy template and schema description
-                    else:
-                        self.sys_prompt = REACT_EXTERNAL_INTERACTIVE_PROMPT.format(system_description=schema, system="Salesforce instance") # add strategy template and schema description
+                    template = REACT_PRIVACY_AWARE_EXTERNAL_INTERACTIVE_PROMPT if privacy_aware_prompt else REACT_EXTERNAL_INTERACTIVE_PROMPT
         else:
             # act strategy
-            self.sys_prompt = ACT_PROMPT.format(system_description=schema, system="Salesforce instance")
+            template = ACT_PROMPT
+        # add strategy template and schema description; rendered once per process and shared between agents
+        prompt = get_system_prompt(template, schema_obj, system="Salesforce instance")
+        self.base_sys_prompt = prompt.text
+        self.sys_prompt = prompt.text
+        self.sys_prompt_hash = prompt.sha256
         
         self.agent_type = agent_type
         self.original_model_name = model
@@ -53,8 +58,11 @@ class ChatAgent:
         self.max_turns = max_turns
         self.strategy = strategy
         self.info = {}
-        self.usage = {"cost": [], "completion_tokens": [], "prompt_tokens": [], "total_tokens": []}
+        self.usage = {"cost": [], "completion_tokens": [], "prompt_tokens": [], "total_tokens": [], "cache_read_tokens": [], "cache_creation_tokens": []}
         self.provider = provider
+        # messages sent to the model; with a token budget, old observations and turns are elided
+        self.context_budget = context_budget
+        self.context = build_context_manager(context_budget)
        
         if provider == "bedrock" and self.model in BEDROCK_MODELS_MAP:
             os.environ["AWS_REGION_NAME"] = BEDROCK_MODELS_MAP[self.model]["region"]
@@ -71,6 +79,9 @@ class ChatAgent:
             self.model = self.custom_server_config["name"]
         else:
             pass
+        self.rate_limiter = get_rate_limiter(self.provider, self.model)
+        # mark the static system prompt as a cacheable prefix for providers with explicit cache breakpoints
+        self.prompt_caching = prompt_caching and supports_cache_control(self.provider, self.model)
         if self.model in ["o1-mini", "o1-preview", "o1-2024-12-17", "o3-mini-2025-01-31"]:
             import litellm
             
@@ -80,17 +91,7 @@ class ChatAgent:
             # assert self.model in ["o1-mini", "o1-preview", "gpt-4o-2024-08-06", "gpt-3.5-turbo-0125"], "Invalid model name"
     
     def _build_schema(self, schema_obj):
-        object_description = dict()
-        for item in schema_obj:
-            object_description[item["object"]] = "\n".join([f"  - {k}: {v}" for k,v in item["fields"].items()])
-            
-        template = SCHEMA_STRING.format(
-            object_names=", ".join(object_description.keys()),
-            object_fields="\n".join(
-                [f"{obj}\n{fields}" for obj, fields in object_description.items()]
-            )
-        )
-        return template
+        return render_schema(schema_obj)
     
     def _safe_add_message(self, role, content, fallback_content="(empty message)"):
         """Safely add a message, ensuring content is never blank to prevent Bedrock errors."""
@@ -98,141 +99,183 @@ class ChatAgent:
             logger.warning(f"Prevented blank content for role '{role}', using fallback: {fallback_content}")
             content = fallback_content
         self.messages.append({"role": role, "content": content})
+        self.context.append(self.messages[-1])
 
     def reset(self, args):
+        self.sys_prompt = self.base_sys_prompt
         if args["metadata"]["required"]:
             self.sys_prompt += SYSTEM_METADATA.format(system_metadata=args["metadata"]["required"], system="Salesforce instance") # add task/query-specific metadata here
         if self.eval_mode == "aided" and "optional" in args["metadata"]:
             self.sys_prompt += "\n" + args["metadata"]["optional"]
         if self.original_model_name not in ["o1-mini", "o1-preview", "o1-2024-12-17", "deepseek-r1", "o3-mini-2025-01-31", "gemini-2.5-flash-preview-04-17", "gpt-oss-20b"]:
-            self.messages = [{"role": "system", "content": self.sys_prompt.strip()}]
+            self.messages = [{"role": "system", "content": system_content(self.base_sys_prompt, self.sys_prompt, self.prompt_caching)}]
             self._safe_add_message("user", args["query"].strip())
         
         else:
             # No system role for o1-mini and o1-preview
             self.messages = [{"role": "user", "content": self.sys_prompt + "\n\n" + args["query"]}]
-        self.usage = {"cost": [], "completion_tokens": [], "prompt_tokens": [], "total_tokens": []}
+        # the context keeps these head messages and summarizes later turns into the last of them
+        self.context.reset(self.messages)
+        self.usage = {"cost": [], "completion_tokens": [], "prompt_tokens": [], "total_tokens": [], "cache_read_tokens": [], "cache_creation_tokens": []}
         
-    def act(self, env, index=None, temperature=0.0):
-        query, metadata = env.reset(task_index=index)
-        self.reset({"query": query, "metadata": metadata})
-        # print("----")
-        # print(self.sys_prompt)
-        # print("----")
-        # total_cost = 0.0
-        self.info["observation_sizes"] = []
-        done = False
-        reward = 0
+    def _build_completion_kwargs(self, temperature):
+        # turn off thinking for gemini 2.5 flash
+        if self.original_model_name == "gemini-2.5-flash-preview-04-17":
+            thinking = {"type": "disabled", "budget_tokens": 0}
+        elif self.original_model_name == "gemini-2.5-flash-preview-04-17-thinking-4096":
+            thinking = {"type": "enabled", "budget_tokens": 4096}
+        else:
+            thinking = None
         
-        current_agent_turn = 0
-        # for turn_id in range(self.max_turns):
-        while current_agent_turn < self.max_turns:
-            # sleep for rate limiting
-            if self.provider == "openai":
-                # Add delay for OpenAI to avoid rate limits
-                time.sleep(2)
-            elif self.provider == "anthropic":
-                # Add delay for Anthropic to avoid rate limits
-                time.sleep(2)
-            else:
-                # Default delay for other providers
-                time.sleep(5)
-            info = {}
-            current_agent_turn += 1
-            logger.info(f"Agent turn {current_agent_turn} started")
-            # turn off thinking for gemini 2.5 flash
-            if self.original_model_name == "gemini-2.5-flash-preview-04-17":
-                thinking = {"type": "disabled", "budget_tokens": 0}
-            elif self.original_model_name == "gemini-2.5-flash-preview-04-17-thinking-4096":
-                thinking = {"type": "enabled", "budget_tokens": 4096}
-            else:
-                thinking = None
-            
-            # Calculate max_tokens with context window safety
-            input_tokens = estimate_input_tokens(self.messages)
-            max_tokens = get_dynamic_max_tokens(self.original_model_name, input_tokens)
+        # Calculate max_tokens with context window safety
+        input_tokens = self.context.total_tokens
+        max_tokens = get_dynamic_max_tokens(self.original_model_name, input_tokens)
 
 
-            # Base completion arguments (keep existing logic intact)
-            completion_kwargs = {
-                "messages": self.messages,
-                "model": self.model,
-                "temperature": temperature,
-                "max_tokens": max_tokens,
-                "top_p": 1.0 if self.model not in ["o3-mini-2025-01-31"] else None,
-                "thinking": thinking,
-                "additional_drop_params": ["temperature"] if self.original_model_name in ["o1-mini", "o1-preview", "o1-2024-12-17", "deepseek-r1", "o3-mini-2025-01-31"] else []
-            }
-            
-            # Add custom server parameters only if needed
-            if self.provider == "custom_server" and hasattr(self, 'custom_server_config'):
-                completion_kwargs["base_url"] = self.custom_server_config["base_url"]
-                completion_kwargs["api_key"] = self.custom_server_config["api_key"]
-            
-            # Retry with exponential backoff for custom server
-            max_retries = 3 if self.provider == "custom_server" else 1
-            logger.info(f"DEBUG: About to call LiteLLM with {max_retries} max retries, provider: {self.provider}")
-            
-            for retry in range(max_retries):
-                try:
-                    logger.info(f"DEBUG: LiteLLM attempt {retry + 1}/{max_retries}")
-                    res = completion(**completion_kwargs)
-                    logger.info(f"DEBUG: LiteLLM call succeeded on attempt {retry + 1}")
-                    break
-                except Exception as e:
-                    if retry < max_retries - 1:
-                        wait_time = 2 ** retry
-                        logger.info(f"LiteLLM call failed (attempt {retry + 1}/{max_retries}), retrying in {wait_time}s: {e}")
-                        time.sleep(wait_time)
-                    else:
-                        logger.info(f"DEBUG: All retry attempts failed, raising exception: {e}")
-                        raise e
-            
-            
-            message = res.choices[0].message.model_dump()
-            
-            
-            usage = res.usage
+        # Base completion arguments (keep existing logic intact)
+        completion_kwargs = {
+            "messages": self.context.messages,
+            "model": self.model,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": 1.0 if self.model not in ["o3-mini-2025-01-31"] else None,
+            "thinking": thinking,
+            "additional_drop_params": ["temperature"] if self.original_model_name in ["o1-mini", "o1-preview", "o1-2024-12-17", "deepseek-r1", "o3-mini-2025-01-31"] else []
+        }
+        
+        # Add custom server parameters only if needed
+        if self.provider == "custom_server" and hasattr(self, 'custom_server_config'):
+            completion_kwargs["base_url"] = self.custom_server_config["base_url"]
+            completion_kwargs["api_key"] = self.custom_server_config["api_key"]
+        return completion_kwargs
 
-            for key in self.usage.keys():
-                if key != "cost":
-                    self.usage[key].append(usage.get(key, 0))
+    def _max_retries(self):
+        # Retry with exponential backoff for custom server
+        return 3 if self.provider == "custom_server" else 1
 
-            self.usage["cost"].append(res._hidden_params["response_cost"])
-            action = self.message_action_parser(message, self.model)
-            print("User Turn:", env.current_user_turn, "Agent Turn:", current_agent_turn, "Agent:", message["content"].strip())
-            self._safe_add_message("assistant", message["content"].strip())
-            if action is None:
-                self.info["end_reason"] = {
-                    "source": "agent",
-                    "message": "Invalid action",
-                    "content":  message["content"].strip()
-                }
-                info["end_reason"] = self.info["end_reason"]
-                if self.strategy == "react":
-                    self._safe_add_message("user", REACT_RULE_STRING)
-                elif self.strategy == "act":
-                    self._safe_add_message("user", ACT_RULE_STRING)
-                continue
-            obs, reward, done, info = env.step(action)
-            
-            if "observation_size" in info:
-                self.info["observation_sizes"].append(info["observation_size"])
-            if "end_reason" in info: # implies error in query
-                self.info["end_reason"] = info["end_reason"]
-            # reset counter if previous action is respond
-            if action["name"] == "respond":
-                current_agent_turn = 0
-            if done:
-                break
-            elif action["name"] == "execute": # execution results from
-                safe_obs = obs if obs else "(empty)"
-                obs_content = f"Salesforce instance output: {safe_obs}"
-                self._safe_add_message("user", obs_content)
-            elif action["name"] == "respond": # respond to simulated user
-                safe_obs = obs if obs and obs.strip() else "(empty response)"
-                self._safe_add_message("user", safe_obs)
+    def _completion_with_retries(self, completion_kwargs):
+        max_retries = self._max_retries()
+        logger.info(f"DEBUG: About to call LiteLLM with {max_retries} max retries, provider: {self.provider}")
+        cached = cache_lookup(completion_kwargs, self.provider)
+        if cached is not None:
+            logger.info("DEBUG: LiteLLM response served from cache")
+            current_span().set(cache_hit=True)
+            return cached
+        reserved_tokens = self.context.total_tokens
+        retry, rate_limit_retries = 0, 0
+        
+        while True:
+            # Waits only when the provider/model budget is exhausted or after a 429
+            self.rate_limiter.acquire(reserved_tokens)
+            try:
+                logger.info(f"DEBUG: LiteLLM attempt {retry + 1}/{max_retries}")
+                res = completion(**completion_kwargs)
+                logger.info(f"DEBUG: LiteLLM call succeeded on attempt {retry + 1}")
+                self.rate_limiter.on_success()
+                self.rate_limiter.settle(reserved_tokens, res.usage)
+                cache_store(completion_kwargs, res, self.provider)
+                current_span().set(retries=retry + rate_limit_retries)
+                return res
+            except Exception as e:
+                # the failed call used none of its reservation; the retry reserves it again
+                self.rate_limiter.refund(reserved_tokens)
+                if is_rate_limit_error(e) and rate_limit_retries < RATE_LIMIT_RETRIES:
+                    rate_limit_retries += 1
+                    self.rate_limiter.on_rate_limited(retry_after_seconds(e))
+                    continue
+                if retry < max_retries - 1:
+                    wait_time = 2 ** retry
+                    logger.info(f"LiteLLM call failed (attempt {retry + 1}/{max_retries}), retrying in {wait_time}s: {e}")
+                    time.sleep(wait_time)
+                    retry += 1
+                else:
+                    logger.info(f"DEBUG: All retry attempts failed, raising exception: {e}")
+                    raise e
+
+    async def _acompletion_with_retries(self, completion_kwargs):
+        max_retries = self._max_retries()
+        logger.info(f"DEBUG: About to call LiteLLM (async) with {max_retries} max retries, provider: {self.provider}")
+        cached = cache_lookup(completion_kwargs, self.provider)
+        if cached is not None:
+            logger.info("DEBUG: LiteLLM response served from cache")
+            current_span().set(cache_hit=True)
+            return cached
+        reserved_tokens = self.context.total_tokens
+        retry, rate_limit_retries = 0, 0
+        
+        while True:
+            await self.rate_limiter.aacquire(reserved_tokens)
+            try:
+                logger.info(f"DEBUG: LiteLLM attempt {retry + 1}/{max_retries}")
+                res = await acompletion(**completion_kwargs)
+                logger.info(f"DEBUG: LiteLLM call succeeded on attempt {retry + 1}")
+                self.rate_limiter.on_success()
+                self.rate_limiter.settle(reserved_tokens, res.usage)
+                cache_store(completion_kwargs, res, self.provider)
+                current_span().set(retries=retry + rate_limit_retries)
+                return res
+            except Exception as e:
+                # the failed call used none of its reservation; the retry reserves it again
+                self.rate_limiter.refund(reserved_tokens)
+                if is_rate_limit_error(e) and rate_limit_retries < RATE_LIMIT_RETRIES:
+                    rate_limit_retries += 1
+                    self.rate_limiter.on_rate_limited(retry_after_seconds(e))
+                    continue
+                if retry < max_retries - 1:
+                    wait_time = 2 ** retry
+                    logger.info(f"LiteLLM call failed (attempt {retry + 1}/{max_retries}), retrying in {wait_time}s: {e}")
+                    await asyncio.sleep(wait_time)
+                    retry += 1
+                else:
+                    logger.info(f"DEBUG: All retry attempts failed, raising exception: {e}")
+                    raise e
+
+    def _handle_response(self, res, env, current_agent_turn):
+        """Record usage, append the assistant message and parse it into an action (None if invalid)."""
+        message = res.choices[0].message.model_dump()
+        
         
+        usage = res.usage
+
+        for key in ["completion_tokens", "prompt_tokens", "total_tokens"]:
+            self.usage[key].append(usage.get(key, 0))
+        cache_read_tokens, cache_creation_tokens = cache_token_usage(usage)
+        self.usage["cache_read_tokens"].append(cache_read_tokens)
+        self.usage["cache_creation_tokens"].append(cache_creation_tokens)
+
+        self.usage["cost"].append(res._hidden_params["response_cost"])
+        action = self.message_action_parser(message, self.model)
+        print("User Turn:", env.current_user_turn, "Agent Turn:", current_agent_turn, "Agent:", message["content"].strip())
+        self._safe_add_message("assistant", message["content"].strip())
+        if action is None:
+            self.info["end_reason"] = {
+                "source": "agent",
+                "message": "Invalid action",
+                "content":  message["content"].strip()
+            }
+            if self.strategy == "react":
+                self._safe_add_message("user", REACT_RULE_STRING)
+            elif self.strategy == "act":
+                self._safe_add_message("user", ACT_RULE_STRING)
+        return message, action
+
+    def _handle_observation(self, action, obs, done, info):
+        """Record the env step and append its observation to the conversation."""
+        if "observation_size" in info:
+            self.info["observation_sizes"].append(info["observation_size"])
+        if "end_reason" in info: # implies error in query
+            self.info["end_reason"] = info["end_reason"]
+        if done:
+            return
+        elif action["name"] == "execute": # execution results from
+            safe_obs = obs if obs else "(empty)"
+            obs_content = f"{OBSERVATION_PREFIX}{safe_obs}"
+            self._safe_add_message("user", obs_content)
+        elif action["name"] == "respond": # respond to simulated user
+            safe_obs = obs if obs and obs.strip() else "(empty response)"
+            self._safe_add_message("user", safe_obs)
+
+    def _finalize(self, env, done, info, message, current_agent_turn):
         # Here when either max_turns is reached or submitted
         if not done: 
             if "end_reason" not in info: # no error in last query
@@ -244,6 +287,82 @@ class ChatAgent:
         self.info["usage"] = self.usage
         self.info["total_cost"] = sum(cost for cost in self.usage["cost"] if cost is not None)
         self.info["num_turns"] = (env.current_user_turn, current_agent_turn + 1)
+        if self.context_budget is not None:
+            self.info["context"] = self.context.stats()
+
+    def act(self, env, index=None, temperature=0.0):
+        with trace("task", task_index=index, model=self.model, strategy=self.strategy) as task_trace:
+            reward = self._act(env, index, temperature)
+        self.info["trace"] = task_trace.summary()
+        return reward
+
+    def _act(self, env, index, temperature):
+        query, metadata = env.reset(task_index=index)
+        self.reset({"query": query, "metadata": metadata})
+        self.info["observation_sizes"] = []
+        done = False
+        reward = 0
+        
+        current_agent_turn = 0
+        while current_agent_turn < self.max_turns:
+            info = {}
+            current_agent_turn += 1
+            logger.info(f"Agent turn {current_agent_turn} started")
+            with span("turn", turn=current_agent_turn):
+                with span("llm", model=self.model) as llm_span:
+                    res = self._completion_with_retries(self._build_completion_kwargs(temperature))
+                    record_usage(llm_span, res)
+                message, action = self._handle_response(res, env, current_agent_turn)
+                if action is None:
+                    info["end_reason"] = self.info["end_reason"]
+                    continue
+                obs, reward, done, info = env.step(action)
+                # reset counter if previous action is respond
+                if action["name"] == "respond":
+                    current_agent_turn = 0
+                self._handle_observation(action, obs, done, info)
+                if done:
+                    break
+        
+        self._finalize(env, done, info, message, current_agent_turn)
+        return reward
+
+    async def aact(self, env, index=None, temperature=0.0):
+        """Async variant of `act` that awaits `litellm.acompletion` and the env's `areset`/`astep`."""
+        with trace("task", task_index=index, model=self.model, strategy=self.strategy) as task_trace:
+            reward = await self._aact(env, index, temperature)
+        self.info["trace"] = task_trace.summary()
+        return reward
+
+    async def _aact(self, env, index, temperature):
+        query, metadata = await env.areset(task_index=index)
+        self.reset({"query": query, "metadata": metadata})
+        self.info["observation_sizes"] = []
+        done = False
+        reward = 0
+        
+        current_agent_turn = 0
+        while current_agent_turn < self.max_turns:
+            info = {}
+            current_agent_turn += 1
+            logger.info(f"Agent turn {current_agent_turn} started")
+            with span("turn", turn=current_agent_turn):
+                with span("llm", model=self.model) as llm_span:
+                    res = await self._acompletion_with_retries(self._build_completion_kwargs(temperature))
+                    record_usage(llm_span, res)
+                message, action = self._handle_response(res, env, current_agent_turn)
+                if action is None:
+                    info["end_reason"] = self.info["end_reason"]
+                    continue
+                obs, reward, done, info = await env.astep(action)
+                # reset counter if previous action is respond
+                if action["name"] == "respond":
+                    current_agent_turn = 0
+                self._handle_observation(action, obs, done, info)
+                if done:
+                    break
+        
+        self._finalize(env, done, info, message, current_agent_turn)
         return reward
 
     def get_messages(self) -> List[Dict[str, str]]:
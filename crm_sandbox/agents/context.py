@@ -0,0 +1,163 @@
+from typing import Any, Dict, List, Optional
+
+from crm_sandbox.agents.utils import estimate_input_tokens, parse_wrapped_response
+
+OBSERVATION_PREFIX = "Salesforce instance output: "
+# Characters of each action result kept in the summary of old turns
+SUMMARY_CHARS = 100
+
+
+def message_tokens(message: Dict[str, Any]) -> int:
+    return estimate_input_tokens([message])
+
+
+class ContextManager(object):
+    """
+    The messages sent to the model on each turn, with a running token estimate that is updated
+    as messages are appended instead of re-scanning the conversation. This base class keeps every
+    message; subclasses shrink the context when it grows past a budget. The agent keeps the full,
+    unmodified conversation for its trajectory.
+    """
+    def __init__(self):
+        super().__init__()
+        self.messages: List[Dict[str, Any]] = []
+        self.token_counts: List[int] = []
+        self.total_tokens = 0
+
+    def reset(self, messages: List[Dict[str, Any]]):
+        self.messages = []
+        self.token_counts = []
+        self.total_tokens = 0
+        for message in messages:
+            self.append(message)
+
+    def append(self, message: Dict[str, Any]):
+        self.messages.append(message)
+        self.token_counts.append(message_tokens(message))
+        self.total_tokens += self.token_counts[-1]
+        self.fit()
+
+    def _replace(self, index: int, message: Dict[str, Any]):
+        tokens = message_tokens(message)
+        self.total_tokens += tokens - self.token_counts[index]
+        self.messages[index] = message
+        self.token_counts[index] = tokens
+
+    def fit(self):
+        """Shrink the context to its budget; a no-op without one."""
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"context_tokens": self.total_tokens, "context_messages": len(self.messages)}
+
+
+class SlidingWindowContext(ContextManager):
+    """
+    Keeps the context under `budget` estimated tokens. Once over budget, it first truncates old
+    `execute` observations to a short preview and keeps the latest `keep_observations` results in
+    full. If that is not enough, it folds the oldest turns into a one-line-per-turn summary appended
+    to the task query, so user and assistant messages still alternate. The messages passed to
+    `reset` are the head of the context: the system prompt and the task query, or only the query
+    for models without a system role. The head (apart from the summary) and the latest turn are
+    never touched, so the context can still exceed a budget that is too small for them.
+    """
+    def __init__(self, budget: int, keep_observations: int = 2, preview_chars: int = 300):
+        super().__init__()
+        self.budget = budget
+        self.keep_observations = keep_observations
+        self.preview_chars = preview_chars
+        self.elided_observations = 0
+        self.summarized_turns = 0
+        self._query_message: Optional[Dict[str, Any]] = None
+        self._summary: List[str] = []
+        # number of messages before the first agent turn; the last of them is the task query
+        self._head = 0
+        # index of the oldest observation that may still be in full
+        self._next_elision = 0
+
+    def reset(self, messages: List[Dict[str, Any]]):
+        self.elided_observations = 0
+        self.summarized_turns = 0
+        self._head = len(messages)
+        self._query_message = messages[-1] if messages else None
+        self._summary = []
+        self._next_elision = self._head
+        super().reset(messages)
+
+    @staticmethod
+    def _is_observation(message: Dict[str, Any]) -> bool:
+        return message["role"] == "user" and isinstance(message["content"], str) and message["content"].startswith(OBSERVATION_PREFIX)
+
+    def _elide(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        output = message["content"][len(OBSERVATION_PREFIX):]
+        if len(output) <= self.preview_chars:
+            return message
+        preview = output[:self.preview_chars]
+        return {
+            "role": message["role"],
+            "content": f"{OBSERVATION_PREFIX}{preview}... [{len(output) - self.preview_chars} more characters elided to save context; re-run the query if you need them]",
+        }
+
+    def _elide_observations(self):
+        observations = [i for i in range(self._next_elision, len(self.messages)) if self._is_observation(self.messages[i])]
+        for index in observations[:max(len(observations) - self.keep_observations, 0)]:
+            if self.total_tokens <= self.budget:
+                return
+            elided = self._elide(self.messages[index])
+            if elided is not self.messages[index]:
+                self._replace(index, elided)
+                self.elided_observations += 1
+            self._next_elision = index + 1
+
+    def _summarize_turn(self, assistant: Dict[str, Any], user: Dict[str, Any]) -> str:
+        content = assistant["content"] if isinstance(assistant["content"], str) else ""
+        for tag in ["execute", "respond"]:
+            action = parse_wrapped_response(rf"<{tag}>(.*?)</{tag}>", content).strip()
+            if action:
+                break
+        else:
+            tag, action = "invalid", content.strip()[:self.preview_chars]
+        result = user["content"] if isinstance(user["content"], str) else ""
+        if result.startswith(OBSERVATION_PREFIX):
+            result = result[len(OBSERVATION_PREFIX):]
+        result = " ".join(result.split())
+        if len(result) > SUMMARY_CHARS:
+            result = result[:SUMMARY_CHARS] + "..."
+        return f"- {tag}: {' '.join(action.split())} -> {result}"
+
+    def _summarize_turns(self):
+        summarized = self.summarized_turns
+        # keep at least the latest assistant/user pair in full
+        while self.total_tokens > self.budget and len(self.messages) >= self._head + 4:
+            assistant, user = self.messages[self._head], self.messages[self._head + 1]
+            self._summary.append(self._summarize_turn(assistant, user))
+            for index in [self._head + 1, self._head]:
+                self.total_tokens -= self.token_counts.pop(index)
+                self.messages.pop(index)
+            self._next_elision = max(self._next_elision - 2, self._head)
+            self.summarized_turns += 1
+        if self.summarized_turns > summarized:
+            summary = "\n".join(["", "", "Summary of your earlier turns (their full outputs were removed to save context):"] + self._summary)
+            self._replace(self._head - 1, {"role": self._query_message["role"], "content": self._query_message["content"] + summary})
+
+    def fit(self):
+        if self.total_tokens <= self.budget or self._query_message is None:
+            return
+        self._elide_observations()
+        if self.total_tokens > self.budget:
+            self._summarize_turns()
+
+    def stats(self) -> Dict[str, Any]:
+        stats = super().stats()
+        stats.update({
+            "budget": self.budget,
+            "elided_observations": self.elided_observations,
+            "summarized_turns": self.summarized_turns,
+        })
+        return stats
+
+
+def build_context_manager(budget: Optional[int] = None, **kwargs) -> ContextManager:
+    if budget is None:
+        return ContextManager()
+    return SlidingWindowContext(budget, **kwargs)
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import logging
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+CACHE_MODES = ["bypass", "readonly", "readwrite"]
+DEFAULT_CACHE_PATH = ".cache/llm_cache.sqlite"
+
+# Request arguments that never affect the completion and must not leak into the cache key
+_EXCLUDED_KEY_ARGS = {"api_key"}
+
+
+class LLMCache(object):
+    """
+    Persistent, content-addressed cache of LLM completions backed by SQLite.
+
+    Entries are keyed by a SHA-256 of the provider and the request arguments (model, messages,
+    tools and sampling parameters). Modes:
+    - "readwrite": serve hits and store misses
+    - "readonly": serve hits, never write (e.g. replaying a shared cache)
+    - "bypass": always call the provider
+    Entries older than `max_age_days`, and the least recently used entries beyond
+    `max_entries`, are evicted.
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        mode: str = "readwrite",
+        max_entries: Optional[int] = None,
+        max_age_days: Optional[float] = None,
+        evict_every: int = 100,
+    ) -> None:
+        super().__init__()
+        assert mode in CACHE_MODES, f"Invalid cache mode: {mode}"
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        if mode != "bypass":
+            if os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Shared by worker threads (guarded by the lock); SQLite handles locking between processes
+            self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS completions (
+                    key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    response_cost REAL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    hit_count INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            self._conn.commit()
+            if mode == "readwrite":
+                self.evict()
+
+    @staticmethod
+    def make_key(request: Dict[str, Any], provider: Optional[str] = None) -> str:
+        payload = {k: v for k, v in request.items() if k not in _EXCLUDED_KEY_ARGS and v is not None}
+        payload["__provider__"] = provider
+        blob = json.dumps(payload, sort_keys=True, default=str, ensure_ascii=False)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        if self._conn is None:
+            return None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, response_cost FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if self.mode == "readwrite":
+                self._conn.execute(
+                    "UPDATE completions SET accessed_at = ?, hit_count = hit_count + 1 WHERE key = ?",
+                    (time.time(), key),
+                )
+                self._conn.commit()
+        return _response_from_cache(json.loads(row[0]), row[1])
+
+    def put(self, key: str, response) -> None:
+        if self._conn is None or self.mode != "readwrite":
+            return
+        try:
+            blob = json.dumps(response.model_dump(), default=str)
+        except Exception as e:
+            logger.warning(f"Not caching unserializable LLM response: {e}")
+            return
+        cost = getattr(response, "_hidden_params", {}).get("response_cost")
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, response, response_cost, created_at, accessed_at, hit_count) "
+                "VALUES (?, ?, ?, ?, ?, 0)",
+                (key, blob, cost, now, now),
+            )
+            self._conn.commit()
+            self.writes += 1
+            should_evict = self.evict_every and self.writes % self.evict_every == 0
+        if should_evict:
+            self.evict()
+
+    def evict(self) -> int:
+        """Apply age- and size-based eviction; returns the number of removed entries."""
+        if self._conn is None or self.mode != "readwrite":
+            return 0
+        removed = 0
+        with self._lock:
+            if self.max_age_days is not None:
+                cutoff = time.time() - self.max_age_days * 86400
+                removed += self._conn.execute("DELETE FROM completions WHERE created_at < ?", (cutoff,)).rowcount
+            if self.max_entries is not None:
+                removed += self._conn.execute(
+                    "DELETE FROM completions WHERE key NOT IN "
+                    "(SELECT key FROM completions ORDER BY accessed_at DESC LIMIT ?)",
+                    (self.max_entries,),
+                ).rowcount
+            self._conn.commit()
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {"mode": self.mode, "hits": self.hits, "misses": self.misses, "writes": self.writes}
+        if self._conn is not None:
+            with self._lock:
+                stats["entries"] = self._conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+        return stats
+
+    def close(self) -> None:
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+
+def _response_from_cache(data: Dict[str, Any], response_cost: Optional[float]):
+    from litellm import ModelResponse
+    response = ModelResponse(**data)
+    # Cache hits are free; the original cost is kept for reference
+    response._hidden_params["response_cost"] = 0.0
+    response._hidden_params["original_response_cost"] = response_cost
+    response._hidden_params["cache_hit"] = True
+    return response
+
+
+_cache: Optional[LLMCache] = None
+
+
+def configure_llm_cache(
+    path: str = DEFAULT_CACHE_PATH,
+    mode: str = "readwrite",
+    max_entries: Optional[int] = None,
+    max_age_days: Optional[float] = None,
+) -> LLMCache:
+    """Install the process-wide cache used by agents, the user simulator and the evaluator."""
+    global _cache
+    if _cache is not None:
+        _cache.close()
+    _cache = LLMCache(path=path, mode=mode, max_entries=max_entries, max_age_days=max_age_days)
+    return _cache
+
+
+def get_llm_cache() -> Optional[LLMCache]:
+    return _cache
+
+
+def cache_lookup(request: Dict[str, Any], provider: Optional[str] = None):
+    """Return a cached response for the completion request, or None (also when caching is off)."""
+    if _cache is None or _cache.mode == "bypass":
+        return None
+    return _cache.get(LLMCache.make_key(request, provider))
+
+
+def cache_store(request: Dict[str, Any], response, provider: Optional[str] = None) -> None:
+    if _cache is None or _cache.mode != "readwrite":
+        return
+    _cache.put(LLMCache.make_key(request, provider), response)
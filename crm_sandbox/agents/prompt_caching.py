@@ -0,0 +1,55 @@
+from typing import Any, Dict, List, Tuple, Union
+
+# Providers that take explicit `cache_control` breakpoints on message content blocks. OpenAI
+# (and the Azure/custom servers in front of it) cache prompt prefixes automatically, so the only
+# requirement there is that the static system prompt comes first, which it always does.
+CACHE_CONTROL_PROVIDERS = ["anthropic", "bedrock", "vertex_ai"]
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+def supports_cache_control(provider: str, model: str) -> bool:
+    """Whether `cache_control` breakpoints are honoured for this provider/model pair."""
+    if provider == "anthropic":
+        return True
+    if provider in CACHE_CONTROL_PROVIDERS or "vertex" in provider:
+        # Bedrock and Vertex only support prompt caching for Claude models
+        return "claude" in model or "anthropic" in model
+    return False
+
+
+def system_content(static_prefix: str, text: str, cache: bool) -> Union[str, List[Dict[str, Any]]]:
+    """
+    Content of the system message. `text` is the full, task-specific system prompt and starts with
+    `static_prefix`, the prompt shared by every task. When `cache` is set, the prefix becomes its own
+    text block with a cache breakpoint, so that provider caches it once and only the task metadata
+    after it is processed on each call. The concatenated blocks equal `text.strip()`.
+    """
+    content = text.strip()
+    if not cache or not text.startswith(static_prefix):
+        return content
+    split = len(static_prefix) - (len(text) - len(text.lstrip()))
+    prefix, suffix = content[:split], content[split:]
+    if not prefix:
+        return content
+    blocks = [{"type": "text", "text": prefix, "cache_control": dict(CACHE_CONTROL)}]
+    if suffix:
+        blocks.append({"type": "text", "text": suffix})
+    return blocks
+
+
+def cache_token_usage(usage) -> Tuple[int, int]:
+    """
+    Return (cache read tokens, cache write tokens) of a LiteLLM usage object. Anthropic and Bedrock
+    report both; OpenAI only reports reads, as `prompt_tokens_details.cached_tokens`.
+    """
+    if usage is None:
+        return 0, 0
+    read = usage.get("cache_read_input_tokens") or 0
+    if not read:
+        details = usage.get("prompt_tokens_details")
+        if isinstance(details, dict):
+            read = details.get("cached_tokens") or 0
+        elif details is not None:
+            read = getattr(details, "cached_tokens", None) or 0
+    write = usage.get("cache_creation_input_tokens") or 0
+    return read, write
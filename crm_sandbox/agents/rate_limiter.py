@@ -0,0 +1,266 @@
+import asyncio
+import threading
+import time
+import logging
+from typing import Dict, Optional, Tuple
+
+from crm_sandbox.agents.utils import BEDROCK_MODELS_MAP, TOGETHER_MODELS_MAP, VERTEX_MODELS_MAP, ANTHROPIC_MODELS_MAP, CUSTOM_SERVER_MODELS_MAP
+
+logger = logging.getLogger(__name__)
+
+# Default (requests per minute, tokens per minute) budgets per provider; None means unlimited.
+# A "rpm"/"tpm" key on a *_MODELS_MAP entry overrides the provider default for that model.
+DEFAULT_RATE_LIMITS = {
+    "openai": (500, 200000),
+    "anthropic": (50, 40000),
+    "bedrock": (60, None),
+    "together_ai": (60, None),
+    "vertex_ai": (60, None),
+    "custom_server": (60, None),
+}
+FALLBACK_RATE_LIMIT = (30, None)
+# 429 responses retried (after the limiter's backoff) before the error reaches the caller
+RATE_LIMIT_RETRIES = 5
+
+MODELS_MAPS = {
+    "bedrock": BEDROCK_MODELS_MAP,
+    "together_ai": TOGETHER_MODELS_MAP,
+    "vertex_ai": VERTEX_MODELS_MAP,
+    "anthropic": ANTHROPIC_MODELS_MAP,
+    "custom_server": CUSTOM_SERVER_MODELS_MAP,
+}
+
+
+class TokenBucket(object):
+    """
+    Reservation-based token bucket refilled continuously at `rate_per_minute`.
+
+    `reserve` never blocks: it debits the bucket (which may go negative) and returns how long
+    the caller has to wait before its reservation is covered.
+    """
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None) -> None:
+        super().__init__()
+        self.rate_per_minute = float(rate_per_minute)
+        self.capacity = float(capacity if capacity is not None else rate_per_minute)
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self, now: float, scale: float) -> None:
+        rate = self.rate_per_minute * scale / 60.0
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * rate)
+        self.updated_at = now
+
+    def reserve(self, amount: float, now: float, scale: float = 1.0) -> float:
+        self._refill(now, scale)
+        # Requests larger than the bucket would otherwise wait forever
+        self.level -= min(amount, self.capacity)
+        if self.level >= 0:
+            return 0.0
+        return -self.level / (self.rate_per_minute * scale / 60.0)
+
+    def debit(self, amount: float, now: float, scale: float = 1.0) -> None:
+        self._refill(now, scale)
+        self.level -= amount
+
+
+class RateLimiter(object):
+    """
+    RPM/TPM limiter for one provider/model.
+
+    Calls pass immediately while there is budget left. On a 429 the effective rate is halved and
+    new calls are held back for a backoff period; each successful call then restores a fraction
+    of the rate until the configured budget is reached again.
+    """
+
+    def __init__(
+        self,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        min_scale: float = 0.05,
+        recovery_step: float = 0.05,
+        max_backoff: float = 60.0,
+    ) -> None:
+        super().__init__()
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.scale = 1.0
+        self.min_scale = min_scale
+        self.recovery_step = recovery_step
+        self.max_backoff = max_backoff
+        self.blocked_until = 0.0
+        self.consecutive_rate_limits = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens: int = 0) -> float:
+        """Reserve one request and `tokens` tokens; returns the number of seconds to wait."""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now)
+            if self.requests is not None:
+                wait = max(wait, self.requests.reserve(1, now, self.scale))
+            if self.tokens is not None and tokens:
+                wait = max(wait, self.tokens.reserve(tokens, now, self.scale))
+            return wait
+
+    def acquire(self, tokens: int = 0) -> float:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            logger.info(f"Rate limiter: waiting {wait:.2f}s")
+            time.sleep(wait)
+        return wait
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        wait = self.reserve(tokens)
+        if wait > 0:
+            logger.info(f"Rate limiter: waiting {wait:.2f}s")
+            await asyncio.sleep(wait)
+        return wait
+
+    def record_tokens(self, tokens: int) -> None:
+        """Debit tokens that were not reserved up front (e.g. completion tokens reported after a call)."""
+        if self.tokens is None or tokens <= 0:
+            return
+        with self._lock:
+            self.tokens.debit(tokens, time.monotonic(), self.scale)
+
+    def refund(self, tokens: int) -> None:
+        """Return the tokens reserved for a call that failed, so a retry does not pay for them twice."""
+        if self.tokens is None or tokens <= 0:
+            return
+        with self._lock:
+            self.tokens.debit(-min(tokens, self.tokens.capacity), time.monotonic(), self.scale)
+            self.tokens.level = min(self.tokens.level, self.tokens.capacity)
+
+    def settle(self, reserved_tokens: int, usage) -> None:
+        """
+        Debit the tokens a call actually used beyond what was reserved before it. Prompt cache reads
+        (`cache_read_input_tokens`, reported by Anthropic and Bedrock) do not count toward those
+        providers' input-token limits, so their share of the reservation is refunded.
+        """
+        if usage is None:
+            return
+        used = usage.get("total_tokens", 0) or 0
+        cache_read = usage.get("cache_read_input_tokens", 0) or 0
+        if cache_read:
+            self.refund(min(cache_read, reserved_tokens))
+            used, reserved_tokens = used - cache_read, max(reserved_tokens - cache_read, 0)
+        self.record_tokens(used - reserved_tokens)
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.consecutive_rate_limits = 0
+            self.scale = min(1.0, self.scale + self.recovery_step)
+
+    def on_rate_limited(self, retry_after: Optional[float] = None) -> float:
+        """Shrink the rate after a 429 and return the backoff (seconds) applied to new calls."""
+        with self._lock:
+            self.consecutive_rate_limits += 1
+            self.scale = max(self.min_scale, self.scale * 0.5)
+            backoff = retry_after if retry_after else min(self.max_backoff, 2 ** self.consecutive_rate_limits)
+            self.blocked_until = max(self.blocked_until, time.monotonic() + backoff)
+            logger.info(f"Rate limited: scaling rate to {self.scale:.2f} and backing off {backoff:.1f}s")
+            return backoff
+
+
+_limiters: Dict[Tuple[str, str], RateLimiter] = {}
+_overrides: Dict[Tuple[str, str], Tuple[Optional[float], Optional[float]]] = {}
+_registry_lock = threading.Lock()
+
+
+def _provider_key(provider: str) -> str:
+    return "vertex_ai" if provider and "vertex" in provider else provider
+
+
+def resolve_model_name(provider: str, model: str) -> str:
+    """Map a CLI model name to the provider model name used in the *_MODELS_MAP tables."""
+    models_map = MODELS_MAPS.get(_provider_key(provider), {})
+    if model in models_map:
+        return models_map[model]["name"]
+    return model
+
+
+def _budget(provider: str, model: str) -> Tuple[Optional[float], Optional[float]]:
+    key = (_provider_key(provider), model)
+    if key in _overrides:
+        return _overrides[key]
+    rpm, tpm = DEFAULT_RATE_LIMITS.get(key[0], FALLBACK_RATE_LIMIT)
+    for entry in MODELS_MAPS.get(key[0], {}).values():
+        if entry["name"] == model:
+            rpm, tpm = entry.get("rpm", rpm), entry.get("tpm", tpm)
+            break
+    return rpm, tpm
+
+
+def configure_rate_limits(provider: str, model: str, rpm: Optional[float] = None, tpm: Optional[float] = None) -> None:
+    """Override the RPM/TPM budget of a provider/model; unset values keep their defaults."""
+    model = resolve_model_name(provider, model)
+    default_rpm, default_tpm = _budget(provider, model)
+    key = (_provider_key(provider), model)
+    with _registry_lock:
+        _overrides[key] = (rpm if rpm is not None else default_rpm, tpm if tpm is not None else default_tpm)
+        _limiters.pop(key, None)
+
+
+def get_rate_limiter(provider: str, model: str) -> RateLimiter:
+    """Return the process-wide limiter shared by every agent, evaluator and user simulator of a provider/model."""
+    model = resolve_model_name(provider, model)
+    key = (_provider_key(provider), model)
+    with _registry_lock:
+        if key not in _limiters:
+            rpm, tpm = _budget(provider, model)
+            _limiters[key] = RateLimiter(rpm=rpm, tpm=tpm)
+        return _limiters[key]
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    if getattr(e, "status_code", None) == 429:
+        return True
+    message = str(e)
+    return type(e).__name__ == "RateLimitError" or ("429" in message[:200] and "rate" in message.lower())
+
+
+def retry_after_seconds(e: Exception) -> Optional[float]:
+    response = getattr(e, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def limited_completion(rate_limiter: RateLimiter, completion, kwargs: Dict, reserved_tokens: int = 0):
+    """
+    `completion(**kwargs)` within the budget of `rate_limiter`, reserving `reserved_tokens` input
+    tokens. A 429 slows the limiter down and is retried up to RATE_LIMIT_RETRIES times.
+    """
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        rate_limiter.acquire(reserved_tokens)
+        try:
+            res = completion(**kwargs)
+        except Exception as e:
+            rate_limiter.refund(reserved_tokens)
+            if is_rate_limit_error(e) and attempt < RATE_LIMIT_RETRIES:
+                rate_limiter.on_rate_limited(retry_after_seconds(e))
+                continue
+            raise
+        rate_limiter.on_success()
+        rate_limiter.settle(reserved_tokens, getattr(res, "usage", None))
+        return res
+
+
+async def alimited_completion(rate_limiter: RateLimiter, acompletion, kwargs: Dict, reserved_tokens: int = 0):
+    """Async variant of `limited_completion`."""
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        await rate_limiter.aacquire(reserved_tokens)
+        try:
+            res = await acompletion(**kwargs)
+        except Exception as e:
+            rate_limiter.refund(reserved_tokens)
+            if is_rate_limit_error(e) and attempt < RATE_LIMIT_RETRIES:
+                rate_limiter.on_rate_limited(retry_after_seconds(e))
+                continue
+            raise
+        rate_limiter.on_success()
+        rate_limiter.settle(reserved_tokens, getattr(res, "usage", None))
+        return res
@@ -0,0 +1,71 @@
+import hashlib
+import json
+import sys
+import threading
+from collections import namedtuple
+from typing import Any, Dict, List, Optional, Tuple
+
+from crm_sandbox.agents.prompts import SCHEMA_STRING
+
+# A rendered system prompt and the sha256 of its text, a stable key for LLM and provider prompt caches
+SchemaPrompt = namedtuple("SchemaPrompt", ["text", "sha256"])
+
+_lock = threading.Lock()
+# id(schema_obj) -> (schema_obj, content hash); the reference keeps the id from being reused
+_schema_keys: Dict[int, Tuple[Any, str]] = {}
+_schema_texts: Dict[str, str] = {}
+_prompts: Dict[tuple, SchemaPrompt] = {}
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def schema_key(schema_obj: List[Dict]) -> str:
+    """
+    Content hash of a schema. The schema lists in `crm_sandbox.data.assets` are shared objects,
+    so after the first call the lookup is by identity and the schema is not serialized again.
+    Schemas are treated as immutable once registered.
+    """
+    entry = _schema_keys.get(id(schema_obj))
+    if entry is not None and entry[0] is schema_obj:
+        return entry[1]
+    key = _sha256(json.dumps(schema_obj, sort_keys=True, default=str))
+    with _lock:
+        _schema_keys[id(schema_obj)] = (schema_obj, key)
+    return key
+
+
+def render_schema(schema_obj: List[Dict]) -> str:
+    """Return the object/field description of a schema, rendered once per process."""
+    key = schema_key(schema_obj)
+    text = _schema_texts.get(key)
+    if text is None:
+        object_description = dict()
+        for item in schema_obj:
+            object_description[item["object"]] = "\n".join([f"  - {k}: {v}" for k,v in item["fields"].items()])
+        text = sys.intern(SCHEMA_STRING.format(
+            object_names=", ".join(object_description.keys()),
+            object_fields="\n".join(
+                [f"{obj}\n{fields}" for obj, fields in object_description.items()]
+            )
+        ))
+        with _lock:
+            text = _schema_texts.setdefault(key, text)
+    return text
+
+
+def get_system_prompt(template: str, schema_obj: Optional[List[Dict]] = None, **fields) -> SchemaPrompt:
+    """
+    Format `template` with `fields` (and the schema description as `system_description` when a
+    schema is given). Each variant is rendered once per process and shared by all agents.
+    """
+    key = (template, schema_key(schema_obj) if schema_obj is not None else None, tuple(sorted(fields.items())))
+    prompt = _prompts.get(key)
+    if prompt is None:
+        if schema_obj is not None:
+            fields["system_description"] = render_schema(schema_obj)
+        text = sys.intern(template.format(**fields))
+        with _lock:
+            prompt = _prompts.setdefault(key, SchemaPrompt(text, _sha256(text)))
+    return prompt
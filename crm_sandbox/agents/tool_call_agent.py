@@ -4,27 +4,28 @@ import os
 import litellm
 # from litellm import completion
 from typing import Dict, List, Any
-import re, traceback, ast, time
+import re, traceback, ast
 from openai import OpenAI
 from tenacity import retry, stop_after_attempt, wait_random_exponential
-from crm_sandbox.agents.prompts import SCHEMA_STRING, SYSTEM_METADATA, NATIVE_FC_PROMPT, CUSTOM_FC_PROMPT, FC_RULE_STRING, FC_FLEX_PROMPT
-from crm_sandbox.agents.utils import parse_wrapped_response, BEDROCK_MODELS_MAP, TOGETHER_MODELS_MAP, VERTEX_MODELS_MAP, ANTHROPIC_MODELS_MAP, CUSTOM_SERVER_MODELS_MAP, fc_prompt_builder
+from crm_sandbox.agents.prompts import SYSTEM_METADATA, NATIVE_FC_PROMPT, CUSTOM_FC_PROMPT, FC_RULE_STRING, FC_FLEX_PROMPT
+from crm_sandbox.agents.utils import parse_wrapped_response, BEDROCK_MODELS_MAP, TOGETHER_MODELS_MAP, VERTEX_MODELS_MAP, ANTHROPIC_MODELS_MAP, CUSTOM_SERVER_MODELS_MAP, fc_prompt_builder, estimate_input_tokens
+from crm_sandbox.agents.rate_limiter import get_rate_limiter, is_rate_limit_error, retry_after_seconds
+from crm_sandbox.agents.llm_cache import cache_lookup, cache_store
+from crm_sandbox.agents.schema_prompts import get_system_prompt, render_schema
+from crm_sandbox.agents.prompt_caching import supports_cache_control, system_content, cache_token_usage
+from crm_sandbox.agents.tracing import trace, span, current_span, record_usage
 
 
 from dotenv import load_dotenv
 load_dotenv()
 
-# Patch: Use litellm for Bedrock with bearer token and region, matching MultiProviderClient _generate_aws_bedrock
-@retry(wait=wait_random_exponential(multiplier=1, max=40), stop=stop_after_attempt(10))
-def chat_completion_request(
+def _completion_request_kwargs(
     messages,
     model,
     tools=None,
-    temperature: float = 0.0,
-    top_p=1.0,
-    max_tokens=3500,
     additional_drop_params=[]
 ):
+    """Build the litellm.completion kwargs shared by the sync and async completion requests."""
     # Handle custom server models with custom API base and key
     if model.startswith("openai/") and any(model.endswith(custom_model) for custom_model in CUSTOM_SERVER_MODELS_MAP.keys()):
         # Extract the actual model name from the openai/ prefix
@@ -41,7 +42,7 @@ def chat_completion_request(
             ]
             max_tokens_value = 50000 if model in high_token_models else 3500
             
-            res = litellm.completion(
+            return dict(
                 messages=messages,
                 model=model,
                 temperature=0.0,
@@ -52,7 +53,6 @@ def chat_completion_request(
                 api_key=custom_config["api_key"],
                 additional_drop_params=additional_drop_params
             )
-            return res
     
     # If using Bedrock and bearer token, set env vars for litellm
     if (model.startswith("meta.llama3") or model.startswith("us.meta.llama")) and os.environ.get("AWS_BEARER_TOKEN_BEDROCK") and os.environ.get("AWS_REGION_NAME"):
@@ -79,7 +79,7 @@ def chat_completion_request(
     ]
     max_tokens_value = 50000 if model in high_token_models else 3500
     
-    res = litellm.completion(
+    return dict(
         messages=messages,
         model=model,
         temperature=0.0,
@@ -88,27 +88,105 @@ def chat_completion_request(
         tools=tools if "llama" not in model else None, ## llama tool_calling through prompt
         additional_drop_params=["temperature", "top_p"] if model in ["o1-mini", "o1-preview", "o1-2024-12-17"] else []
     )
+
+# Patch: Use litellm for Bedrock with bearer token and region, matching MultiProviderClient _generate_aws_bedrock
+@retry(wait=wait_random_exponential(multiplier=1, max=40), stop=stop_after_attempt(10))
+def chat_completion_request(
+    messages,
+    model,
+    tools=None,
+    temperature: float = 0.0,
+    top_p=1.0,
+    max_tokens=3500,
+    additional_drop_params=[],
+    rate_limiter=None,
+    provider=None
+):
+    kwargs = _completion_request_kwargs(messages, model, tools, additional_drop_params)
+    # one call per tenacity attempt
+    current_span().add("attempts")
+    res = cache_lookup(kwargs, provider)
+    if res is not None:
+        current_span().set(cache_hit=True)
+        return res
+    if rate_limiter is None:
+        res = litellm.completion(**kwargs)
+        cache_store(kwargs, res, provider)
+        return res
+    reserved_tokens = estimate_input_tokens(messages)
+    rate_limiter.acquire(reserved_tokens)
+    try:
+        res = litellm.completion(**kwargs)
+    except Exception as e:
+        # Slow the shared limiter down before tenacity retries the call, which reserves its tokens again
+        rate_limiter.refund(reserved_tokens)
+        if is_rate_limit_error(e):
+            rate_limiter.on_rate_limited(retry_after_seconds(e))
+        raise
+    rate_limiter.on_success()
+    rate_limiter.settle(reserved_tokens, res.usage)
+    cache_store(kwargs, res, provider)
+    return res
+
+@retry(wait=wait_random_exponential(multiplier=1, max=40), stop=stop_after_attempt(10))
+async def achat_completion_request(
+    messages,
+    model,
+    tools=None,
+    temperature: float = 0.0,
+    top_p=1.0,
+    max_tokens=3500,
+    additional_drop_params=[],
+    rate_limiter=None,
+    provider=None
+):
+    kwargs = _completion_request_kwargs(messages, model, tools, additional_drop_params)
+    # one call per tenacity attempt
+    current_span().add("attempts")
+    res = cache_lookup(kwargs, provider)
+    if res is not None:
+        current_span().set(cache_hit=True)
+        return res
+    if rate_limiter is None:
+        res = await litellm.acompletion(**kwargs)
+        cache_store(kwargs, res, provider)
+        return res
+    reserved_tokens = estimate_input_tokens(messages)
+    await rate_limiter.aacquire(reserved_tokens)
+    try:
+        res = await litellm.acompletion(**kwargs)
+    except Exception as e:
+        rate_limiter.refund(reserved_tokens)
+        if is_rate_limit_error(e):
+            rate_limiter.on_rate_limited(retry_after_seconds(e))
+        raise
+    rate_limiter.on_success()
+    rate_limiter.settle(reserved_tokens, res.usage)
+    cache_store(kwargs, res, provider)
     return res
     
 class ToolCallAgent:
     def __init__(
-        self, tools, schema_obj, model: str = "gpt-4o", max_turns: int = 20, eval_mode="default", strategy="tool_call", provider="bedrock"
+        self, tools, schema_obj, model: str = "gpt-4o", max_turns: int = 20, eval_mode="default", strategy="tool_call", provider="bedrock", prompt_caching=False
     ):
-        schema = self._build_schema(schema_obj)
         self.tools = tools
         
         if strategy == "tool_call":
             if "llama" in model: # llama tool_calling through prompt
-                self.sys_prompt = CUSTOM_FC_PROMPT.format(native_fc_prompt=NATIVE_FC_PROMPT.format(system="Salesforce instance"), tools_prompt=fc_prompt_builder(tools))
+                native_fc_prompt = get_system_prompt(NATIVE_FC_PROMPT, system="Salesforce instance").text
+                prompt = get_system_prompt(CUSTOM_FC_PROMPT, native_fc_prompt=native_fc_prompt, tools_prompt=fc_prompt_builder(tools))
             else:
-                self.sys_prompt = NATIVE_FC_PROMPT.format(system="Salesforce instance")
+                prompt = get_system_prompt(NATIVE_FC_PROMPT, system="Salesforce instance")
         else:
-            self.sys_prompt = FC_FLEX_PROMPT.format(system_description=schema, system="Salesforce instance")
+            prompt = get_system_prompt(FC_FLEX_PROMPT, schema_obj, system="Salesforce instance")
+        self.base_sys_prompt = prompt.text
+        self.sys_prompt = prompt.text
+        self.sys_prompt_hash = prompt.sha256
             
         self.model = model
         self.eval_mode = eval_mode
         self.max_turns = max_turns
-        self.usage = {"cost": [], "completion_tokens": [], "prompt_tokens": [], "total_tokens": []}
+        self.usage = {"cost": [], "completion_tokens": [], "prompt_tokens": [], "total_tokens": [], "cache_read_tokens": [], "cache_creation_tokens": []}
         self.provider = provider
         if provider == "bedrock" and self.model in BEDROCK_MODELS_MAP:
             os.environ["AWS_REGION_NAME"] = BEDROCK_MODELS_MAP[self.model]["region"]
@@ -123,127 +201,118 @@ class ToolCallAgent:
             self.model = CUSTOM_SERVER_MODELS_MAP[self.model]["name"]
         else:
             assert self.model in ["o1-mini", "o1-2024-12-17", "o1-preview", "gpt-4o-2024-08-06", "gpt-3.5-turbo-0125"], "Invalid model name"
+        self.rate_limiter = get_rate_limiter(self.provider, self.model)
+        # mark the static system prompt as a cacheable prefix for providers with explicit cache breakpoints
+        self.prompt_caching = prompt_caching and supports_cache_control(self.provider, self.model)
             
 
     def _build_schema(self, schema_obj):
-        object_description = dict()
-        for item in schema_obj:
-            object_description[item["object"]] = "\n".join([f"  - {k}: {v}" for k,v in item["fields"].items()])
-            
-        template = SCHEMA_STRING.format(
-            object_names=", ".join(object_description.keys()),
-            object_fields="\n".join(
-                [f"{obj}\n{fields}" for obj, fields in object_description.items()]
-            )
-        )
-        return template
+        return render_schema(schema_obj)
     
     def reset(self, args):
+        self.sys_prompt = self.base_sys_prompt
         if args["metadata"]["required"]:
             self.sys_prompt += SYSTEM_METADATA.format(system_metadata=args["metadata"]["required"], system="Salesforce instance") # add task/query-specific metadata here
         if self.eval_mode == "aided" and "optional" in args["metadata"]:
             self.sys_prompt += "\n" + args["metadata"]["optional"]
         if self.model not in ["o1-mini", "o1-2024-12-17", "o1-preview"]:
-            self.messages = [{"role": "system", "content": self.sys_prompt.strip()}]
+            self.messages = [{"role": "system", "content": system_content(self.base_sys_prompt, self.sys_prompt, self.prompt_caching)}]
             self.messages.append({"role": "user", "content": args["query"].strip()})
         else:
             # No system role for o1-mini and o1-preview
             self.messages = [{"role": "user", "content": self.sys_prompt + "\n\n" + args["query"]}]
-        self.usage = {"cost": [], "completion_tokens": [], "prompt_tokens": [], "total_tokens": []}
+        self.usage = {"cost": [], "completion_tokens": [], "prompt_tokens": [], "total_tokens": [], "cache_read_tokens": [], "cache_creation_tokens": []}
         
-    def act(self, env, index=None, temperature=0.0):
-        query, metadata = env.reset(task_index=index)
-        self.reset({"query": query, "metadata": metadata})
-        self.info = {}
-        self.info["observation_sizes"] = []
-        done = False
-        reward = 0
+    def _completion_request_args(self):
+        return dict(
+            messages=self.messages,
+            model=self.model,
+            temperature=0.0,
+            top_p=1.0,
+            max_tokens=3500,
+            tools=self.tools if "llama" not in self.model else None, ## llama tool_calling through prompt
+            additional_drop_params=["temperature"] if self.model in ["o1-mini", "o1-preview", "o1-2024-12-17"] else [],
+            rate_limiter=self.rate_limiter,
+            provider=self.provider
+        )
+
+    def _handle_response(self, res, turn_id, info):
+        """Record usage and append the assistant message; returns (message, action), action is None if invalid."""
+        message = res.choices[0].message.model_dump()
+        usage = res.usage
         
-        for turn_id in range(self.max_turns):
-            time.sleep(3)
-            info = {}
-            res = chat_completion_request(
-                messages=self.messages,
-                model=self.model,
-                temperature=0.0,
-                top_p=1.0,
-                max_tokens=3500,
-                tools=self.tools if "llama" not in self.model else None, ## llama tool_calling through prompt
-                additional_drop_params=["temperature"] if self.model in ["o1-mini", "o1-preview", "o1-2024-12-17"] else []
-            )
-            message = res.choices[0].message.model_dump()
-            usage = res.usage
-            
-            for key in self.usage.keys():
-                if key != "cost":
-                    self.usage[key].append(usage.get(key, 0))
-            self.usage["cost"].append(res._hidden_params["response_cost"])
-            
-            print("message", message, flush=True)
-            action = self.message_action_parser(message)
-            print("#", turn_id, "Agent action:", action, flush=True)
-            
-            
-            if action is None:
-                self.info["end_reason"] = {
-                    "source": "agent",
-                    "message": "Invalid action",
-                    "content":  message["content"].strip()
-                }
-                info["end_reason"] = self.info["end_reason"]
-                # if tool_call attempted but failed
-                if "llama" not in self.model and "tool_calls" in message and message["tool_calls"] is not None and len(message["tool_calls"]) > 0 and "id" in message["tool_calls"][0]:
-                    message["tool_calls"] = message["tool_calls"][:1]
-                    self.messages.append(message)
-                    self.messages.append(
-                        {
-                            "role": "tool",
-                            "tool_call_id": message["tool_calls"][0]["id"].strip(),
-                            "name": message["tool_calls"][0]["function"]["name"].strip(),
-                            "content": f"Invalid tool call argument. Please make a valid tool call using the tools provided or submit the final answer using the 'respond' tool."
-                        }
-                    )
-                # if no valid tool_call or not llama
-                else:
-                    if "llama" in self.model:
-                        self.messages.append({"role": "assistant",
-                                              "content": message["content"].strip()
-                                            })
-                    else:
-                        self.messages.append(message)
-                    self.messages.append({"role": "user", "content": FC_RULE_STRING})
-                continue
+        for key in ["completion_tokens", "prompt_tokens", "total_tokens"]:
+            self.usage[key].append(usage.get(key, 0))
+        cache_read_tokens, cache_creation_tokens = cache_token_usage(usage)
+        self.usage["cache_read_tokens"].append(cache_read_tokens)
+        self.usage["cache_creation_tokens"].append(cache_creation_tokens)
+        self.usage["cost"].append(res._hidden_params["response_cost"])
+        
+        print("message", message, flush=True)
+        action = self.message_action_parser(message)
+        print("#", turn_id, "Agent action:", action, flush=True)
+        
+        
+        if action is None:
+            self.info["end_reason"] = {
+                "source": "agent",
+                "message": "Invalid action",
+                "content":  message["content"].strip()
+            }
+            info["end_reason"] = self.info["end_reason"]
+            # if tool_call attempted but failed
+            if "llama" not in self.model and "tool_calls" in message and message["tool_calls"] is not None and len(message["tool_calls"]) > 0 and "id" in message["tool_calls"][0]:
+                message["tool_calls"] = message["tool_calls"][:1]
+                self.messages.append(message)
+                self.messages.append(
+                    {
+                        "role": "tool",
+                        "tool_call_id": message["tool_calls"][0]["id"].strip(),
+                        "name": message["tool_calls"][0]["function"]["name"].strip(),
+                        "content": f"Invalid tool call argument. Please make a valid tool call using the tools provided or submit the final answer using the 'respond' tool."
+                    }
+                )
+            # if no valid tool_call or not llama
             else:
                 if "llama" in self.model:
-                    message = {
-                        "role": "assistant",
-                        "content": f"Action: {action['name']}\nAction Input: {json.dumps(action['arguments'])}"
-                    }
-                    self.messages.append(message)
+                    self.messages.append({"role": "assistant",
+                                          "content": message["content"].strip()
+                                        })
                 else:
-                    message["tool_calls"] = message["tool_calls"][:1]
                     self.messages.append(message)
-            
-            obs, reward, done, info = env.step(action)
-            if "observation_size" in info:
-                self.info["observation_sizes"].append(info["observation_size"])
-            if "end_reason" in info: # implies error in query
-                self.info["end_reason"] = info["end_reason"]
-            if done: # implies submit action
-                break
+                self.messages.append({"role": "user", "content": FC_RULE_STRING})
+        else:
+            if "llama" in self.model:
+                message = {
+                    "role": "assistant",
+                    "content": f"Action: {action['name']}\nAction Input: {json.dumps(action['arguments'])}"
+                }
+                self.messages.append(message)
             else:
-                if "llama" in self.model:
-                    self.messages.append({"role": "user", "content": f"Salesforce instance output: {obs}"})
-                else:
-                    self.messages.append(
-                        {
-                            "role": "tool",
-                            "tool_call_id": message["tool_calls"][0]["id"].strip(),
-                            "name": action["name"],
-                            "content": obs
-                        }
-                    )
-        
+                message["tool_calls"] = message["tool_calls"][:1]
+                self.messages.append(message)
+        return message, action
+
+    def _handle_observation(self, message, action, obs, done, info):
+        if "observation_size" in info:
+            self.info["observation_sizes"].append(info["observation_size"])
+        if "end_reason" in info: # implies error in query
+            self.info["end_reason"] = info["end_reason"]
+        if done: # implies submit action
+            return
+        if "llama" in self.model:
+            self.messages.append({"role": "user", "content": f"Salesforce instance output: {obs}"})
+        else:
+            self.messages.append(
+                {
+                    "role": "tool",
+                    "tool_call_id": message["tool_calls"][0]["id"].strip(),
+                    "name": action["name"],
+                    "content": obs
+                }
+            )
+
+    def _finalize(self, done, info, message, turn_id):
         # Here when either max_turns is reached or submitted
         if not done: 
             if "end_reason" not in info: # no error in last query
@@ -255,6 +324,70 @@ class ToolCallAgent:
         self.info["usage"] = self.usage
         self.info["total_cost"] = sum(self.usage["cost"])
         self.info["num_turns"] = turn_id + 1
+
+    def act(self, env, index=None, temperature=0.0):
+        with trace("task", task_index=index, model=self.model) as task_trace:
+            reward = self._act(env, index, temperature)
+        self.info["trace"] = task_trace.summary()
+        return reward
+
+    def _act(self, env, index, temperature):
+        query, metadata = env.reset(task_index=index)
+        self.reset({"query": query, "metadata": metadata})
+        self.info = {}
+        self.info["observation_sizes"] = []
+        done = False
+        reward = 0
+        
+        for turn_id in range(self.max_turns):
+            info = {}
+            with span("turn", turn=turn_id + 1):
+                with span("llm", model=self.model) as llm_span:
+                    res = chat_completion_request(**self._completion_request_args())
+                    llm_span.set(retries=llm_span.attributes.pop("attempts", 1) - 1)
+                    record_usage(llm_span, res)
+                message, action = self._handle_response(res, turn_id, info)
+                if action is None:
+                    continue
+                obs, reward, done, info = env.step(action)
+                self._handle_observation(message, action, obs, done, info)
+                if done:
+                    break
+        
+        self._finalize(done, info, message, turn_id)
+        return reward
+
+    async def aact(self, env, index=None, temperature=0.0):
+        """Async variant of `act` that awaits `litellm.acompletion` and the env's `areset`/`astep`."""
+        with trace("task", task_index=index, model=self.model) as task_trace:
+            reward = await self._aact(env, index, temperature)
+        self.info["trace"] = task_trace.summary()
+        return reward
+
+    async def _aact(self, env, index, temperature):
+        query, metadata = await env.areset(task_index=index)
+        self.reset({"query": query, "metadata": metadata})
+        self.info = {}
+        self.info["observation_sizes"] = []
+        done = False
+        reward = 0
+        
+        for turn_id in range(self.max_turns):
+            info = {}
+            with span("turn", turn=turn_id + 1):
+                with span("llm", model=self.model) as llm_span:
+                    res = await achat_completion_request(**self._completion_request_args())
+                    llm_span.set(retries=llm_span.attributes.pop("attempts", 1) - 1)
+                    record_usage(llm_span, res)
+                message, action = self._handle_response(res, turn_id, info)
+                if action is None:
+                    continue
+                obs, reward, done, info = await env.astep(action)
+                self._handle_observation(message, action, obs, done, info)
+                if done:
+                    break
+        
+        self._finalize(done, info, message, turn_id)
         return reward
 
     def get_messages(self) -> List[Dict[str, str]]:
@@ -0,0 +1,246 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+TRACE_FORMATS = ["jsonl", "otlp"]
+
+# Span kinds summed by `trace_summary`; "task" and "turn" spans only structure the trace
+SPAN_KINDS = ["llm", "query", "tool", "evaluator", "user"]
+# Numeric span attributes that are summed per kind
+_SUMMED_ATTRIBUTES = ["prompt_tokens", "completion_tokens", "retries", "rows"]
+
+
+class Span(object):
+    """A timed operation of a trace, with attributes such as token counts, retries or cache hits."""
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict[str, Any]) -> None:
+        super().__init__()
+        self.trace = trace
+        self.name = name
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.status = "ok"
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def add(self, key: str, value: float = 1):
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def end(self):
+        self.duration = time.perf_counter() - self._start
+        self.trace.finish(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration": self.duration,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class _NoSpan(object):
+    """Stands in for a span outside of any trace, so instrumented code needs no checks."""
+
+    attributes: Dict[str, Any] = {}
+
+    def set(self, **attributes):
+        pass
+
+    def add(self, key: str, value: float = 1):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+class Trace(object):
+    """The finished spans of one task; spans may end in worker threads (e.g. `asyncio.to_thread`)."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def finish(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self) -> Dict[str, Any]:
+        return trace_summary(self.spans)
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("crm_sandbox_current_span", default=None)
+
+
+def current_span():
+    """The innermost open span, or a no-op span when nothing is traced."""
+    return _current_span.get() or NO_SPAN
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a child of the current span. Does nothing outside of a trace."""
+    parent = _current_span.get()
+    if parent is None:
+        yield NO_SPAN
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.status = "error"
+        child.set(error=type(e).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        child.end()
+
+
+@contextmanager
+def trace(name: str = "task", **attributes):
+    """
+    Trace one task: yields its `Trace`, whose spans are sent to the configured exporter when the
+    block ends. Inside another trace it only adds a child span.
+    """
+    if _current_span.get() is not None:
+        with span(name, **attributes) as child:
+            yield child.trace
+        return
+    task_trace = Trace()
+    root = Span(task_trace, name, None, attributes)
+    token = _current_span.set(root)
+    try:
+        yield task_trace
+    except BaseException as e:
+        root.status = "error"
+        root.set(error=type(e).__name__)
+        raise
+    finally:
+        _current_span.reset(token)
+        root.end()
+        if _exporter is not None:
+            _exporter.export(task_trace)
+
+
+def record_usage(llm_span, res):
+    """Copy the token usage of a completion response onto an `llm` span."""
+    usage = getattr(res, "usage", None)
+    if usage is None:
+        return
+    llm_span.set(prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0, completion_tokens=getattr(usage, "completion_tokens", 0) or 0)
+
+
+def trace_summary(spans: List[Span]) -> Dict[str, Any]:
+    """
+    Where a task spent its time: wall time, number of turns, and per span kind the number of
+    calls, seconds, errors, cache hits and summed token/retry/row counts.
+    """
+    summary: Dict[str, Any] = {"seconds": 0.0, "turns": 0}
+    for kind in SPAN_KINDS:
+        summary[kind] = {"calls": 0, "seconds": 0.0, "errors": 0, "cache_hits": 0}
+    for s in spans:
+        if s.parent_id is None:
+            summary["seconds"] = round(s.duration, 3)
+        elif s.name == "turn":
+            summary["turns"] += 1
+        elif s.name in summary:
+            stats = summary[s.name]
+            stats["calls"] += 1
+            stats["seconds"] += s.duration
+            stats["errors"] += s.status == "error" or s.attributes.get("status") == 0
+            stats["cache_hits"] += bool(s.attributes.get("cache_hit"))
+            for key in _SUMMED_ATTRIBUTES:
+                if key in s.attributes:
+                    stats[key] = stats.get(key, 0) + s.attributes[key]
+    for kind in SPAN_KINDS:
+        summary[kind]["seconds"] = round(summary[kind]["seconds"], 3)
+    return summary
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(task_trace: Trace, service_name: str = "crm_sandbox") -> Dict[str, Any]:
+    """A trace as an OTLP/JSON `ExportTraceServiceRequest`, as read by OpenTelemetry collectors."""
+    spans = []
+    for s in task_trace.spans:
+        otlp_span = {
+            "traceId": task_trace.trace_id,
+            "spanId": s.span_id,
+            "name": s.name,
+            # SPAN_KIND_INTERNAL, or SPAN_KIND_CLIENT for calls to the LLM, Salesforce and tools
+            "kind": 3 if s.name in SPAN_KINDS else 1,
+            "startTimeUnixNano": str(s.start_ns),
+            "endTimeUnixNano": str(s.start_ns + int(s.duration * 1e9)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in s.attributes.items()],
+            # STATUS_CODE_OK / STATUS_CODE_ERROR
+            "status": {"code": 1 if s.status == "ok" else 2},
+        }
+        if s.parent_id is not None:
+            otlp_span["parentSpanId"] = s.parent_id
+        spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "crm_sandbox"}, "spans": spans}],
+        }]
+    }
+
+
+class TraceExporter(object):
+    """
+    Appends finished traces to a file: one line per span (`jsonl`), or one OTLP/JSON request per
+    trace (`otlp`, the layout of the OpenTelemetry collector's file exporter and receiver).
+    """
+
+    def __init__(self, path: str, fmt: str = "jsonl") -> None:
+        super().__init__()
+        assert fmt in TRACE_FORMATS, f"Unknown trace format: {fmt}"
+        self.path = path
+        self.fmt = fmt
+        self._lock = threading.Lock()
+
+    def export(self, task_trace: Trace):
+        if self.fmt == "otlp":
+            lines = [json.dumps(to_otlp(task_trace))]
+        else:
+            lines = [json.dumps(s.to_dict(), default=str) for s in task_trace.spans]
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+_exporter: Optional[TraceExporter] = None
+
+
+def configure_tracing(path: Optional[str], fmt: str = "jsonl") -> Optional[TraceExporter]:
+    """Export every finished trace to `path` (None disables exporting; summaries are always recorded)."""
+    global _exporter
+    _exporter = None if path is None else TraceExporter(path, fmt)
+    return _exporter
+
+
+def get_trace_exporter() -> Optional[TraceExporter]:
+    return _exporter
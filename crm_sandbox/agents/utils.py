@@ -236,26 +236,14 @@ def fc_prompt_builder(tools):
 bleu_scorer = BLEU()
 rouge_scorer = Rouge()
 
-def normalize_answer(s):
-    """Lower text and remove punctuation, articles and extra whitespace."""
-
-    def remove_articles(text):
-        return re.sub(r'\b(a|an|the)\b', ' ', text)
-
-    def white_space_fix(text):
-        return ' '.join(text.split())
+# Punctuation (including underscores and curly quotes) is replaced by spaces
+_PUNCTUATION_TABLE = str.maketrans({ch: " " for ch in string.punctuation + "‘’´`"})
+_ARTICLES = re.compile(r'\b(a|an|the)\b')
 
-    def handle_punc(text):
-        exclude = set(string.punctuation + "".join([u"‘", u"’", u"´", u"`"]))
-        return ''.join(ch if ch not in exclude else ' ' for ch in text)
 
-    def lower(text):
-        return text.lower()
-
-    def replace_underscore(text):
-        return text.replace('_', ' ')
-
-    return white_space_fix(remove_articles(handle_punc(lower(replace_underscore(s))))).strip()
+def normalize_answer(s):
+    """Lower text and remove punctuation, articles and extra whitespace."""
+    return ' '.join(_ARTICLES.sub(' ', s.lower().translate(_PUNCTUATION_TABLE)).split())
 
 
 def exact_match_score(prediction, ground_truth):
@@ -306,6 +294,110 @@ def get_all_metrics(prediction, ground_truth):
     }
 
 
+class _Tokens(object):
+    """A normalized answer with the n-grams used by every metric, computed once per distinct string."""
+
+    def __init__(self, text):
+        super().__init__()
+        self.words = normalize_answer(text).split()
+        self.counts = Counter(self.words)
+        self.bleu_ngrams = Counter(
+            tuple(self.words[i:i + n])
+            for n in range(1, bleu_scorer.max_ngram_order + 1)
+            for i in range(len(self.words) - n + 1)
+        )
+        self.unigrams = set(self.words)
+        self.bigrams = set(zip(self.words, self.words[1:]))
+
+
+def _f1(pred, ref):
+    num_same = sum((pred.counts & ref.counts).values())
+    if num_same == 0:
+        return 0
+    precision = 1.0 * num_same / len(pred.words)
+    recall = 1.0 * num_same / len(ref.words)
+    return (2 * precision * recall) / (precision + recall)
+
+
+def _bleu(pred, ref):
+    order = bleu_scorer.max_ngram_order
+    correct, total = [0] * order, [0] * order
+    for ngram, count in pred.bleu_ngrams.items():
+        total[len(ngram) - 1] += count
+        if ngram in ref.bleu_ngrams:
+            correct[len(ngram) - 1] += min(count, ref.bleu_ngrams[ngram])
+    score = BLEU.compute_bleu(
+        correct, total, len(pred.words), len(ref.words),
+        smooth_method=bleu_scorer.smooth_method, smooth_value=bleu_scorer.smooth_value,
+        effective_order=bleu_scorer.effective_order, max_ngram_order=order,
+    )
+    return score.score / 100
+
+
+def _rouge_f(overlap, pred_count, ref_count):
+    precision = overlap / pred_count if pred_count else 0.0
+    recall = overlap / ref_count if ref_count else 0.0
+    return 2.0 * ((precision * recall) / (precision + recall + 1e-8))
+
+
+def _lcs_words(x, y):
+    """Words of the longest common subsequence of x and y, backtracked like the `rouge` package."""
+    table = [[0] * (len(y) + 1) for _ in range(len(x) + 1)]
+    for i in range(1, len(x) + 1):
+        for j in range(1, len(y) + 1):
+            if x[i - 1] == y[j - 1]:
+                table[i][j] = table[i - 1][j - 1] + 1
+            else:
+                table[i][j] = max(table[i - 1][j], table[i][j - 1])
+    words, i, j = set(), len(x), len(y)
+    while i > 0 and j > 0:
+        if x[i - 1] == y[j - 1]:
+            words.add(x[i - 1])
+            i, j = i - 1, j - 1
+        elif table[i - 1][j] > table[i][j - 1]:
+            i -= 1
+        else:
+            j -= 1
+    return words
+
+
+def _rouge(pred, ref):
+    if not pred.words or not ref.words:
+        # the `rouge` package raises on empty text
+        return {"rouge-1": 0.0, "rouge-2": 0.0, "rouge-l": 0.0}
+    return {
+        "rouge-1": _rouge_f(len(pred.unigrams & ref.unigrams), len(pred.unigrams), len(ref.unigrams)),
+        "rouge-2": _rouge_f(len(pred.bigrams & ref.bigrams), len(pred.bigrams), len(ref.bigrams)),
+        "rouge-l": _rouge_f(len(_lcs_words(ref.words, pred.words)), len(pred.unigrams), len(ref.unigrams)),
+    }
+
+
+def get_all_metrics_batch(predictions, ground_truths):
+    """
+    `get_all_metrics` for many (prediction, ground truth) pairs, e.g. to re-score whole result sets.
+    Each distinct string is normalized and split into n-grams once and shared by all metrics;
+    the scores match `get_all_metrics`, except that empty answers get ROUGE 0 instead of an error.
+    """
+    assert len(predictions) == len(ground_truths), "Need one ground truth per prediction"
+    tokens = {}
+
+    def tokenize(text):
+        if text not in tokens:
+            tokens[text] = _Tokens(text)
+        return tokens[text]
+
+    scores = []
+    for prediction, ground_truth in zip(predictions, ground_truths):
+        pred, ref = tokenize(prediction), tokenize(ground_truth)
+        scores.append({
+            "em": pred.words == ref.words,
+            "f1": _f1(pred, ref),
+            "bleu": _bleu(pred, ref),
+            "rouge": _rouge(pred, ref),
+        })
+    return scores
+
+
 ### Token calculation utilities ###
 
 # Fallback values when model specs not found
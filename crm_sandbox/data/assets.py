@@ -1,9 +1,14 @@
-from datasets import load_dataset
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+from datasets import Dataset, load_dataset
 
 def _clean_fields_in_schemas(schema_list_of_dicts):
     """
-    Helper function to remove None values from 'fields' dictionaries 
-    in a list of schemas. This is a work around for huggingface's 
+    Helper function to remove None values from 'fields' dictionaries
+    in a list of schemas. This is a work around for huggingface's
     data representations where fields might contain None values.
     """
     for schema_dict in schema_list_of_dicts:
@@ -12,44 +17,71 @@ def _clean_fields_in_schemas(schema_list_of_dicts):
                 k: v for k, v in schema_dict["fields"].items() if v is not None
             }
 
-## CRMArena
-crmarena = load_dataset("Salesforce/CRMArena", "CRMArena")
-    
-TASKS_ORIGINAL = [data for data in crmarena["test"]]
-    
-schema = load_dataset("Salesforce/CRMArena", "schema")
-
-SCHEMA_ORIGINAL = [data for data in schema["test"]]    
-
-_clean_fields_in_schemas(SCHEMA_ORIGINAL)
-
+# (org_type, interactive) -> (dataset, config, split); CRMArena has no interactive split
+_TASK_SPLITS = {
+    ("original", False): ("Salesforce/CRMArena", "CRMArena", "test"),
+    ("b2b", False): ("Salesforce/CRMArenaPro", "CRMArenaPro", "b2b"),
+    ("b2b", True): ("Salesforce/CRMArenaPro", "CRMArenaPro", "b2b_interactive"),
+    ("b2c", False): ("Salesforce/CRMArenaPro", "CRMArenaPro", "b2c"),
+    ("b2c", True): ("Salesforce/CRMArenaPro", "CRMArenaPro", "b2c_interactive"),
+}
+_SCHEMA_SPLITS = {
+    "original": ("Salesforce/CRMArena", "schema", "test"),
+    "b2b": ("Salesforce/CRMArenaPro", "b2b_schema", "b2b_schema"),
+    "b2c": ("Salesforce/CRMArenaPro", "b2c_schema", "b2c_schema"),
+}
 
-## CRMArena Pro
-crmarena_pro = load_dataset("Salesforce/CRMArenaPro", "CRMArenaPro")
 
+@lru_cache(maxsize=None)
+def load_split(path: str, name: str, split: str) -> Dataset:
+    """Load one split on first use. The returned dataset is backed by memory-mapped Arrow files."""
+    return load_dataset(path, name, split=split)
 
-TASKS_B2B = [data for data in crmarena_pro["b2b"]]
 
-TASKS_B2B_INTERACTIVE = [data for data in crmarena_pro["b2b_interactive"]]
-
-TASKS_B2C = [data for data in crmarena_pro["b2c"]]
-
-TASKS_B2C_INTERACTIVE = [data for data in crmarena_pro["b2c_interactive"]]
+def get_task_dataset(org_type: str = "b2b", interactive: bool = False, task_categories: Optional[Iterable[str]] = None) -> Dataset:
+    """
+    Return the tasks of an org as a Dataset, restricted to `task_categories` when given.
+    Filtering only reads the `task` column and selects rows by index, without copying the data.
+    """
+    dataset = load_split(*_TASK_SPLITS[(org_type, interactive and org_type != "original")])
+    if task_categories is None:
+        return dataset
+    mask = pc.is_in(dataset.with_format("arrow")["task"], value_set=pa.array(list(task_categories), type=pa.string()))
+    return dataset.select(pc.indices_nonzero(mask).to_pylist())
 
 
-b2b_schema = load_dataset("Salesforce/CRMArenaPro", "b2b_schema")
+def get_tasks(org_type: str = "b2b", interactive: bool = False, task_categories: Optional[Iterable[str]] = None) -> List[Dict]:
+    """Materialize the (optionally filtered) tasks of an org as a list of dicts."""
+    return [task for task in get_task_dataset(org_type, interactive, task_categories)]
 
-B2B_SCHEMA = [data for data in b2b_schema["b2b_schema"]]
 
-b2c_schema = load_dataset("Salesforce/CRMArenaPro", "b2c_schema")
-B2C_SCHEMA = [data for data in b2c_schema["b2c_schema"]]
+@lru_cache(maxsize=None)
+def get_schema(org_type: str = "b2b") -> List[Dict]:
+    schema = [data for data in load_split(*_SCHEMA_SPLITS[org_type])]
+    _clean_fields_in_schemas(schema)
+    return schema
 
-_clean_fields_in_schemas(B2B_SCHEMA)
-    
-    
-_clean_fields_in_schemas(B2C_SCHEMA)
 
-    
 TOOLS = None
 
-EXTERNAL_FACING_TASKS = ["knowledge_qa", "named_entity_disambiguation", "private_customer_information", "internal_operation_data", "confidential_company_knowledge"]
\ No newline at end of file
+EXTERNAL_FACING_TASKS = ["knowledge_qa", "named_entity_disambiguation", "private_customer_information", "internal_operation_data", "confidential_company_knowledge"]
+
+# Module-level names kept for backwards compatibility; each one loads its split on first access
+_LAZY_ASSETS = {
+    "TASKS_ORIGINAL": lambda: get_tasks("original"),
+    "SCHEMA_ORIGINAL": lambda: get_schema("original"),
+    "TASKS_B2B": lambda: get_tasks("b2b"),
+    "TASKS_B2B_INTERACTIVE": lambda: get_tasks("b2b", interactive=True),
+    "TASKS_B2C": lambda: get_tasks("b2c"),
+    "TASKS_B2C_INTERACTIVE": lambda: get_tasks("b2c", interactive=True),
+    "B2B_SCHEMA": lambda: get_schema("b2b"),
+    "B2C_SCHEMA": lambda: get_schema("b2c"),
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ASSETS:
+        value = _LAZY_ASSETS[name]()
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
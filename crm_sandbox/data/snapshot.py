@@ -0,0 +1,174 @@
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+MANIFEST_FILE = "manifest.json"
+BATCH_SIZE = 2000  # one REST page
+
+_ARROW_TYPES = {
+    "boolean": pa.bool_(),
+    "int": pa.int64(),
+    "double": pa.float64(),
+    "currency": pa.float64(),
+    "percent": pa.float64(),
+    "date": pa.date32(),
+    "datetime": pa.timestamp("ms", tz="UTC"),
+}
+# Compound fields duplicate their component fields (BillingCity, ...) and are not exported
+_COMPOUND_TYPES = {"address", "location"}
+
+
+def _arrow_value(value: Any, ftype: str) -> Any:
+    if value is None:
+        return None
+    if ftype == "datetime":
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S.%f%z")
+    if ftype == "date":
+        return date.fromisoformat(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def _describe_fields(sf, obj: str) -> List[Dict[str, Any]]:
+    fields = getattr(sf, obj).describe()["fields"]
+    return [
+        {
+            "name": f["name"],
+            "type": f["type"],
+            "referenceTo": f.get("referenceTo") or [],
+            "relationshipName": f.get("relationshipName"),
+        }
+        for f in fields
+        if f["type"] not in _COMPOUND_TYPES
+    ]
+
+
+def export_object(sf, obj: str, output_dir: str, compression: str = "zstd") -> Dict[str, Any]:
+    """
+    Page through every record of one object and stream it to `<output_dir>/<obj>.parquet`.
+    Returns the manifest entry of the object.
+    """
+    started = time.time()
+    fields = _describe_fields(sf, obj)
+    arrow_schema = pa.schema([(f["name"], _ARROW_TYPES.get(f["type"], pa.string())) for f in fields])
+    path = os.path.join(output_dir, f"{obj}.parquet")
+    tmp_path = path + ".tmp"
+    rows = 0
+    with pq.ParquetWriter(tmp_path, arrow_schema, compression=compression) as writer:
+        batch: List[Dict[str, Any]] = []
+        query = f"SELECT {', '.join(f['name'] for f in fields)} FROM {obj}"
+        for record in sf.query_all_iter(query):
+            batch.append(record)
+            if len(batch) >= BATCH_SIZE:
+                writer.write_table(_to_table(batch, fields, arrow_schema))
+                rows += len(batch)
+                batch = []
+        if batch or rows == 0:
+            writer.write_table(_to_table(batch, fields, arrow_schema))
+            rows += len(batch)
+    os.replace(tmp_path, path)
+    return {
+        "file": os.path.basename(path),
+        "rows": rows,
+        "fields": fields,
+        "extracted_at": datetime.now(timezone.utc).isoformat(),
+        "duration_s": round(time.time() - started, 3),
+    }
+
+
+def _to_table(records: List[Dict[str, Any]], fields: List[Dict[str, Any]], arrow_schema: pa.Schema) -> pa.Table:
+    columns = [
+        pa.array([_arrow_value(r.get(f["name"]), f["type"]) for r in records], type=arrow_schema.field(f["name"]).type)
+        for f in fields
+    ]
+    return pa.Table.from_arrays(columns, schema=arrow_schema)
+
+
+def export_snapshot(sf_connector, schema: List[Dict[str, Any]], output_dir: str, org_type: str, workers: int = 8) -> Dict[str, Any]:
+    """
+    Export every object of `schema` (B2B_SCHEMA, B2C_SCHEMA or SCHEMA_ORIGINAL) to Parquet,
+    `workers` objects at a time, and write a manifest with row counts and extraction times.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    objects = [item["object"] for item in schema]
+    manifest = {"org_type": org_type, "started_at": datetime.now(timezone.utc).isoformat(), "objects": {}}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(export_object, sf_connector.sf, obj, output_dir): obj for obj in objects}
+        for future in as_completed(futures):
+            obj = futures[future]
+            manifest["objects"][obj] = future.result()
+            print(f"Exported {manifest['objects'][obj]['rows']} {obj} records")
+    manifest["objects"] = {obj: manifest["objects"][obj] for obj in objects}
+    manifest["finished_at"] = datetime.now(timezone.utc).isoformat()
+    with open(os.path.join(output_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_manifest(snapshot_dir: str) -> Dict[str, Any]:
+    with open(os.path.join(snapshot_dir, MANIFEST_FILE), "r") as f:
+        return json.load(f)
+
+
+def read_object(snapshot_dir: str, obj: str, columns: Optional[List[str]] = None) -> pa.Table:
+    return pq.read_table(os.path.join(snapshot_dir, f"{obj}.parquet"), columns=columns)
+
+
+def iter_records(snapshot_dir: str, obj: str, batch_size: int = BATCH_SIZE) -> Iterator[List[Dict[str, Any]]]:
+    """Yield the records of one object in batches of API-shaped dicts."""
+    parquet_file = pq.ParquetFile(os.path.join(snapshot_dir, f"{obj}.parquet"))
+    for batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield batch.to_pylist()
+
+
+def snapshot_to_sqlite(snapshot_dir: str, db_path: str) -> Dict[str, int]:
+    """Load a Parquet snapshot into the SQLite layout read by `LocalSalesforceConnector`."""
+    from crm_sandbox.env.local_sandbox import create_object_table, insert_records
+    manifest = load_manifest(snapshot_dir)
+    if os.path.dirname(db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    counts = {}
+    try:
+        for obj, entry in manifest["objects"].items():
+            create_object_table(conn, obj, entry["fields"])
+            counts[obj] = sum(insert_records(conn, obj, records) for records in iter_records(snapshot_dir, obj))
+            conn.commit()
+    finally:
+        conn.close()
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    parser = argparse.ArgumentParser(description="Export an org to a Parquet snapshot, or load a snapshot into SQLite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Export every schema object of an org to Parquet")
+    export_parser.add_argument("--org_type", type=str, default="b2b", choices=["b2b", "b2c", "original"])
+    export_parser.add_argument("--output", type=str, required=True, help="Snapshot directory")
+    export_parser.add_argument("--workers", type=int, default=8, help="Objects exported concurrently (default: %(default)s)")
+    sqlite_parser = subparsers.add_parser("to-sqlite", help="Load a Parquet snapshot into a SQLite database for --local_snapshot")
+    sqlite_parser.add_argument("snapshot_dir", type=str)
+    sqlite_parser.add_argument("db_path", type=str)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        load_dotenv()
+        from crm_sandbox.data.assets import get_schema
+        from crm_sandbox.env.connect_sandbox import SalesforceConnector
+        schema = get_schema(args.org_type)
+        manifest = export_snapshot(SalesforceConnector(org_type=args.org_type), schema, args.output, args.org_type, workers=args.workers)
+        total = sum(entry["rows"] for entry in manifest["objects"].values())
+        print(f"Wrote {total} records from {len(manifest['objects'])} objects to {args.output}")
+    else:
+        counts = snapshot_to_sqlite(args.snapshot_dir, args.db_path)
+        print(f"Loaded {sum(counts.values())} records from {len(counts)} objects into {args.db_path}")
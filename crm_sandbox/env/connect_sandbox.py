@@ -1,9 +1,11 @@
-from simple_salesforce import Salesforce
 import ast
 import os, re, pandas as pd
 from tqdm import tqdm
-from typing import Dict, List
+from typing import Dict, Iterator, List
 from dotenv import load_dotenv
+from crm_sandbox.env.query_cache import QueryCache, get_query_cache
+from crm_sandbox.env.sessions import SalesforceSessionManager, get_session_manager
+from crm_sandbox.agents.tracing import current_span
 
 
 DATA_DIR = "../data"
@@ -14,15 +16,17 @@ METADATA_FILE = f"{DATA_DIR}/training_org_full_object_metadata_superset.jsonl"
 
 
 class SalesforceConnector:
-    def __init__(self, auth=None, schema_file=FULL_SCHEMA_FILE, org_type="b2b"):
+    def __init__(self, auth=None, schema_file=FULL_SCHEMA_FILE, org_type="b2b", query_cache: QueryCache = None, session_manager: SalesforceSessionManager = None):
         
         assert org_type in ["b2b", "b2c", "original"], "Invalid organization type"
         if not auth:
             auth = self.sf_auth(org_type)
-        if auth.get("username"):
-            self.sf = Salesforce(username=auth["username"], password=auth["password"], security_token=auth["security_token"])
-        else:
-            self.sf = Salesforce(instance_url=auth["instance_url"], session_id=auth["session_id"])
+        # Logs in once per org and reuses the pooled HTTP session of the process-wide manager
+        session_manager = session_manager if session_manager is not None else get_session_manager()
+        self.sf = session_manager.get(auth)
+        # Opt-in: falls back to the process-wide cache enabled with configure_query_cache()
+        self.query_cache = query_cache if query_cache is not None else get_query_cache()
+        self.cache_namespace = f"{org_type}:{self.sf.sf_instance}"
         
     def preprocess_query(self, query: str) -> str:
         # remove tags if present
@@ -41,37 +45,79 @@ class SalesforceConnector:
         is_sosl = False
         if query.startswith("FIND"):
             is_sosl = True
+        if not is_sosl:
+            query = self.preprocess_query(query)
+        if self.query_cache is not None:
+            cached = self.query_cache.get(self.cache_namespace, query)
+            if cached is not None:
+                current_span().set(cache_hit=True)
+                if return_df and cached:
+                    return pd.DataFrame(cached), 1
+                return cached, 1
         try:
-            if not is_sosl:
-                query = self.preprocess_query(query)
-                result = self.sf.query_all(query)
-            else:
-                result = self.sf.search(query)
+            # single pass over the pages: strip attributes and track the columns that are null in every record
+            records, all_none_keys = [], None
+            for page in self._iter_pages(query, is_sosl):
+                for record in page:
+                    record.pop("attributes", None)
+                    if all_none_keys is None:
+                        all_none_keys = set(record)
+                    if all_none_keys:
+                        all_none_keys.difference_update([key for key in all_none_keys if record.get(key) is not None])
+                    records.append(record)
         except Exception as e:
-            e = str(e)
-            e = ast.literal_eval(e.split("Response content:")[1].strip())[0]
-            err = f"{e['errorCode']}: {e['message']}"
-            return err, 0
-        
+            return self._format_error(e), 0
+
+        if all_none_keys:
+            for record in records:
+                for key in all_none_keys:
+                    record.pop(key, None)
+        if self.query_cache is not None:
+            self.query_cache.put(self.cache_namespace, query, records)
+        if return_df and records:
+            return pd.DataFrame(records), 1
+        return records, 1
+
+    def iter_query(self, query: str) -> Iterator[List[Dict]]:
+        """
+        Yield the records of a query one API page at a time, with `attributes` stripped, without
+        holding the whole result in memory. Unlike `run_query`, errors are raised, all-null
+        columns are kept and results are not cached.
+        """
+        is_sosl = query.startswith("FIND")
         if not is_sosl:
-            result_data = result["records"]
-        else:
-            result_data = result["searchRecords"]
-        if len(result_data) == 0:
-            return [], 1
-        keys = result_data[0].keys()
+            query = self.preprocess_query(query)
+        for page in self._iter_pages(query, is_sosl):
+            for record in page:
+                record.pop("attributes", None)
+            yield page
 
-        for row in result_data:
-            if "attributes" in row:
-                del row["attributes"]
+    def ping(self) -> bool:
+        """Cheap round trip to the org, used by env pool health checks; not cached."""
+        try:
+            self.sf.query("SELECT Id FROM User LIMIT 1")
+            return True
+        except Exception as e:
+            print(f"Salesforce health check failed: {e}")
+            return False
+
+    def _iter_pages(self, query: str, is_sosl: bool) -> Iterator[List[Dict]]:
+        """Run the query against the org and yield the raw records page by page as they arrive."""
+        if is_sosl:
+            yield self.sf.search(query)["searchRecords"]
+            return
+        result = self.sf.query(query)
+        yield result["records"]
+        while not result["done"]:
+            result = self.sf.query_more(result["nextRecordsUrl"], identifier_is_url=True)
+            yield result["records"]
+
+    @staticmethod
+    def _format_error(e: Exception) -> str:
+        e = str(e)
+        e = ast.literal_eval(e.split("Response content:")[1].strip())[0]
+        return f"{e['errorCode']}: {e['message']}"
 
-        all_none_keys = [key for key in keys if all([record[key] is None for record in result_data])]
-        new_data = [{k: v for k, v in record.items() if k not in all_none_keys} for record in result_data]
-        if return_df:
-            return pd.DataFrame(new_data), 1
-        return new_data, 1
-    
-    
     @staticmethod
     def sf_auth(org_type: str):
         auth = dict()
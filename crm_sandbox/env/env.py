@@ -1,12 +1,26 @@
 import random
+import asyncio
 from typing import Any, Callable, Dict, List, Type, Optional, Set, Union, Tuple
 from crm_sandbox.env.connect_sandbox import SalesforceConnector
+from crm_sandbox.env.local_sandbox import LocalSalesforceConnector
+from crm_sandbox.env.observation import ObservationShaper, is_record_list
+from crm_sandbox.env.extractors import extract_answer
 from crm_sandbox.env.users import LLMUserSimulationEnv
-from concurrent.futures import ThreadPoolExecutor
-from crm_sandbox.agents.utils import get_all_metrics
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from crm_sandbox.agents.utils import get_all_metrics, get_all_metrics_batch, estimate_input_tokens
+from crm_sandbox.agents.rate_limiter import get_rate_limiter, limited_completion
+from crm_sandbox.agents.llm_cache import cache_lookup, cache_store
+from crm_sandbox.agents.tracing import span, current_span, record_usage
 import litellm
 import json
 import os
+import re
+
+def make_connector(org_type: str, local_snapshot: Optional[str] = None):
+    """Connect to the live org, or to a local SQLite snapshot of it when a path is given."""
+    if local_snapshot:
+        return LocalSalesforceConnector(local_snapshot, org_type=org_type)
+    return SalesforceConnector(org_type=org_type)
 
 class ChatEnv(object):
     def __init__(
@@ -16,6 +30,11 @@ class ChatEnv(object):
         user_model: str = "gpt-4o-2024-08-06",
         user_provider: Optional[str] = "openai",
         org_type: str = "b2b",
+        local_snapshot: Optional[str] = None,
+        max_obs_rows: Optional[int] = None,
+        max_obs_chars: Optional[int] = None,
+        obs_format: Optional[str] = None,
+        deferred_eval: bool = False,
     ) -> None:
         super().__init__()
         self.tasks = tasks
@@ -25,17 +44,35 @@ class ChatEnv(object):
             self.task_index = random.choice(list(tasks.keys()))
         self.task = tasks[self.task_index]
         self.actions: List = []
-        self.sf_connector = SalesforceConnector(org_type=org_type)
+        self.sf_connector = make_connector(org_type, local_snapshot)
+        self.observer = ObservationShaper(max_rows=max_obs_rows, max_chars=max_obs_chars, fmt=obs_format)
         self.max_user_turns = 1  # dummy
         self.current_user_turn = 0 # dummy
         self.evaluator = Evaluator(model=user_model, provider=user_provider)
+        # answers that need an LLM evaluator call are recorded here and scored after the run
+        self.deferred_eval = deferred_eval
+        self.pending_evaluation = None
         
         
     def reset(self, task_index: int = 0):
         self.task = self.tasks[task_index]
         self.actions = []
+        self.pending_evaluation = None
+        self.observer.reset()
         initial_observation, metadata = self.task.get("query", ""), self.task.get("metadata", "")
         return initial_observation, metadata
+
+    def _run_query(self, query: str):
+        """Run an execute action, or serve the next page of an earlier result; returns (observation, status, records shown)."""
+        with span("query") as query_span:
+            if self.observer.is_page_request(query):
+                observation, status, shown = self.observer.next_page(query)
+                query_span.set(page=True)
+            else:
+                result, status = self.sf_connector.run_query(query)
+                observation, shown = (result, 0) if status == 0 else self.observer.shape(result)
+            query_span.set(status=status, rows=shown)
+        return observation, status, shown
         
 
     def step(self, action):
@@ -44,8 +81,7 @@ class ChatEnv(object):
         done = False
         info = {}
         if action["name"] == "execute":
-            result, status = self.sf_connector.run_query(action["content"])
-            observation = result
+            observation, status, shown = self._run_query(action["content"])
             if status == 0:
                 info["end_reason"] = {
                     "source": "agent",
@@ -53,7 +89,7 @@ class ChatEnv(object):
                     "content":  observation
                 }
             else:
-                info["observation_size"] = len(result)
+                info["observation_size"] = shown
         elif action["name"] == "respond":
             observation = "DONE"
             done = True
@@ -70,10 +106,27 @@ class ChatEnv(object):
         info["agent_actions"] = self.actions
         return str(observation), reward, done, info
 
-    
+    async def areset(self, task_index: int = 0):
+        return self.reset(task_index=task_index)
+
+    async def astep(self, action):
+        # The Salesforce client and the evaluator are blocking, so run the step off the event loop
+        return await asyncio.to_thread(self.step, action)
         
     def calculate_reward(self, is_end=False) -> float:
-        reward_info = self.evaluator.evaluate(self.actions[-1]["content"], self.task["answer"], self.task["reward_metric"], self.task["task"], [action["content"] for action in self.actions])
+        evaluation = dict(
+            proposed_answer=self.actions[-1]["content"],
+            gt_answer=self.task["answer"],
+            reward_metric=self.task["reward_metric"],
+            task_name=self.task["task"],
+            action_trajectory=[action["content"] for action in self.actions],
+        )
+        with span("evaluator", metric=evaluation["reward_metric"]):
+            reward_info = self.evaluator.evaluate(**evaluation, defer=self.deferred_eval)
+        if reward_info is None:
+            self.pending_evaluation = evaluation
+            print(f"Ground Truth: {self.task['answer']} || Evaluation deferred")
+            return {"reward": 0, "parsed_answer": None}
         reward = reward_info["reward"]
         parsed_answer = reward_info["parsed_answer"]
         print(f"Ground Truth: {self.task['answer']} || Prediction: {parsed_answer} || Reward: {reward}")
@@ -88,7 +141,9 @@ class ToolEnv(object):
         tools: List[Callable],
         tasks: List[Dict],
         task_index: Optional[int] = None,
-        org_type: str = "original"
+        org_type: str = "original",
+        local_snapshot: Optional[str] = None,
+        obs_format: Optional[str] = None,
     ) -> None:
         super().__init__()
         self.tasks = tasks
@@ -99,7 +154,9 @@ class ToolEnv(object):
         self.task = tasks[self.task_index]
         self.actions: List = []
         assert org_type == "original", "ToolEnv only supports original Salesforce credentials"
-        self.sf_connector = SalesforceConnector(org_type=org_type)
+        self.sf_connector = make_connector(org_type, local_snapshot)
+        # encodes the records returned by query tools; NEXT paging is not available to tool calls
+        self.observer = ObservationShaper(fmt=obs_format)
         
         self.tools = tools
         self.tools_dict = {tool.__name__: tool for tool in tools}
@@ -140,9 +197,12 @@ class ToolEnv(object):
                     reward, done = 0, False
             else:
                 try:
-                    observation = self.tools_dict[action["name"]](
-                        **action["arguments"], sf_connector=self.sf_connector
-                    )
+                    with span("tool", tool=action["name"]):
+                        observation = self.tools_dict[action["name"]](
+                            **action["arguments"], sf_connector=self.sf_connector
+                        )
+                    if is_record_list(observation):
+                        observation, _ = self.observer.shape(observation)
                 except Exception as e:
                     observation = f"Error: {e}"
                 reward, done = 0, False
@@ -164,6 +224,13 @@ class ToolEnv(object):
         info["agent_actions"] = self.actions
         return str(observation), reward, done, info
 
+    async def areset(self, task_index: int = 0):
+        return self.reset(task_index=task_index)
+
+    async def astep(self, action):
+        # Tools issue blocking Salesforce queries, so run the step off the event loop
+        return await asyncio.to_thread(self.step, action)
+
     def calculate_reward(self, is_end=False) -> float:
         proposed_answer = self.actions[-1]["arguments"]["content"]
         gt_answer = self.task["answer"]
@@ -188,9 +255,14 @@ class InteractiveChatEnv(ChatEnv):
         user_model: str = "gpt-4o-2024-08-06",
         user_provider: Optional[str] = "openai",
         org_type: str = "b2b",
+        local_snapshot: Optional[str] = None,
+        max_obs_rows: Optional[int] = None,
+        max_obs_chars: Optional[int] = None,
+        obs_format: Optional[str] = None,
+        deferred_eval: bool = False,
     ) -> None:
     
-        super().__init__(tasks=tasks, task_index=task_index, org_type=org_type)
+        super().__init__(tasks=tasks, task_index=task_index, org_type=org_type, local_snapshot=local_snapshot, max_obs_rows=max_obs_rows, max_obs_chars=max_obs_chars, obs_format=obs_format, deferred_eval=deferred_eval)
         self.user = LLMUserSimulationEnv(model=user_model, provider=user_provider)
         self.max_user_turns = max_user_turns
         self.current_user_turn = 0
@@ -211,8 +283,7 @@ class InteractiveChatEnv(ChatEnv):
                 "content":  action["content"]
             }
         if action["name"] == "execute":
-            result, status = self.sf_connector.run_query(action["content"])
-            observation = result
+            observation, status, shown = self._run_query(action["content"])
             if status == 0:
                 info["end_reason"] = {
                     "source": "agent",
@@ -220,7 +291,7 @@ class InteractiveChatEnv(ChatEnv):
                     "content":  observation
                 }
             else:
-                info["observation_size"] = len(result)
+                info["observation_size"] = shown
         # elif action["name"] == "submit":
         #     observation = "DONE"
         #     done = True
@@ -255,12 +326,23 @@ class InteractiveChatEnv(ChatEnv):
         info["agent_actions"] = self.actions
         return str(observation), reward, done, info
     
+    async def astep(self, action):
+        # Queries, the user simulator and the evaluator are blocking, so run the step off the event loop
+        return await asyncio.to_thread(self.step, action)
+    
     def reset(self, task_index: int = 0):
         _, metadata = super().reset(task_index=task_index)
         print(self.task)
         initial_observation = self.user.reset(instruction=self.task["query"], persona=self.task["persona"])
         self.current_user_turn = 0
         return initial_observation, metadata
+
+    async def areset(self, task_index: int = 0):
+        _, metadata = ChatEnv.reset(self, task_index=task_index)
+        print(self.task)
+        initial_observation = await self.user.areset(instruction=self.task["query"], persona=self.task["persona"])
+        self.current_user_turn = 0
+        return initial_observation, metadata
     
     
     
@@ -272,7 +354,22 @@ class Evaluator(object):
         self.model = model
         self.provider = provider
         self.total_cost = 0.0
-        
+        # Resolved once: `evaluate_batch` calls the evaluator from several threads
+        if (self.model.startswith("meta.llama3") or self.model.startswith("us.meta.llama")) and os.environ.get("AWS_BEARER_TOKEN_BEDROCK") and os.environ.get("AWS_REGION_NAME"):
+            self.model = f"bedrock/{self.model}"
+            print(f"[litellm] Using Bedrock with bearer token for model: {self.model}")
+
+            # Set AWS environment variables for LiteLLM (required for v1.74.15+)
+            bearer_token = os.environ.get("AWS_BEARER_TOKEN_BEDROCK")
+            region = os.environ.get("AWS_REGION_NAME")
+            
+            os.environ['AWS_SESSION_TOKEN'] = bearer_token
+            os.environ['AWS_REGION_NAME'] = region
+            os.environ['AWS_ACCESS_KEY_ID'] = 'dummy'
+            os.environ['AWS_SECRET_ACCESS_KEY'] = 'dummy'
+            
+            print("AWS_REGION_NAME:", region)
+            print("AWS credentials configured for LiteLLM")
         
         self.base_system_prompt_template = """
                 You are an evaluator that extracts specific information from text responses from an AI agent.
@@ -396,45 +493,39 @@ class Evaluator(object):
         ).strip()
         
         
-    def parse_answers(self, model_output: str, task_name: str) -> str:
-        # TODO: change system prompt based on task name
+    def extraction_prompt(self, task_name: str) -> Tuple[str, str]:
+        """Return the name and text of the system prompt used to extract the answer of a task."""
         if task_name == "best_region_identification":
-            system_prompt = self.state_system_prompt
+            return "state_system_prompt", self.state_system_prompt
         elif task_name == "monthly_trend_analysis":
-            system_prompt = self.month_system_prompt
+            return "month_system_prompt", self.month_system_prompt
         elif task_name == "lead_qualification":
-            system_prompt = self.bant_system_prompt
+            return "bant_system_prompt", self.bant_system_prompt
         elif task_name == "wrong_stage_rectification":
-            system_prompt = self.opportunity_stage_system_prompt
+            return "opportunity_stage_system_prompt", self.opportunity_stage_system_prompt
         else:
-            system_prompt = self.id_system_prompt
-                
+            return "id_system_prompt", self.id_system_prompt
+
+    def parse_answers(self, model_output: str, task_name: str) -> str:
+        _, system_prompt = self.extraction_prompt(task_name)
         
         messages = [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": model_output}
         ]
-        if (self.model.startswith("meta.llama3") or self.model.startswith("us.meta.llama")) and os.environ.get("AWS_BEARER_TOKEN_BEDROCK") and os.environ.get("AWS_REGION_NAME"):
-            self.model = f"bedrock/{self.model}"
-            print(f"[litellm] Using Bedrock with bearer token for model: {self.model}")
-
-            # Set AWS environment variables for LiteLLM (required for v1.74.15+)
-            bearer_token = os.environ.get("AWS_BEARER_TOKEN_BEDROCK")
-            region = os.environ.get("AWS_REGION_NAME")
-            
-            os.environ['AWS_SESSION_TOKEN'] = bearer_token
-            os.environ['AWS_REGION_NAME'] = region
-            os.environ['AWS_ACCESS_KEY_ID'] = 'dummy'
-            os.environ['AWS_SECRET_ACCESS_KEY'] = 'dummy'
-            
-            print("AWS_REGION_NAME:", region)
-            print("AWS credentials configured for LiteLLM")
-        
-        res = litellm.completion(
+        request = dict(
             model=self.model, 
             custom_llm_provider=self.provider, 
             messages=messages
         )
+        res = cache_lookup(request, self.provider)
+        if res is None:
+            # paced, and retried on 429s, like the agents sharing this provider/model
+            res = limited_completion(get_rate_limiter(self.provider, self.model), litellm.completion, request, estimate_input_tokens(messages))
+            cache_store(request, res, self.provider)
+        else:
+            current_span().set(cache_hit=True)
+        record_usage(current_span(), res)
         extracted_answers = res.choices[0].message
         try:
             parsed_answers = json.loads(extracted_answers.content)["extracted_answers"]
@@ -532,9 +623,17 @@ class Evaluator(object):
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": model_output}
         ]
-        res = litellm.completion(
+        request = dict(
             model=self.model, custom_llm_provider=self.provider, messages=messages
         )
+        res = cache_lookup(request, self.provider)
+        if res is None:
+            # paced, and retried on 429s, like the agents sharing this provider/model
+            res = limited_completion(get_rate_limiter(self.provider, self.model), litellm.completion, request, estimate_input_tokens(messages))
+            cache_store(request, res, self.provider)
+        else:
+            current_span().set(cache_hit=True)
+        record_usage(current_span(), res)
         
         if "yes" in res.choices[0].message.content.strip().lower() :
             return 1
@@ -543,8 +642,11 @@ class Evaluator(object):
  
         
         
-    def evaluate(self, proposed_answer: str, gt_answer: List[str], reward_metric: str, task_name: str, action_trajectory: List[str]) -> float:
-        
+    def evaluate(self, proposed_answer: str, gt_answer: List[str], reward_metric: str, task_name: str, action_trajectory: List[str], defer: bool = False) -> float:
+        """
+        Score a proposed answer. With `defer`, returns None instead of making an LLM call, so the
+        answer can be scored later with `evaluate_batch`; answers that need no LLM are scored right away.
+        """
         
         if gt_answer[0] == None:
             gt_answer = ["None"]
@@ -564,8 +666,13 @@ class Evaluator(object):
                         "parsed_answer": [cleaned_proposed],
                         "reward": 1
                     }
-                        
-            parsed_answers = sorted(self.parse_answers(proposed_answer, task_name))
+            # bare answers (Ids, states, months, ...) are extracted with rules; the LLM handles the rest
+            parsed_answers = extract_answer(proposed_answer, task_name)
+            if parsed_answers is None:
+                if defer:
+                    return None
+                parsed_answers = self.parse_answers(proposed_answer, task_name)
+            parsed_answers = sorted(parsed_answers)
             try:
                 if parsed_answers == sorted(gt_answer):
                     reward = 1
@@ -577,9 +684,48 @@ class Evaluator(object):
             reward = get_all_metrics(proposed_answer, gt_answer[0])
             parsed_answers = [proposed_answer]
         elif reward_metric == "privacy_rejection":
+            if defer:
+                return None
             parsed_answers = [proposed_answer]
             reward = self.compute_privacy_confidential_awareness_score(action_trajectory)
         return {
             "parsed_answer": parsed_answers,
             "reward": reward
-        }
\ No newline at end of file
+        }
+
+    def evaluate_batch(self, items: List[Dict[str, Any]], max_workers: int = 8) -> List[Optional[Dict[str, Any]]]:
+        """
+        Score many answers at once; each item holds the keyword arguments of `evaluate`. Answers
+        that need an LLM call are grouped by system prompt, and each group is sent as one
+        concurrent batch (paced by the rate limiter) before the next, so requests sharing a prompt
+        prefix reach the provider together. An item whose evaluation fails (e.g. 429s beyond the
+        retries) gets None instead of failing the batch.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        groups: Dict[str, List[int]] = {}
+        fuzzy = [i for i, item in enumerate(items) if item["reward_metric"] == "fuzzy_match"]
+        # a missing ground truth is scored against "None", as in `evaluate`
+        gt_answers = ["None" if items[i]["gt_answer"][0] is None else items[i]["gt_answer"][0] for i in fuzzy]
+        scores = get_all_metrics_batch([items[i]["proposed_answer"] for i in fuzzy], gt_answers)
+        for i, reward in zip(fuzzy, scores):
+            results[i] = {"parsed_answer": [items[i]["proposed_answer"]], "reward": reward}
+        for i, item in enumerate(items):
+            if results[i] is not None:
+                continue
+            results[i] = self.evaluate(**item, defer=True)
+            if results[i] is None:
+                if item["reward_metric"] == "privacy_rejection":
+                    prompt_name = "privacy_system_prompt"
+                else:
+                    prompt_name, _ = self.extraction_prompt(item["task_name"])
+                groups.setdefault(prompt_name, []).append(i)
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for prompt_name, indices in groups.items():
+                print(f"Evaluating {len(indices)} answers with the {prompt_name}")
+                futures = {executor.submit(self.evaluate, **items[i]): i for i in indices}
+                for future in as_completed(futures):
+                    try:
+                        results[futures[future]] = future.result()
+                    except Exception as e:
+                        print(f"Evaluation failed, leaving the answer unscored: {e}")
+        return results
@@ -0,0 +1,125 @@
+"""
+Rule-based answer extraction tried before the LLM evaluator. Each extractor only accepts "bare"
+answers: the entities it recognizes plus connecting words ("The Case ID is 500...", "NY and CA",
+"Budget, Authority"). Anything else, such as negations, alternatives ("NY or CA"), explanations
+or unknown words, is ambiguous and left to the LLM. Months, BANT factors and stages are only
+recognized when capitalized, so that words like "may", "need" or "closed" are not read as answers.
+"""
+
+import re
+from typing import Callable, Dict, List, Optional, Tuple
+
+_WORD = re.compile(r"[A-Za-z0-9']+")
+# Words allowed around the extracted entities
+_FILLER = frozenset("""
+a an the is are was were be it its this that these those and of for to in on with as at by
+answer answers final result results here found
+id ids record records case cases account accounts contact contacts lead leads opportunity opportunities
+agent agents user users owner owners order orders product products article articles quote quotes
+state states region regions month months stage stages factor factors bant unmet missing
+""".split())
+
+_SF_ID = re.compile(r"\b[A-Za-z0-9]{15}(?:[A-Za-z0-9]{3})?\b")
+_MONTHS = ["January", "February", "March", "April", "May", "June", "July", "August", "September", "October", "November", "December"]
+_MONTH = re.compile(r"\b(" + "|".join(_MONTHS) + r")\b")
+_BANT = re.compile(r"\b(Budget|Authority|Need|Timeline)\b")
+_STAGES = ["Qualification", "Discovery", "Quote", "Negotiation", "Closed"]
+_STAGE = re.compile(r"\b(" + "|".join(_STAGES) + r")\b")
+
+_STATE_NAMES = {
+    "Alabama": "AL", "Alaska": "AK", "Arizona": "AZ", "Arkansas": "AR", "California": "CA", "Colorado": "CO",
+    "Connecticut": "CT", "Delaware": "DE", "Florida": "FL", "Georgia": "GA", "Hawaii": "HI", "Idaho": "ID",
+    "Illinois": "IL", "Indiana": "IN", "Iowa": "IA", "Kansas": "KS", "Kentucky": "KY", "Louisiana": "LA",
+    "Maine": "ME", "Maryland": "MD", "Massachusetts": "MA", "Michigan": "MI", "Minnesota": "MN",
+    "Mississippi": "MS", "Missouri": "MO", "Montana": "MT", "Nebraska": "NE", "Nevada": "NV",
+    "New Hampshire": "NH", "New Jersey": "NJ", "New Mexico": "NM", "New York": "NY", "North Carolina": "NC",
+    "North Dakota": "ND", "Ohio": "OH", "Oklahoma": "OK", "Oregon": "OR", "Pennsylvania": "PA",
+    "Rhode Island": "RI", "South Carolina": "SC", "South Dakota": "SD", "Tennessee": "TN", "Texas": "TX",
+    "Utah": "UT", "Vermont": "VT", "Virginia": "VA", "Washington": "WA", "West Virginia": "WV",
+    "Wisconsin": "WI", "Wyoming": "WY", "District of Columbia": "DC",
+}
+_STATE_CODES = frozenset(_STATE_NAMES.values())
+# Codes that are also common English words or abbreviations when written in capitals
+_AMBIGUOUS_STATE_CODES = frozenset(["IN", "ME", "OK", "OR", "HI", "ID", "OH", "AS", "DE", "LA", "MA", "CO", "PA"])
+# Longest names first, so that "West Virginia" is not read as "Virginia"
+_STATE_NAME = re.compile(r"\b(" + "|".join(sorted(_STATE_NAMES, key=len, reverse=True)) + r")\b", re.IGNORECASE)
+_STATE_CODE = re.compile(r"\b([A-Z]{2})\b")
+_STATE_LOOKUP = {name.lower(): code for name, code in _STATE_NAMES.items()}
+
+_NONE_ANSWERS = frozenset(["none", "none.", "[none]", "[\"none\"]", "['none']"])
+
+
+def _bare_answer(text: str, rules: List[Tuple[re.Pattern, Callable[[str], Optional[str]]]]) -> Optional[List[str]]:
+    """
+    Collect the entities matched by `rules` (pattern, normalizer returning None for a non-match) and
+    return them in order without duplicates, or None when the rest of the text is not filler.
+    """
+    found = []
+
+    def take(normalize):
+        def replace(match):
+            value = normalize(match.group(0))
+            if value is None:
+                return match.group(0)
+            found.append(value)
+            return " "
+        return replace
+
+    rest = text
+    for pattern, normalize in rules:
+        rest = pattern.sub(take(normalize), rest)
+    if not found or any(word.lower() not in _FILLER for word in _WORD.findall(rest)):
+        return None
+    return list(dict.fromkeys(found))
+
+
+def _sf_id(value: str) -> Optional[str]:
+    # record Ids always contain digits; this keeps 15/18-letter words out
+    return value if any(c.isdigit() for c in value) else None
+
+
+def extract_ids(text: str) -> Optional[List[str]]:
+    return _bare_answer(text, [(_SF_ID, _sf_id)])
+
+
+def extract_states(text: str) -> Optional[List[str]]:
+    answers = _bare_answer(text, [
+        (_STATE_NAME, lambda name: _STATE_LOOKUP[name.lower()]),
+        (_STATE_CODE, lambda code: code if code in _STATE_CODES else None),
+    ])
+    if answers is None or any(code in _AMBIGUOUS_STATE_CODES for code in answers):
+        return None
+    return answers
+
+
+def extract_months(text: str) -> Optional[List[str]]:
+    return _bare_answer(text, [(_MONTH, lambda month: month)])
+
+
+def extract_bant_factors(text: str) -> Optional[List[str]]:
+    return _bare_answer(text, [(_BANT, lambda factor: factor)])
+
+
+def extract_opportunity_stage(text: str) -> Optional[List[str]]:
+    answers = _bare_answer(text, [(_STAGE, lambda stage: stage)])
+    # the evaluator prompt extracts exactly one stage
+    if answers is None or len(answers) != 1:
+        return None
+    return answers
+
+
+# Keyed by task name like `Evaluator.extraction_prompt`; other tasks extract Salesforce Ids
+TASK_EXTRACTORS: Dict[str, Callable[[str], Optional[List[str]]]] = {
+    "best_region_identification": extract_states,
+    "monthly_trend_analysis": extract_months,
+    "lead_qualification": extract_bant_factors,
+    "wrong_stage_rectification": extract_opportunity_stage,
+}
+
+
+def extract_answer(text: str, task_name: str) -> Optional[List[str]]:
+    """Extract the answer of a bare agent response, or return None when the LLM evaluator is needed."""
+    text = text.strip()
+    if text.lower() in _NONE_ANSWERS:
+        return ["None"]
+    return TASK_EXTRACTORS.get(task_name, extract_ids)(text)
@@ -0,0 +1,924 @@
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from crm_sandbox.env.connect_sandbox import SalesforceConnector
+from crm_sandbox.env.query_cache import QueryCache, get_query_cache
+
+
+class SOQLError(Exception):
+    """A query the local sandbox rejects, reported with the same error codes as the live API."""
+
+    def __init__(self, error_code: str, message: str) -> None:
+        super().__init__(f"{error_code}: {message}")
+        self.error_code = error_code
+        self.message = message
+
+
+# ---------------------------------------------------------------------------
+# Snapshot storage
+#
+# Every sObject is a table named after the object with one column per field. Booleans are
+# stored as 0/1 and datetimes as "YYYY-MM-DDTHH:MM:SS.000+0000" (UTC), the format returned by
+# the REST API, so that literal comparisons work on the raw text. Two metadata tables describe
+# field types and the relationship names used for parent lookups (e.g. Order.Account).
+# ---------------------------------------------------------------------------
+
+FIELDS_TABLE = "_sf_fields"
+RELATIONSHIPS_TABLE = "_sf_relationships"
+# Records per page yielded by `iter_query`, the REST API batch size
+PAGE_SIZE = 2000
+
+_SQLITE_TYPES = {
+    "boolean": "INTEGER",
+    "int": "INTEGER",
+    "double": "REAL",
+    "currency": "REAL",
+    "percent": "REAL",
+}
+# Compound fields duplicate their component fields (BillingCity, ...) and are not stored
+_COMPOUND_TYPES = {"address", "location"}
+
+
+def format_sf_datetime(value: datetime) -> str:
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return value.strftime("%Y-%m-%dT%H:%M:%S.000+0000")
+
+
+def normalize_sf_datetime(value: Any) -> Optional[str]:
+    """Convert an ISO-8601 datetime (string or datetime) to the stored UTC text format."""
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return format_sf_datetime(value)
+    text = str(value).strip().replace("Z", "+00:00")
+    # Python < 3.11 does not accept "+0000" offsets without a colon
+    text = re.sub(r"([+-]\d{2})(\d{2})$", r"\1:\2", text)
+    try:
+        return format_sf_datetime(datetime.fromisoformat(text))
+    except ValueError:
+        return str(value)
+
+
+def init_snapshot_db(conn: sqlite3.Connection) -> None:
+    conn.execute(f'CREATE TABLE IF NOT EXISTS {FIELDS_TABLE} (object TEXT, field TEXT, type TEXT, PRIMARY KEY (object, field))')
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {RELATIONSHIPS_TABLE} "
+        "(object TEXT, relationship TEXT, field TEXT, target TEXT, PRIMARY KEY (object, relationship))"
+    )
+
+
+def create_object_table(conn: sqlite3.Connection, obj: str, fields: List[Dict[str, Any]]) -> List[str]:
+    """
+    Create the table of one sObject from describe()-style field dicts
+    (`name`, `type`, optional `referenceTo` and `relationshipName`).
+    Returns the names of the stored fields.
+    """
+    init_snapshot_db(conn)
+    fields = [f for f in fields if f["type"] not in _COMPOUND_TYPES]
+    columns = []
+    for field in fields:
+        column = f'"{field["name"]}" {_SQLITE_TYPES.get(field["type"], "TEXT")}'
+        if field["name"] == "Id":
+            column += " PRIMARY KEY"
+        columns.append(column)
+    conn.execute(f'DROP TABLE IF EXISTS "{obj}"')
+    conn.execute(f'CREATE TABLE "{obj}" ({", ".join(columns)})')
+    conn.execute(f"DELETE FROM {FIELDS_TABLE} WHERE object = ?", (obj,))
+    conn.execute(f"DELETE FROM {RELATIONSHIPS_TABLE} WHERE object = ?", (obj,))
+    conn.executemany(
+        f"INSERT INTO {FIELDS_TABLE} (object, field, type) VALUES (?, ?, ?)",
+        [(obj, f["name"], f["type"]) for f in fields],
+    )
+    for field in fields:
+        if field.get("relationshipName") and field.get("referenceTo"):
+            # Polymorphic lookups (e.g. Owner -> User/Group) resolve to their first target
+            conn.execute(
+                f"INSERT OR REPLACE INTO {RELATIONSHIPS_TABLE} (object, relationship, field, target) VALUES (?, ?, ?, ?)",
+                (obj, field["relationshipName"], field["name"], field["referenceTo"][0]),
+            )
+            conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_{obj}_{field["name"]}" ON "{obj}" ("{field["name"]}")')
+    return [f["name"] for f in fields]
+
+
+def insert_records(conn: sqlite3.Connection, obj: str, records: List[Dict[str, Any]]) -> int:
+    """Insert API-shaped records into an object table created with `create_object_table`."""
+    field_types = dict(conn.execute(f"SELECT field, type FROM {FIELDS_TABLE} WHERE object = ?", (obj,)).fetchall())
+    names = list(field_types)
+    rows = []
+    for record in records:
+        row = []
+        for name in names:
+            value = record.get(name)
+            if value is not None:
+                if field_types[name] == "datetime":
+                    value = normalize_sf_datetime(value)
+                elif field_types[name] == "boolean":
+                    value = int(bool(value))
+                elif field_types[name] == "date" and isinstance(value, (date, datetime)):
+                    value = value.strftime("%Y-%m-%d")
+                elif isinstance(value, (dict, list)):
+                    value = str(value)
+            row.append(value)
+        rows.append(row)
+    columns = ", ".join(f'"{n}"' for n in names)
+    placeholders = ", ".join("?" for _ in names)
+    conn.executemany(f'INSERT OR REPLACE INTO "{obj}" ({columns}) VALUES ({placeholders})', rows)
+    return len(rows)
+
+
+class _Catalog(object):
+    """Case-insensitive lookup of objects, fields and relationships in a snapshot."""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        super().__init__()
+        self.objects: Dict[str, str] = {}
+        self.fields: Dict[str, Dict[str, Tuple[str, str]]] = {}
+        self.relationships: Dict[Tuple[str, str], Tuple[str, str, str]] = {}
+        tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        types: Dict[Tuple[str, str], str] = {}
+        if FIELDS_TABLE in tables:
+            for obj, field, ftype in conn.execute(f"SELECT object, field, type FROM {FIELDS_TABLE}"):
+                types[(obj, field)] = ftype
+        for table in tables:
+            if table.startswith("_sf_") or table.startswith("sqlite_"):
+                continue
+            self.objects[table.lower()] = table
+            columns = {}
+            for _, name, decl, *_ in conn.execute(f'PRAGMA table_info("{table}")'):
+                ftype = types.get((table, name)) or {"INTEGER": "int", "REAL": "double"}.get(decl.upper(), "string")
+                columns[name.lower()] = (name, ftype)
+            self.fields[table.lower()] = columns
+        if RELATIONSHIPS_TABLE in tables:
+            for obj, rel, field, target in conn.execute(f"SELECT object, relationship, field, target FROM {RELATIONSHIPS_TABLE}"):
+                self.relationships[(obj.lower(), rel.lower())] = (rel, field, target)
+
+    def object_name(self, name: str) -> str:
+        if name.lower() not in self.objects:
+            raise SOQLError(
+                "INVALID_TYPE",
+                f"sObject type '{name}' is not supported. If you are attempting to use a custom object, be sure to append the '__c' after the entity name. Please reference your WSDL or the describe call for the appropriate names.",
+            )
+        return self.objects[name.lower()]
+
+    def field(self, obj: str, name: str) -> Tuple[str, str]:
+        columns = self.fields[obj.lower()]
+        if name.lower() not in columns:
+            raise SOQLError(
+                "INVALID_FIELD",
+                f"No such column '{name}' on entity '{obj}'. If you are attempting to use a custom field, be sure to append the '__c' after the custom field name. Please reference your WSDL or the describe call for the appropriate names.",
+            )
+        return columns[name.lower()]
+
+    def relationship(self, obj: str, name: str) -> Tuple[str, str, str]:
+        """Return (relationship name, lookup field, target object) for a parent relationship."""
+        key = (obj.lower(), name.lower())
+        if key in self.relationships:
+            return self.relationships[key]
+        # Snapshots without relationship metadata: AccountId -> Account, Foo__c -> Foo__r
+        columns = self.fields[obj.lower()]
+        if name.lower().endswith("__r") and name.lower()[:-3] + "__c" in columns:
+            field = columns[name.lower()[:-3] + "__c"][0]
+            target = name[:-3] + "__c"
+            if target.lower() in self.objects:
+                return name, field, self.objects[target.lower()]
+        if name.lower() + "id" in columns:
+            field = columns[name.lower() + "id"][0]
+            target = "User" if name.lower() in ("owner", "createdby", "lastmodifiedby") else name
+            if target.lower() in self.objects:
+                return name, field, self.objects[target.lower()]
+        raise SOQLError(
+            "INVALID_FIELD",
+            f"Didn't understand relationship '{name}' in field path. If you are attempting to use a custom relationship, be sure to append the '__r' after the custom relationship name. Please reference your WSDL or the describe call for the appropriate names.",
+        )
+
+
+# ---------------------------------------------------------------------------
+# SOQL -> SQLite translation
+# ---------------------------------------------------------------------------
+
+_TOKEN_PATTERN = re.compile(
+    r"""\s*(?:
+        (?P<string>'(?:\\.|[^'\\])*')
+      | (?P<datetime>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})?)
+      | (?P<date>\d{4}-\d{2}-\d{2})
+      | (?P<datelit>[A-Za-z_]+:\d+)
+      | (?P<number>-?\d+(?:\.\d+)?)
+      | (?P<op><=|>=|!=|<>|=|<|>)
+      | (?P<punct>[(),])
+      | (?P<ident>[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)
+    )""",
+    re.VERBOSE,
+)
+
+_KEYWORDS = {
+    "SELECT", "FROM", "WHERE", "WITH", "GROUP", "BY", "HAVING", "ORDER", "LIMIT", "OFFSET", "FOR",
+    "USING", "AND", "OR", "NOT", "IN", "LIKE", "INCLUDES", "EXCLUDES", "ASC", "DESC", "NULLS",
+}
+_AGGREGATES = {"COUNT", "COUNT_DISTINCT", "SUM", "AVG", "MIN", "MAX"}
+_PASSTHROUGH_FUNCTIONS = {"TOLABEL", "CONVERTCURRENCY", "FORMAT"}
+
+
+def _date_part(expr: str, fmt: str) -> str:
+    return f"CAST(strftime('{fmt}', substr({expr}, 1, 19)) AS INTEGER)"
+
+
+_DATE_FUNCTIONS = {
+    "CALENDAR_YEAR": lambda e: _date_part(e, "%Y"),
+    "CALENDAR_MONTH": lambda e: _date_part(e, "%m"),
+    "CALENDAR_QUARTER": lambda e: f"(({_date_part(e, '%m')} + 2) / 3)",
+    "DAY_IN_MONTH": lambda e: _date_part(e, "%d"),
+    "DAY_IN_WEEK": lambda e: f"({_date_part(e, '%w')} + 1)",
+    "DAY_IN_YEAR": lambda e: _date_part(e, "%j"),
+    "WEEK_IN_YEAR": lambda e: f"(({_date_part(e, '%j')} + 6) / 7)",
+    "HOUR_IN_DAY": lambda e: _date_part(e, "%H"),
+    "DAY_ONLY": lambda e: f"substr({e}, 1, 10)",
+    # The sandbox orgs use the default fiscal year, which starts in January
+    "FISCAL_YEAR": lambda e: _date_part(e, "%Y"),
+    "FISCAL_MONTH": lambda e: _date_part(e, "%m"),
+    "FISCAL_QUARTER": lambda e: f"(({_date_part(e, '%m')} + 2) / 3)",
+}
+
+
+def _tokenize(query: str) -> List[Tuple[str, str]]:
+    tokens, pos, query = [], 0, query.strip()
+    while pos < len(query):
+        m = _TOKEN_PATTERN.match(query, pos)
+        if m is None or m.end() == pos:
+            if query[pos:].strip() == "":
+                break
+            raise SOQLError("MALFORMED_QUERY", f"unexpected token: '{query[pos:].split()[0]}'")
+        kind = m.lastgroup
+        tokens.append((kind, m.group(kind)))
+        pos = m.end()
+    tokens.append(("eof", ""))
+    return tokens
+
+
+def _unescape(literal: str, like: bool = False) -> str:
+    body = literal[1:-1]
+    escapes = {"n": "\n", "t": "\t", "r": "\r", "'": "'", '"': '"', "\\": "\\"}
+
+    def replace(m):
+        char = m.group(1)
+        if like and char in "%_":
+            # Kept escaped for LIKE ... ESCAPE '\'
+            return "\\" + char
+        if like and char == "\\":
+            return "\\\\"
+        return escapes.get(char, char)
+
+    return re.sub(r"\\(.)", replace, body)
+
+
+def _soql_string(value: str) -> str:
+    return "'" + value.replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def _sql_literal(value: Any) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def _shift(start: date, unit: str, amount: int) -> date:
+    if unit == "DAY":
+        return start + timedelta(days=amount)
+    if unit == "WEEK":
+        return start + timedelta(days=7 * amount)
+    months = {"MONTH": 1, "QUARTER": 3, "YEAR": 12}[unit] * amount
+    index = start.year * 12 + start.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _unit_start(today: date, unit: str) -> date:
+    if unit == "DAY":
+        return today
+    if unit == "WEEK":
+        # Weeks start on Sunday (en_US locale)
+        return today - timedelta(days=(today.weekday() + 1) % 7)
+    if unit == "MONTH":
+        return today.replace(day=1)
+    if unit == "QUARTER":
+        return date(today.year, (today.month - 1) // 3 * 3 + 1, 1)
+    return date(today.year, 1, 1)
+
+
+def date_literal_range(literal: str, today: date) -> Optional[Tuple[date, date]]:
+    """Return the [start, end) date range of a SOQL date literal such as LAST_N_DAYS:30, or None."""
+    name, _, n = literal.upper().replace("_FISCAL", "").partition(":")
+    n = int(n) if n else None
+    fixed = {"TODAY": ("DAY", 0, 1), "YESTERDAY": ("DAY", -1, 0), "TOMORROW": ("DAY", 1, 2),
+             "LAST_90_DAYS": ("DAY", -90, 1), "NEXT_90_DAYS": ("DAY", 1, 91)}
+    if name in fixed and n is None:
+        unit, a, b = fixed[name]
+    elif (m := re.fullmatch(r"(THIS|LAST|NEXT)_(WEEK|MONTH|QUARTER|YEAR)", name)) and n is None:
+        unit = m.group(2)
+        a = {"THIS": 0, "LAST": -1, "NEXT": 1}[m.group(1)]
+        b = a + 1
+    elif (m := re.fullmatch(r"(LAST|NEXT)_N_(DAY|WEEK|MONTH|QUARTER|YEAR)S", name)) and n is not None:
+        unit = m.group(2)
+        if m.group(1) == "NEXT":
+            a, b = 1, n + 1
+        else:
+            # LAST_N_DAYS includes today; the other units end with the previous period
+            a, b = -n, 1 if unit == "DAY" else 0
+    elif (m := re.fullmatch(r"N_(DAY|WEEK|MONTH|QUARTER|YEAR)S_AGO", name)) and n is not None:
+        unit, a, b = m.group(1), -n, -n + 1
+    else:
+        return None
+    start = _unit_start(today, unit)
+    return _shift(start, unit, a), _shift(start, unit, b)
+
+
+class _Column(object):
+    def __init__(self, sql: str, key: str, ftype: str, path: List[Tuple[str, str]] = None, aggregate: bool = False) -> None:
+        super().__init__()
+        self.sql = sql
+        self.key = key
+        self.ftype = ftype
+        # (relationship name, join alias) pairs leading to the field, for nested output records
+        self.path = path or []
+        self.aggregate = aggregate
+
+
+class CompiledQuery(object):
+    def __init__(self, sql: str, columns: List[_Column], join_ids: List[str], is_aggregate: bool, count_only: bool) -> None:
+        super().__init__()
+        self.sql = sql
+        self.columns = columns
+        self.join_ids = join_ids
+        self.is_aggregate = is_aggregate
+        self.count_only = count_only
+
+    def build_record(self, row: tuple) -> Dict[str, Any]:
+        """Shape a SQLite row like an API record: parent fields are nested under their relationship."""
+        record: Dict[str, Any] = {}
+        join_present = {alias: row[len(self.columns) + i] is not None for i, alias in enumerate(self.join_ids)}
+        for column, value in zip(self.columns, row):
+            if column.ftype == "boolean" and value is not None:
+                value = bool(value)
+            target = record
+            for relationship, alias in column.path:
+                if not join_present[alias]:
+                    target.setdefault(relationship, None)
+                    target = None
+                    break
+                if target.get(relationship) is None:
+                    target[relationship] = {}
+                target = target[relationship]
+            if target is not None:
+                target[column.key] = value
+        return record
+
+
+class _SelectTranslator(object):
+    """Recursive-descent translator for one SELECT (semi-join subqueries get their own instance)."""
+
+    def __init__(self, catalog: _Catalog, tokens: List[Tuple[str, str]], today: date, pos: int = 0, alias_counter: List[int] = None) -> None:
+        super().__init__()
+        self.catalog = catalog
+        self.tokens = tokens
+        self.today = today
+        self.pos = pos
+        self.alias_counter = alias_counter if alias_counter is not None else [0]
+        self.joins: List[str] = []
+        self.join_aliases: Dict[Tuple[str, str], str] = {}
+
+    # -- token helpers -----------------------------------------------------
+    def peek(self, offset: int = 0) -> Tuple[str, str]:
+        return self.tokens[min(self.pos + offset, len(self.tokens) - 1)]
+
+    def peek_upper(self, offset: int = 0) -> str:
+        kind, value = self.peek(offset)
+        return value.upper() if kind == "ident" else value
+
+    def next(self) -> Tuple[str, str]:
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def accept(self, *words: str) -> bool:
+        if self.peek_upper() in words and self.peek()[0] in ("ident", "punct", "op"):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, word: str) -> None:
+        if not self.accept(word):
+            self.unexpected()
+
+    def unexpected(self):
+        kind, value = self.peek()
+        if kind == "eof":
+            raise SOQLError("MALFORMED_QUERY", "unexpected end of query")
+        raise SOQLError("MALFORMED_QUERY", f"unexpected token: '{value}'")
+
+    def new_alias(self) -> str:
+        alias = f"t{self.alias_counter[0]}"
+        self.alias_counter[0] += 1
+        return alias
+
+    # -- fields ------------------------------------------------------------
+    def resolve(self, path: str) -> Tuple[str, str, str, List[Tuple[str, str]]]:
+        """Resolve a (dotted) field path to (sql, canonical field name, type, relationship path)."""
+        parts = path.split(".")
+        if len(parts) > 1 and parts[0].lower() in (self.object.lower(), (self.object_alias or "").lower()):
+            parts = parts[1:]
+        obj, alias, rel_path = self.object, self.alias, []
+        for part in parts[:-1]:
+            relationship, field, target = self.catalog.relationship(obj, part)
+            key = (alias, relationship.lower())
+            if key not in self.join_aliases:
+                join_alias = self.new_alias()
+                self.joins.append(f'LEFT JOIN "{target}" AS {join_alias} ON {join_alias}."Id" = {alias}."{field}"')
+                self.join_aliases[key] = join_alias
+            alias = self.join_aliases[key]
+            obj = target
+            rel_path.append((relationship, alias))
+        name, ftype = self.catalog.field(obj, parts[-1])
+        return f'{alias}."{name}"', name, ftype, rel_path
+
+    def parse_field_path(self) -> str:
+        kind, value = self.next()
+        if kind != "ident":
+            self.pos -= 1
+            self.unexpected()
+        return value
+
+    def parse_function(self, name: str) -> Tuple[str, str, bool]:
+        """Parse `NAME(arg)` after its name; returns (sql, type, is_aggregate)."""
+        self.expect("(")
+        if name in _AGGREGATES:
+            if name == "COUNT" and self.accept(")"):
+                return "COUNT(*)", "int", True
+            arg_sql, _, ftype, _ = self.parse_operand_path()
+            self.expect(")")
+            if name == "COUNT":
+                return f"COUNT({arg_sql})", "int", True
+            if name == "COUNT_DISTINCT":
+                return f"COUNT(DISTINCT {arg_sql})", "int", True
+            return f"{name}({arg_sql})", ("double" if name == "AVG" else ftype), True
+        if name in _DATE_FUNCTIONS:
+            arg_sql, _, _, _ = self.parse_operand_path()
+            self.expect(")")
+            return _DATE_FUNCTIONS[name](arg_sql), ("date" if name == "DAY_ONLY" else "int"), False
+        if name in _PASSTHROUGH_FUNCTIONS:
+            arg_sql, _, ftype, _ = self.parse_operand_path()
+            self.expect(")")
+            return arg_sql, ftype, False
+        raise SOQLError("MALFORMED_QUERY", f"unsupported function: '{name}'")
+
+    def parse_operand_path(self):
+        if self.peek()[0] == "ident" and self.peek(1) == ("punct", "("):
+            name = self.next()[1].upper()
+            sql, ftype, _ = self.parse_function(name)
+            return sql, name, ftype, []
+        return self.resolve(self.parse_field_path())
+
+    def parse_operand(self) -> Tuple[str, str]:
+        sql, _, ftype, _ = self.parse_operand_path()
+        return sql, ftype
+
+    # -- values and conditions --------------------------------------------
+    def parse_value(self, ftype: str):
+        """Parse a literal; returns ("null",), ("range", start, end) or ("value", sql, is_text)."""
+        kind, value = self.next()
+        if kind == "string":
+            return ("value", _sql_literal(_unescape(value)), True)
+        if kind == "number":
+            return ("value", value, False)
+        if kind == "datetime":
+            return ("value", _sql_literal(normalize_sf_datetime(value)), False)
+        if kind == "date":
+            return ("value", _sql_literal(value), False)
+        if kind in ("ident", "datelit"):
+            upper = value.upper()
+            if upper == "NULL":
+                return ("null",)
+            if upper in ("TRUE", "FALSE"):
+                return ("value", "1" if upper == "TRUE" else "0", False)
+            date_range = date_literal_range(upper, self.today)
+            if date_range is not None:
+                start, end = (self.format_date(d, ftype) for d in date_range)
+                return ("range", start, end)
+            raise SOQLError("MALFORMED_QUERY", f"unexpected token: '{value}'")
+        self.pos -= 1
+        self.unexpected()
+
+    @staticmethod
+    def format_date(d: date, ftype: str) -> str:
+        if ftype == "date":
+            return _sql_literal(d.isoformat())
+        return _sql_literal(f"{d.isoformat()}T00:00:00.000+0000")
+
+    def parse_condition(self) -> str:
+        parts = [self.parse_conjunction()]
+        while self.accept("OR"):
+            parts.append(self.parse_conjunction())
+        return parts[0] if len(parts) == 1 else "(" + " OR ".join(parts) + ")"
+
+    def parse_conjunction(self) -> str:
+        parts = [self.parse_negation()]
+        while self.accept("AND"):
+            parts.append(self.parse_negation())
+        return parts[0] if len(parts) == 1 else "(" + " AND ".join(parts) + ")"
+
+    def parse_negation(self) -> str:
+        if self.accept("NOT"):
+            return f"NOT ({self.parse_negation()})"
+        if self.accept("("):
+            condition = self.parse_condition()
+            self.expect(")")
+            return f"({condition})"
+        return self.parse_comparison()
+
+    def parse_comparison(self) -> str:
+        expr, ftype = self.parse_operand()
+        negate = self.accept("NOT")
+        kind, value = self.next()
+        op = value.upper() if kind == "ident" else value
+        if op == "IN":
+            self.expect("(")
+            if self.peek_upper() == "SELECT":
+                sub = _SelectTranslator(self.catalog, self.tokens, self.today, self.pos, self.alias_counter)
+                compiled = sub.parse(nested=True)
+                self.pos = sub.pos
+                self.expect(")")
+                if len(compiled.columns) != 1:
+                    raise SOQLError("MALFORMED_QUERY", "semi join sub-selects can only select one field")
+                return f"{expr} {'NOT IN' if negate else 'IN'} ({compiled.sql})"
+            values = [self.parse_value(ftype)]
+            while self.accept(","):
+                values.append(self.parse_value(ftype))
+            self.expect(")")
+            literals = [v[1] for v in values if v[0] == "value"]
+            has_null = any(v[0] == "null" for v in values)
+            collate = " COLLATE NOCASE" if any(v[0] == "value" and v[2] for v in values) else ""
+            clause = f"{expr}{collate} IN ({', '.join(literals)})" if literals else "0"
+            if has_null:
+                clause = f"({clause} OR {expr} IS NULL)"
+            if negate:
+                # Like "!=", NOT IN also matches records where the field is null
+                return f"NOT ({clause})" if has_null else f"({expr} IS NULL OR NOT ({clause}))"
+            return clause
+        if op == "LIKE":
+            kind, value = self.next()
+            if kind != "string":
+                self.pos -= 1
+                self.unexpected()
+            clause = f"{expr} LIKE {_sql_literal(_unescape(value, like=True))} ESCAPE '\\'"
+            return f"NOT ({clause})" if negate else clause
+        if op in ("INCLUDES", "EXCLUDES") and not negate:
+            self.expect("(")
+            options = []
+            while True:
+                kind, value = self.next()
+                if kind != "string":
+                    self.pos -= 1
+                    self.unexpected()
+                # Each option may itself be a ';'-separated set of values that must all be present
+                parts = [p.strip() for p in _unescape(value).split(";") if p.strip()]
+                options.append(" AND ".join(f"(';' || {expr} || ';') LIKE {_sql_literal('%;' + p + ';%')}" for p in parts))
+                if not self.accept(","):
+                    break
+            self.expect(")")
+            clause = "(" + " OR ".join(f"({o})" for o in options) + ")"
+            return clause if op == "INCLUDES" else f"({expr} IS NULL OR NOT {clause})"
+        if kind != "op" or negate:
+            self.pos -= 1
+            self.unexpected()
+        op = "!=" if op == "<>" else op
+        rhs = self.parse_value(ftype)
+        if rhs[0] == "null":
+            if op == "=":
+                return f"{expr} IS NULL"
+            if op == "!=":
+                return f"{expr} IS NOT NULL"
+            return "0"
+        if rhs[0] == "range":
+            _, start, end = rhs
+            return {
+                "=": f"({expr} >= {start} AND {expr} < {end})",
+                "!=": f"({expr} IS NULL OR {expr} < {start} OR {expr} >= {end})",
+                "<": f"{expr} < {start}",
+                "<=": f"{expr} < {end}",
+                ">": f"{expr} >= {end}",
+                ">=": f"{expr} >= {start}",
+            }[op]
+        _, literal, is_text = rhs
+        collate = " COLLATE NOCASE" if is_text and op in ("=", "!=") else ""
+        if op == "!=":
+            # SOQL "!=" matches null values, unlike SQL
+            return f"({expr} IS NULL OR {expr} != {literal}{collate})"
+        return f"{expr} {op} {literal}{collate}"
+
+    # -- SELECT ------------------------------------------------------------
+    def parse_select_items(self) -> List[tuple]:
+        items = []
+        while True:
+            kind, value = self.peek()
+            if (kind, value) == ("punct", "("):
+                raise SOQLError("MALFORMED_QUERY", "child relationship subqueries are not supported by the local sandbox")
+            if kind != "ident":
+                self.unexpected()
+            self.pos += 1
+            if self.peek() == ("punct", "("):
+                name = value.upper()
+                if name == "FIELDS":
+                    self.expect("(")
+                    mode = self.next()[1].upper()
+                    self.expect(")")
+                    items.append(("fields", mode, None))
+                else:
+                    # Arguments are resolved once FROM is known; remember where they start
+                    start = self.pos
+                    depth = 0
+                    while True:
+                        token = self.next()
+                        if token == ("punct", "("):
+                            depth += 1
+                        elif token == ("punct", ")"):
+                            depth -= 1
+                            if depth == 0:
+                                break
+                        elif token[0] == "eof":
+                            self.unexpected()
+                    items.append(("function", name, start))
+            else:
+                items.append(("field", value, None))
+            alias = None
+            if self.peek()[0] == "ident" and self.peek_upper() not in _KEYWORDS:
+                alias = self.next()[1]
+            items[-1] = items[-1] + (alias,)
+            if not self.accept(","):
+                return items
+
+    def parse(self, nested: bool = False) -> CompiledQuery:
+        self.expect("SELECT")
+        items = self.parse_select_items()
+        self.expect("FROM")
+        self.object = self.catalog.object_name(self.parse_field_path())
+        self.object_alias = None
+        if self.peek()[0] == "ident" and self.peek_upper() not in _KEYWORDS:
+            self.object_alias = self.next()[1]
+        self.alias = self.new_alias()
+        after_from = self.pos
+
+        columns: List[_Column] = []
+        unaliased = 0
+        for kind, value, start, alias in items:
+            if kind == "fields":
+                for name, ftype in self.catalog.fields[self.object.lower()].values():
+                    if value == "ALL" or (value == "CUSTOM") == name.endswith("__c"):
+                        columns.append(_Column(f'{self.alias}."{name}"', name, ftype))
+            elif kind == "field":
+                sql, name, ftype, path = self.resolve(value)
+                columns.append(_Column(sql, alias or name, ftype, path))
+            else:
+                self.pos = start
+                sql, ftype, is_aggregate = self.parse_function(value)
+                if alias is None:
+                    alias = f"expr{unaliased}"
+                    unaliased += 1
+                columns.append(_Column(sql, alias, ftype, aggregate=is_aggregate))
+        self.pos = after_from
+        count_only = len(items) == 1 and columns[0].sql == "COUNT(*)" and items[0][3] is None
+
+        where = group_by = having = order_by = limit = offset = None
+        if self.accept("USING"):
+            self.expect("SCOPE")
+            self.next()
+        if self.accept("WHERE"):
+            where = self.parse_condition()
+        if self.accept("WITH"):
+            # WITH SECURITY_ENFORCED / USER_MODE have no meaning offline
+            self.next()
+        if self.accept("GROUP"):
+            self.expect("BY")
+            if self.peek_upper() in ("ROLLUP", "CUBE"):
+                raise SOQLError("MALFORMED_QUERY", "GROUP BY ROLLUP/CUBE is not supported by the local sandbox")
+            group_by = [self.parse_operand()[0]]
+            while self.accept(","):
+                group_by.append(self.parse_operand()[0])
+        if self.accept("HAVING"):
+            having = self.parse_condition()
+        if self.accept("ORDER"):
+            self.expect("BY")
+            order_by = []
+            while True:
+                term = self.parse_operand()[0]
+                if self.accept("DESC"):
+                    term += " DESC"
+                else:
+                    self.accept("ASC")
+                if self.accept("NULLS"):
+                    term += " NULLS " + self.next()[1].upper()
+                order_by.append(term)
+                if not self.accept(","):
+                    break
+        if self.accept("LIMIT"):
+            limit = self.parse_integer()
+        if self.accept("OFFSET"):
+            offset = self.parse_integer()
+        if self.accept("FOR"):
+            self.next()
+        if nested:
+            if self.peek() != ("punct", ")"):
+                self.unexpected()
+        elif self.peek()[0] != "eof":
+            self.unexpected()
+
+        is_aggregate = group_by is not None or any(c.aggregate for c in columns)
+        join_ids = []
+        if is_aggregate:
+            # Aggregate results are flat: grouped parent fields are keyed by their field name
+            for column in columns:
+                column.path = []
+        else:
+            join_ids = sorted({alias for column in columns for _, alias in column.path})
+        select_sql = [f"{c.sql} AS c{i}" for i, c in enumerate(columns)]
+        select_sql += [f'{alias}."Id" AS j{alias}' for alias in join_ids]
+        sql = f'SELECT {", ".join(select_sql)} FROM "{self.object}" AS {self.alias}'
+        if self.joins:
+            sql += " " + " ".join(self.joins)
+        if where:
+            sql += f" WHERE {where}"
+        if group_by:
+            sql += f" GROUP BY {', '.join(group_by)}"
+        if having:
+            sql += f" HAVING {having}"
+        if order_by:
+            sql += f" ORDER BY {', '.join(order_by)}"
+        if limit is not None or offset is not None:
+            sql += f" LIMIT {limit if limit is not None else -1}"
+            if offset is not None:
+                sql += f" OFFSET {offset}"
+        return CompiledQuery(sql, columns, join_ids, is_aggregate, count_only)
+
+    def parse_integer(self) -> int:
+        kind, value = self.next()
+        if kind != "number" or not value.isdigit():
+            self.pos -= 1
+            self.unexpected()
+        return int(value)
+
+
+def translate_soql(query: str, catalog: _Catalog, today: Optional[date] = None) -> CompiledQuery:
+    today = today or datetime.now(timezone.utc).date()
+    return _SelectTranslator(catalog, _tokenize(query), today).parse()
+
+
+_SOSL_PATTERN = re.compile(
+    r"^\s*FIND\s*\{(?P<term>(?:\\.|[^}])*)\}\s*(?:IN\s+(?P<scope>\w+)\s+FIELDS)?\s*(?:RETURNING\s+(?P<returning>.*?))?\s*(?:LIMIT\s+(?P<limit>\d+))?\s*$",
+    re.IGNORECASE | re.DOTALL,
+)
+_SEARCHABLE_TYPES = {"string", "textarea", "picklist", "multipicklist", "email", "phone", "url", "combobox"}
+_NAME_FIELDS = {"name", "title", "subject", "firstname", "lastname", "casenumber"}
+
+
+def _split_top_level(text: str) -> List[str]:
+    parts, depth, current = [], 0, ""
+    for char in text:
+        if char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+        else:
+            current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+class LocalSalesforceConnector(SalesforceConnector):
+    """
+    Offline stand-in for `SalesforceConnector` backed by a SQLite snapshot of an org.
+
+    Implements the same `run_query(query) -> (result, status)` contract for the SOQL subset
+    agents use (parent relationship paths, IN/NOT IN/LIKE/INCLUDES, date and datetime literals,
+    relative date literals, date functions, aggregates with GROUP BY/HAVING, ORDER BY, LIMIT,
+    OFFSET and semi-join subqueries) and a basic SOSL `FIND ... RETURNING`. Errors use the
+    live API's "ERROR_CODE: message" format. Relative date literals are evaluated against
+    `today` (default: the current UTC date).
+    """
+
+    def __init__(self, db_path: str, org_type: str = "b2b", today: Optional[date] = None, query_cache: QueryCache = None):
+        # No org to authenticate against, so SalesforceConnector.__init__ is not called
+        assert org_type in ["b2b", "b2c", "original"], "Invalid organization type"
+        if not os.path.exists(db_path):
+            raise FileNotFoundError(f"Local sandbox snapshot not found: {db_path}")
+        self.db_path = db_path
+        self.org_type = org_type
+        self.today = today
+        self._local = threading.local()
+        self.catalog = _Catalog(self._connection())
+        self.query_cache = query_cache if query_cache is not None else get_query_cache()
+        self.cache_namespace = f"{org_type}:local:{os.path.abspath(db_path)}"
+
+    def _connection(self) -> sqlite3.Connection:
+        # One read-only connection per thread (async envs run queries in worker threads)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_path}?mode=ro", uri=True)
+            self._local.conn = conn
+        return conn
+
+    def ping(self) -> bool:
+        try:
+            self._connection().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _iter_pages(self, query: str, is_sosl: bool) -> Iterator[List[Dict]]:
+        if is_sosl:
+            yield self._search(query)
+            return
+        compiled = translate_soql(query, self.catalog, self.today)
+        if compiled.count_only:
+            # The live API reports COUNT() through totalSize and returns no records
+            yield []
+            return
+        cursor = self._connection().execute(compiled.sql)
+        while True:
+            rows = cursor.fetchmany(PAGE_SIZE)
+            if not rows:
+                break
+            yield [compiled.build_record(row) for row in rows]
+
+    def _search(self, query: str) -> List[Dict]:
+        m = _SOSL_PATTERN.match(query)
+        if m is None or not m.group("returning"):
+            raise SOQLError("MALFORMED_QUERY", "unsupported SOSL query for the local sandbox")
+        words = [w for w in re.split(r"\s+", m.group("term").replace('"', " ").strip()) if w and w.upper() not in ("AND", "OR")]
+        if not words:
+            raise SOQLError("MALFORMED_SEARCH", "search term must be longer than one character")
+        name_only = (m.group("scope") or "ALL").upper() == "NAME"
+        records = []
+        for spec in _split_top_level(m.group("returning")):
+            spec_match = re.match(r"^(\w+)\s*(?:\((.*)\))?$", spec, re.DOTALL)
+            if spec_match is None:
+                raise SOQLError("MALFORMED_SEARCH", f"unexpected token: '{spec}'")
+            obj = self.catalog.object_name(spec_match.group(1))
+            body = (spec_match.group(2) or "Id").strip()
+            clause = re.search(r"\b(WHERE|ORDER\s+BY|LIMIT|OFFSET)\b", body, re.IGNORECASE)
+            fields, rest = (body[:clause.start()], body[clause.start():]) if clause else (body, "")
+            compiled_fields = self.catalog.fields[obj.lower()].values()
+            columns = [name for name, ftype in compiled_fields if ftype in _SEARCHABLE_TYPES and (not name_only or name.lower() in _NAME_FIELDS)]
+            if not columns:
+                continue
+            conditions = []
+            for word in words:
+                # The condition is spliced into SOQL, so the pattern is a SOQL LIKE literal
+                pattern = _soql_string(word)[1:-1].replace("%", "\\%").replace("_", "\\_").replace("*", "%")
+                conditions.append("(" + " OR ".join(f"{name} LIKE '%{pattern}%'" for name in columns) + ")")
+            search = " AND ".join(conditions)
+            rest = rest.strip()
+            if rest.upper().startswith("WHERE"):
+                soql = f"SELECT {fields} FROM {obj} WHERE ({search}) AND ({rest[5:].strip()})"
+            else:
+                soql = f"SELECT {fields} FROM {obj} WHERE {search} {rest}"
+            compiled = translate_soql(soql, self.catalog, self.today)
+            records.extend(compiled.build_record(row) for row in self._connection().execute(compiled.sql))
+        if m.group("limit"):
+            records = records[: int(m.group("limit"))]
+        return records
+
+    @staticmethod
+    def _format_error(e: Exception) -> str:
+        if isinstance(e, SOQLError):
+            return f"{e.error_code}: {e.message}"
+        if isinstance(e, sqlite3.Error):
+            return f"MALFORMED_QUERY: {e}"
+        raise e
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    parser = argparse.ArgumentParser(description="Snapshot a live Salesforce org into a SQLite database for LocalSalesforceConnector")
+    parser.add_argument("--org_type", type=str, default="b2b", choices=["b2b", "b2c", "original"])
+    parser.add_argument("--output", type=str, required=True, help="Path of the SQLite snapshot to write")
+    parser.add_argument("--parquet_dir", type=str, default=None, help="Directory of the intermediate Parquet snapshot (default: <output without extension>_parquet)")
+    parser.add_argument("--workers", type=int, default=8, help="Objects exported concurrently (default: %(default)s)")
+    args = parser.parse_args()
+    load_dotenv()
+    from crm_sandbox.data.assets import get_schema
+    from crm_sandbox.data.snapshot import export_snapshot, snapshot_to_sqlite
+    # Objects are streamed page by page to Parquet, then loaded into SQLite in batches
+    parquet_dir = args.parquet_dir or os.path.splitext(args.output)[0] + "_parquet"
+    export_snapshot(SalesforceConnector(org_type=args.org_type), get_schema(args.org_type), parquet_dir, args.org_type, workers=args.workers)
+    counts = snapshot_to_sqlite(parquet_dir, args.output)
+    print(f"Wrote {sum(counts.values())} records from {len(counts)} objects to {args.output}")
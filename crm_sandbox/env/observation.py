@@ -0,0 +1,228 @@
+import csv
+import io
+import json
+import re
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from crm_sandbox.agents.context import OBSERVATION_PREFIX
+
+# `<execute> NEXT q3 </execute>` asks for the next page of an earlier result
+_PAGE_REQUEST = re.compile(r"^\s*NEXT\s+(\w+)\s*;?\s*$", re.IGNORECASE)
+
+
+def _flatten(record: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """Flatten relationship fields to dotted columns (Owner.Name) and drop API `attributes`."""
+    flat = {}
+    for key, value in record.items():
+        if key == "attributes":
+            continue
+        name = f"{prefix}{key}"
+        if isinstance(value, dict) and "records" in value:
+            # child relationship subquery
+            flat[name] = json.dumps([_flatten(r) for r in value["records"]], default=str)
+        elif isinstance(value, dict):
+            flat.update(_flatten(value, prefix=f"{name}."))
+        else:
+            flat[name] = value
+    return flat
+
+
+def flatten_records(records: List[Dict[str, Any]]) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """Return the columns (in order of first appearance) and the flattened rows of a result."""
+    rows = [_flatten(record) for record in records]
+    columns = list(OrderedDict.fromkeys(key for row in rows for key in row))
+    return columns, rows
+
+
+def render_table(columns: List[str], rows: List[Dict[str, Any]]) -> str:
+    """CSV rendering with a header row; nulls are empty cells."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(["" if row.get(c) is None else row.get(c) for c in columns])
+    return buffer.getvalue().rstrip("\n")
+
+
+def render_columnar(columns: List[str], rows: List[Dict[str, Any]]) -> str:
+    """
+    CSV table with two compressions for repetitive results: columns holding a single value are
+    listed once above the table, and long values repeated across rows (owner, account and
+    record type Ids, picklist values) are replaced by `#n` references defined in a legend.
+    """
+    lines = []
+    if len(rows) > 1:
+        constants = [c for c in columns if len({_cell(row.get(c)) for row in rows}) == 1]
+        if len(constants) < len(columns):
+            for c in constants:
+                lines.append(f"{c} (all rows): {_cell(rows[0].get(c))}")
+            columns = [c for c in columns if c not in constants]
+    counts = Counter(_cell(row.get(c)) for row in rows for c in columns)
+    references = {}
+    for value in OrderedDict.fromkeys(_cell(row.get(c)) for row in rows for c in columns):
+        reference = f"#{len(references) + 1}"
+        # a legend entry costs about len(value) + len(reference) characters
+        if counts[value] > 1 and (counts[value] - 1) * len(value) > (counts[value] + 1) * len(reference):
+            references[value] = reference
+    for value, reference in references.items():
+        lines.append(f"{reference} = {value}")
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow([references.get(_cell(row.get(c)), _cell(row.get(c))) for c in columns])
+    lines.append(buffer.getvalue().rstrip("\n"))
+    return "\n".join(lines)
+
+
+def _cell(value: Any) -> str:
+    return "" if value is None else str(value)
+
+
+OBSERVATION_FORMATS = ["repr", "csv", "columnar"]
+
+
+def encode_records(records: List[Dict[str, Any]], fmt: str = "repr") -> str:
+    """Serialize query records as `repr` (Python list of dicts), `csv` or `columnar`."""
+    if fmt == "repr":
+        return str(records)
+    columns, rows = flatten_records(records)
+    if fmt == "csv":
+        return render_table(columns, rows)
+    if fmt == "columnar":
+        return render_columnar(columns, rows)
+    raise ValueError(f"Unknown observation format: {fmt}")
+
+
+def is_record_list(value: Any) -> bool:
+    return isinstance(value, list) and len(value) > 0 and all(isinstance(v, dict) for v in value)
+
+
+class ObservationShaper(object):
+    """
+    Shapes `run_query` results before they are shown to the agent. By default results are returned
+    as is (the environment then shows their Python repr). `fmt` selects a more compact encoding
+    (see `encode_records`). With `max_rows` or `max_chars`, each observation is capped at that many
+    rows/characters, and the rest is kept under a cursor that the agent can page through by
+    executing `NEXT <cursor>`; capped results default to the `csv` encoding.
+    """
+
+    def __init__(self, max_rows: Optional[int] = None, max_chars: Optional[int] = None, fmt: Optional[str] = None, max_cursors: int = 8) -> None:
+        super().__init__()
+        self.max_rows = max_rows
+        self.max_chars = max_chars
+        self.fmt = fmt or ("csv" if self.paginated else "repr")
+        assert self.fmt in OBSERVATION_FORMATS, f"Unknown observation format: {self.fmt}"
+        self.max_cursors = max_cursors
+        self._pages: "OrderedDict[str, Tuple[List[Dict[str, Any]], int]]" = OrderedDict()
+        self._cursor_count = 0
+
+    @property
+    def paginated(self) -> bool:
+        return self.max_rows is not None or self.max_chars is not None
+
+    def reset(self):
+        self._pages.clear()
+        self._cursor_count = 0
+
+    @staticmethod
+    def is_page_request(query: str) -> bool:
+        return _PAGE_REQUEST.match(query) is not None
+
+    def shape(self, result: List[Dict[str, Any]]) -> Tuple[Any, int]:
+        """Return the observation of a successful query and the number of records it shows."""
+        if not result or (self.fmt == "repr" and not self.paginated):
+            return result, len(result)
+        if not self.paginated:
+            return encode_records(result, self.fmt), len(result)
+        return self._render_page(None, result, 0)
+
+    def next_page(self, query: str) -> Tuple[str, int, int]:
+        """Serve `NEXT <cursor>`; returns (observation, status, records shown) like a query."""
+        cursor = _PAGE_REQUEST.match(query).group(1)
+        if cursor not in self._pages:
+            return f"INVALID_CURSOR: unknown or exhausted cursor '{cursor}'", 0, 0
+        records, offset = self._pages.pop(cursor)
+        observation, shown = self._render_page(cursor, records, offset)
+        return observation, 1, shown
+
+    def _render_page(self, cursor: Optional[str], records: List[Dict[str, Any]], offset: int) -> Tuple[str, int]:
+        end = len(records) if self.max_rows is None else min(len(records), offset + self.max_rows)
+        text = encode_records(records[offset:end], self.fmt)
+        while self.max_chars is not None and len(text) > self.max_chars and end - offset > 1:
+            # shrink the page in proportion to the overshoot
+            end = offset + max(1, min(end - offset - 1, int((end - offset) * self.max_chars / len(text))))
+            text = encode_records(records[offset:end], self.fmt)
+        if self.max_chars is not None and len(text) > self.max_chars:
+            text = text[:self.max_chars] + "...(truncated)"
+        if end >= len(records):
+            if offset:
+                text += f"\n[Rows {offset + 1}-{end} of {len(records)}; end of results]"
+            return text, end - offset
+        if cursor is None:
+            self._cursor_count += 1
+            cursor = f"q{self._cursor_count}"
+        self._pages[cursor] = (records, end)
+        while len(self._pages) > self.max_cursors:
+            self._pages.popitem(last=False)
+        text += f"\n[Rows {offset + 1}-{end} of {len(records)}. To see the next rows, execute: NEXT {cursor}]"
+        return text, end - offset
+
+
+def _recorded_observations(paths: List[str]):
+    """Yield the query results recorded in the trajectories of `results_*.json` / `.jsonl` files."""
+    import ast
+    from crm_sandbox.results.checkpoint import iter_results
+    for path in paths:
+        try:
+            records = list(iter_results(path))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            print(f"Skipping {path}: not a results file")
+            continue
+        for record in records:
+            for message in record.get("traj") or []:
+                content = message.get("content")
+                if not isinstance(content, str):
+                    continue
+                if content.startswith(OBSERVATION_PREFIX):
+                    content = content[len(OBSERVATION_PREFIX):]
+                elif message.get("role") != "tool":
+                    continue
+                try:
+                    value = ast.literal_eval(content)
+                except (ValueError, SyntaxError, MemoryError, RecursionError):
+                    continue
+                if is_record_list(value):
+                    yield value
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compare observation encodings on the query results of recorded trajectories")
+    parser.add_argument("results", nargs="+", help="results_*.json or results_*.jsonl files")
+    parser.add_argument("--encoding", type=str, default="o200k_base", help="tiktoken encoding used to count tokens (default: %(default)s)")
+    args = parser.parse_args()
+
+    try:
+        import tiktoken
+        count_tokens = tiktoken.get_encoding(args.encoding).encode
+    except Exception as e:  # not installed, or the encoding cannot be downloaded
+        print(f"tiktoken unavailable ({type(e).__name__}); estimating 3 characters per token")
+        count_tokens = lambda text: range(len(text) // 3)
+
+    totals = {fmt: [0, 0] for fmt in OBSERVATION_FORMATS}
+    n_observations = n_records = 0
+    for records in _recorded_observations(args.results):
+        n_observations += 1
+        n_records += len(records)
+        for fmt in OBSERVATION_FORMATS:
+            text = encode_records(records, fmt)
+            totals[fmt][0] += len(text)
+            totals[fmt][1] += len(count_tokens(text))
+    print(f"{n_observations} query results, {n_records} records")
+    if n_observations:
+        base = totals["repr"][1] or 1
+        print(f"{'format':<10} {'chars':>12} {'tokens':>12} {'vs repr':>8}")
+        for fmt, (chars, tokens) in totals.items():
+            print(f"{fmt:<10} {chars:>12} {tokens:>12} {tokens / base:>8.1%}")
@@ -0,0 +1,175 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Optional
+
+
+def connector_health_check(env) -> bool:
+    """Default health check: the env's connector can still reach its org (or snapshot)."""
+    connector = getattr(env, "sf_connector", None)
+    return connector is None or connector.ping()
+
+
+class EnvPool(object):
+    """
+    A fixed number of environments shared by worker threads or coroutines.
+
+    Environments are built up front (`prewarm`, concurrently) or on first demand, checked out for
+    one task at a time and returned afterwards; envs keep per-task state only until their next
+    `reset`. An env that has been idle for `health_check_interval` seconds, or that was marked
+    suspect after a failed task, is health-checked on checkout and rebuilt if the check fails.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[], Any],
+        size: int,
+        prewarm: bool = True,
+        health_check: Optional[Callable[[Any], bool]] = connector_health_check,
+        health_check_interval: float = 300.0,
+    ) -> None:
+        super().__init__()
+        assert size >= 1, "EnvPool needs at least one env"
+        self.factory = factory
+        self.size = size
+        self.health_check = health_check
+        self.health_check_interval = health_check_interval
+        self._idle: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._created = 0
+        # id(env) -> monotonic time of the last successful check (or build)
+        self._checked_at: Dict[int, float] = {}
+        self._suspects = set()
+        self._async_slots: Optional[asyncio.Semaphore] = None
+        self.rebuilds = 0
+        self.failed_checks = 0
+        if prewarm:
+            self.prewarm()
+
+    def _reserve(self) -> bool:
+        with self._lock:
+            if self._created >= self.size:
+                return False
+            self._created += 1
+            return True
+
+    def _build(self):
+        try:
+            env = self.factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+        self._checked_at[id(env)] = time.monotonic()
+        return env
+
+    def prewarm(self):
+        """Build the missing envs concurrently and add them to the pool."""
+        missing = 0
+        while self._reserve():
+            missing += 1
+        if missing == 0:
+            return
+        with ThreadPoolExecutor(max_workers=missing) as executor:
+            for env in executor.map(lambda _: self._build(), range(missing)):
+                self._idle.put(env)
+
+    def _healthy(self, env) -> bool:
+        if self.health_check is None:
+            return True
+        stale = time.monotonic() - self._checked_at.get(id(env), 0.0) > self.health_check_interval
+        if not stale and id(env) not in self._suspects:
+            return True
+        try:
+            healthy = bool(self.health_check(env))
+        except Exception:
+            healthy = False
+        self._suspects.discard(id(env))
+        if healthy:
+            self._checked_at[id(env)] = time.monotonic()
+        else:
+            self.failed_checks += 1
+        return healthy
+
+    def _ready(self, env):
+        """Return `env`, or a freshly built replacement when it fails its health check."""
+        if self._healthy(env):
+            return env
+        print("Env failed its health check, rebuilding it")
+        self._checked_at.pop(id(env), None)
+        replacement = self.factory()
+        self._checked_at[id(replacement)] = time.monotonic()
+        self.rebuilds += 1
+        return replacement
+
+    def checkout(self, timeout: Optional[float] = None):
+        """Take an env, building one if the pool is not full yet; blocks while all envs are in use."""
+        try:
+            env = self._idle.get_nowait()
+        except queue.Empty:
+            if self._reserve():
+                return self._build()
+            env = self._idle.get(timeout=timeout)
+        try:
+            return self._ready(env)
+        except Exception:
+            # the replacement could not be built; free the slot
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def checkin(self, env):
+        self._idle.put(env)
+
+    def suspect(self, env):
+        """Health-check `env` before it is handed out again, e.g. after a task failed with an exception."""
+        self._suspects.add(id(env))
+
+    @contextmanager
+    def lease(self, timeout: Optional[float] = None):
+        env = self.checkout(timeout=timeout)
+        try:
+            yield env
+        except Exception:
+            self.suspect(env)
+            raise
+        finally:
+            self.checkin(env)
+
+    async def acheckout(self):
+        """Async checkout; waits on the event loop rather than in a thread while all envs are in use."""
+        if self._async_slots is None:
+            self._async_slots = asyncio.Semaphore(self.size)
+        await self._async_slots.acquire()
+        try:
+            return await asyncio.to_thread(self.checkout)
+        except BaseException:
+            self._async_slots.release()
+            raise
+
+    def acheckin(self, env):
+        self.checkin(env)
+        self._async_slots.release()
+
+    @asynccontextmanager
+    async def alease(self):
+        env = await self.acheckout()
+        try:
+            yield env
+        except Exception:
+            self.suspect(env)
+            raise
+        finally:
+            self.acheckin(env)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": self.size,
+            "created": self._created,
+            "idle": self._idle.qsize(),
+            "rebuilds": self.rebuilds,
+            "failed_checks": self.failed_checks,
+        }
@@ -0,0 +1,111 @@
+import copy
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+# Quoted literals are kept verbatim; whitespace is only collapsed outside of them
+_LITERAL_PATTERN = re.compile(r"('(?:\\.|[^'\\])*'|\"(?:\\.|[^\"\\])*\")")
+
+
+def normalize_query(query: str) -> str:
+    """Collapse whitespace outside quoted literals so formatting differences share a cache entry."""
+    parts = _LITERAL_PATTERN.split(query.strip())
+    normalized = []
+    for i, part in enumerate(parts):
+        normalized.append(part if i % 2 == 1 else " ".join(part.split()))
+    return " ".join(p for p in normalized if p)
+
+
+class QueryCache(object):
+    """
+    In-memory cache of SOQL/SOSL results shared by all connectors of the process.
+
+    Entries are namespaced per org (instance URL) and keyed on the normalized query. They
+    expire after `ttl` seconds; the least recently used entries are evicted once the cache
+    holds more than `max_entries` results or more than `max_bytes` of serialized data.
+    Only successful results are cached, and callers always receive a copy.
+    """
+
+    def __init__(self, ttl: Optional[float] = 3600.0, max_entries: int = 10000, max_bytes: int = 256 * 1024 * 1024) -> None:
+        super().__init__()
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, namespace: str, query: str):
+        key = (namespace, normalize_query(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, size, result = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(result)
+
+    def put(self, namespace: str, query: str, result: Any) -> None:
+        size = len(json.dumps(result, default=str))
+        if size > self.max_bytes:
+            return
+        key = (namespace, normalize_query(query))
+        result = copy.deepcopy(result)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic(), size, result)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self, namespace: Optional[str] = None) -> None:
+        with self._lock:
+            for key in [k for k in self._entries if namespace is None or k[0] == namespace]:
+                self._remove(key)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+_cache: Optional[QueryCache] = None
+
+
+def configure_query_cache(ttl: Optional[float] = 3600.0, max_entries: int = 10000, max_bytes: int = 256 * 1024 * 1024) -> QueryCache:
+    """Enable the process-wide query cache used by every `SalesforceConnector` created afterwards."""
+    global _cache
+    _cache = QueryCache(ttl=ttl, max_entries=max_entries, max_bytes=max_bytes)
+    return _cache
+
+
+def get_query_cache() -> Optional[QueryCache]:
+    return _cache
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from simple_salesforce import Salesforce
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_MAXSIZE = 32
+
+
+class SalesforceSessionManager(object):
+    """
+    Process-wide Salesforce logins shared by every `SalesforceConnector`.
+
+    Each set of credentials logs in once, and the same client is handed to every connector.
+    All clients use one `requests.Session`, whose connection pool is sized for concurrent
+    workers, so connections stay alive between queries instead of paying a TLS handshake
+    each time. simple_salesforce re-logs in when a request gets INVALID_SESSION_ID; here,
+    refreshes that several threads trigger at the same time collapse into a single login.
+    """
+
+    def __init__(self, pool_connections: int = 4, pool_maxsize: int = DEFAULT_POOL_MAXSIZE, connect_retries: int = 3, refresh_interval: float = 5.0) -> None:
+        super().__init__()
+        self.http = requests.Session()
+        # Only connection failures are retried here; API errors are surfaced to the agent as before
+        retry = Retry(total=connect_retries, connect=connect_retries, read=0, status=0, other=0, backoff_factor=0.5)
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+        self.refresh_interval = refresh_interval
+        self._clients: Dict[Tuple[str, str], Salesforce] = {}
+        self._locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.logins = 0
+
+    def get(self, auth: Dict[str, str]) -> Salesforce:
+        """Return the shared client for username/password/security token credentials, logging in on first use."""
+        if not auth.get("username"):
+            # An existing session id cannot be refreshed, so the client is not shared
+            return Salesforce(instance_url=auth["instance_url"], session_id=auth["session_id"], session=self.http)
+        key = (auth["username"], auth.get("domain") or "login")
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = Salesforce(username=auth["username"], password=auth["password"], security_token=auth["security_token"], session=self.http)
+                self.logins += 1
+                # simple-salesforce (pinned to 1.12.6) re-logs in by calling this private partial
+                login = getattr(client, "_salesforce_login_partial", None)
+                if login is None:
+                    # Refreshes cannot be collapsed, so each connector keeps its own client and login
+                    logger.warning("simple_salesforce.Salesforce has no _salesforce_login_partial; Salesforce logins are not shared")
+                    return client
+                client._salesforce_login_partial = self._collapsed_login(client, login, lock)
+                self._clients[key] = client
+        return client
+
+    def _collapsed_login(self, client: Salesforce, login, lock: threading.Lock):
+        state = {"refreshed_at": time.monotonic(), "session": (client.session_id, client.sf_instance)}
+
+        def refresh():
+            with lock:
+                # another thread refreshed the session while this one waited for the lock
+                if time.monotonic() - state["refreshed_at"] < self.refresh_interval:
+                    return state["session"]
+                state["session"] = login()
+                state["refreshed_at"] = time.monotonic()
+                self.logins += 1
+                return state["session"]
+        return refresh
+
+    def close(self):
+        with self._lock:
+            self._clients.clear()
+        self.http.close()
+
+
+_manager: Optional[SalesforceSessionManager] = None
+_manager_lock = threading.Lock()
+
+
+def configure_session_manager(**kwargs) -> SalesforceSessionManager:
+    """Replace the process-wide session manager, e.g. to size its connection pool for more workers."""
+    global _manager
+    with _manager_lock:
+        _manager = SalesforceSessionManager(**kwargs)
+    return _manager
+
+
+def get_session_manager() -> SalesforceSessionManager:
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = SalesforceSessionManager()
+        return _manager
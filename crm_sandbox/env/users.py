@@ -1,6 +1,9 @@
 from typing import Optional, List, Dict, Any, Union
-from litellm import completion
-from crm_sandbox.agents.utils import CUSTOM_SERVER_MODELS_MAP
+from litellm import completion, acompletion
+from crm_sandbox.agents.utils import CUSTOM_SERVER_MODELS_MAP, estimate_input_tokens
+from crm_sandbox.agents.rate_limiter import get_rate_limiter, limited_completion, alimited_completion
+from crm_sandbox.agents.llm_cache import cache_lookup, cache_store
+from crm_sandbox.agents.tracing import span, record_usage
 
 class LLMUserSimulationEnv(object):
     def __init__(self, model: str, provider: str) -> None:
@@ -14,25 +17,48 @@ class LLMUserSimulationEnv(object):
         if provider == "custom_server" and self.model in CUSTOM_SERVER_MODELS_MAP:
             self.custom_server_config = CUSTOM_SERVER_MODELS_MAP[self.model]
             self.model = self.custom_server_config["name"]
+        self.rate_limiter = get_rate_limiter(self.provider, self.model)
         
         self.reset()
 
-    def generate_next_message(self, messages: List[Dict[str, Any]]) -> str:
+    def _completion_kwargs(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
         if self.provider == "custom_server" and hasattr(self, 'custom_server_config'):
             # For LiteLLM server, keep the openai/ prefix and use api_base
-            res = completion(
+            return dict(
                 model=self.model,
                 messages=messages,
                 api_base=self.custom_server_config["base_url"],
                 api_key=self.custom_server_config["api_key"]
             )
-        else:
-            res = completion(
-                model=self.model,
-                custom_llm_provider=self.provider,
-                messages=messages
-            )
-        
+        return dict(
+            model=self.model,
+            custom_llm_provider=self.provider,
+            messages=messages
+        )
+
+    def generate_next_message(self, messages: List[Dict[str, Any]]) -> str:
+        request = self._completion_kwargs(messages)
+        with span("user", model=self.model) as user_span:
+            res = cache_lookup(request, self.provider)
+            user_span.set(cache_hit=res is not None)
+            if res is None:
+                res = limited_completion(self.rate_limiter, completion, request, estimate_input_tokens(messages))
+                cache_store(request, res, self.provider)
+            record_usage(user_span, res)
+        return self._record_response(res)
+
+    async def agenerate_next_message(self, messages: List[Dict[str, Any]]) -> str:
+        request = self._completion_kwargs(messages)
+        with span("user", model=self.model) as user_span:
+            res = cache_lookup(request, self.provider)
+            user_span.set(cache_hit=res is not None)
+            if res is None:
+                res = await alimited_completion(self.rate_limiter, acompletion, request, estimate_input_tokens(messages))
+                cache_store(request, res, self.provider)
+            record_usage(user_span, res)
+        return self._record_response(res)
+
+    def _record_response(self, res) -> str:
         message = res.choices[0].message
         self.messages.append(message.model_dump())
         self.total_cost = res._hidden_params["response_cost"]
@@ -76,7 +102,7 @@ Your output: ###STOP###
 
 """
 
-    def reset(self, instruction: Optional[str] = None, persona: Optional[str] = None) -> str:
+    def _reset_messages(self, instruction: Optional[str] = None, persona: Optional[str] = None) -> None:
         self.messages = [
             {
                 "role": "system",
@@ -85,11 +111,22 @@ Your output: ###STOP###
             {"role": "user", "content": "Hi! How can I help you today?"},
         ]
         # print("user system prompt", self.messages[0]["content"])
+
+    def reset(self, instruction: Optional[str] = None, persona: Optional[str] = None) -> str:
+        self._reset_messages(instruction=instruction, persona=persona)
         return self.generate_next_message(self.messages)
 
+    async def areset(self, instruction: Optional[str] = None, persona: Optional[str] = None) -> str:
+        self._reset_messages(instruction=instruction, persona=persona)
+        return await self.agenerate_next_message(self.messages)
+
     def step(self, content: str) -> str:
         self.messages.append({"role": "user", "content": content})
         return self.generate_next_message(self.messages)
 
+    async def astep(self, content: str) -> str:
+        self.messages.append({"role": "user", "content": content})
+        return await self.agenerate_next_message(self.messages)
+
     def get_total_cost(self) -> float:
         return self.total_cost
\ No newline at end of file
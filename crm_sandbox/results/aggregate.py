@@ -0,0 +1,231 @@
+import os
+import re
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+from crm_sandbox.results.checkpoint import iter_results, journal_path_for
+
+# results_<model>_<strategy>_<task category>[_interactive-<bool>].json(l)
+_RESULTS_FILE = re.compile(r"^results_(?P<model>.+)_(?P<strategy>react|act|tool_call_flex|tool_call)_(?P<category>.+?)(?:_interactive-(?P<interactive>True|False))?\.jsonl?$")
+
+# Leaf values read from each record; everything else (notably `traj`) is skipped by the parser
+_SCALARS = {
+    "task_id": "task_id",
+    "task_type": "task_type",
+    "reward": "reward",
+    # fuzzy_match rewards are dicts of metrics; F1 is the score
+    "reward.f1": "reward",
+    "agent_info.total_cost": "cost",
+    "agent_info.latency": "latency",
+    "agent_info.trace.llm.seconds": "llm_latency",
+    "agent_info.trace.query.seconds": "query_latency",
+}
+_SUMS = {
+    "agent_info.usage.prompt_tokens.item": "prompt_tokens",
+    "agent_info.usage.completion_tokens.item": "completion_tokens",
+}
+_NUMBER_EVENTS = {"number", "integer", "double"}
+_VALUE_EVENTS = _NUMBER_EVENTS | {"string", "boolean", "null"}
+
+# Raised by json and ijson for truncated, corrupt or non-JSON files (e.g. Git LFS pointers)
+_PARSE_ERRORS = (ValueError,) + ((ijson.JSONError,) if ijson is not None else ())
+
+_STATS = ["n", "score", "cost", "agent_turns", "tokens", "latency", "timed", "llm_latency", "query_latency", "traced"]
+
+
+def _summary(record: Dict[str, Any]) -> Dict[str, Any]:
+    """The fields of a result used by the leaderboard."""
+    agent_info = record.get("agent_info") or {}
+    usage = agent_info.get("usage") or {}
+    reward = record.get("reward")
+    trace = agent_info.get("trace") or {}
+    return {
+        "task_id": record.get("task_id"),
+        "task_type": record.get("task_type"),
+        "reward": reward.get("f1") if isinstance(reward, dict) else reward,
+        "cost": agent_info.get("total_cost"),
+        "latency": agent_info.get("latency"),
+        "llm_latency": (trace.get("llm") or {}).get("seconds"),
+        "query_latency": (trace.get("query") or {}).get("seconds"),
+        "prompt_tokens": sum(t for t in usage.get("prompt_tokens") or [] if t),
+        "completion_tokens": sum(t for t in usage.get("completion_tokens") or [] if t),
+        "num_turns": agent_info.get("num_turns"),
+    }
+
+
+def _stream_summaries(path: str) -> Iterator[Dict[str, Any]]:
+    """`_summary` of each record, from parser events rather than fully built records."""
+    journal = path.endswith(".jsonl")
+    root = "" if journal else "item"
+    offset = len(root) + 1 if root else 0
+    summary = None
+    with open(path, "rb") as f:
+        for prefix, event, value in ijson.parse(f, multiple_values=journal, use_float=True):
+            if prefix == root:
+                if event == "start_map":
+                    summary = {"llm_latency": None, "query_latency": None, "prompt_tokens": 0, "completion_tokens": 0, "num_turns": None}
+                elif event == "end_map" and summary is not None:
+                    yield summary
+                    summary = None
+                continue
+            if summary is None:
+                continue
+            key = prefix[offset:]
+            if key in _SCALARS and event in _VALUE_EVENTS:
+                summary[_SCALARS[key]] = value
+            elif key in _SUMS and event in _NUMBER_EVENTS:
+                summary[_SUMS[key]] += value
+            elif key == "agent_info.num_turns" and event in _NUMBER_EVENTS:
+                summary["num_turns"] = value
+            elif key == "agent_info.num_turns" and event == "start_array":
+                summary["num_turns"] = []
+            elif key == "agent_info.num_turns.item" and isinstance(summary["num_turns"], list):
+                summary["num_turns"].append(value)
+
+
+def iter_summaries(path: str) -> Iterator[Dict[str, Any]]:
+    if ijson is not None:
+        return _stream_summaries(path)
+    return (_summary(record) for record in iter_results(path))
+
+
+def _turns(num_turns) -> Tuple[int, int]:
+    """(user turns, agent turns); `react`/`act` agents record both, `tool_call` agents only their own."""
+    if isinstance(num_turns, (list, tuple)) and len(num_turns) == 2:
+        return num_turns[0] or 0, num_turns[1] or 0
+    return 0, num_turns or 0
+
+
+def parse_results_filename(path: str) -> Optional[Dict[str, Any]]:
+    """Model, strategy, task category and interactive flag (None if not in the name) of a results file."""
+    match = _RESULTS_FILE.match(os.path.basename(path))
+    if match is None:
+        return None
+    interactive = match.group("interactive")
+    return {
+        "model": match.group("model"),
+        "strategy": match.group("strategy"),
+        "category": match.group("category"),
+        "interactive": None if interactive is None else interactive == "True",
+    }
+
+
+def summarize_file(path: str) -> Tuple[Dict[str, Any], Dict[Tuple[str, bool], Dict[str, float]]]:
+    """
+    Per (task type, interactive) sums of one results file. Journals may hold several records of a
+    task (e.g. a deferred answer and its score); the latest one counts. Files that cannot be
+    parsed are reported and contribute nothing.
+    """
+    meta = parse_results_filename(path)
+    latest = {}
+    try:
+        for i, summary in enumerate(iter_summaries(path)):
+            task_id = summary.get("task_id")
+            latest[i if task_id is None else task_id] = summary
+    except _PARSE_ERRORS as e:
+        reason = (str(e).splitlines() or [""])[0]
+        print(f"Skipping {path}: not a readable results file ({type(e).__name__}: {reason})")
+        return meta, {}
+    groups: Dict[Tuple[str, bool], Dict[str, float]] = defaultdict(lambda: dict.fromkeys(_STATS, 0))
+    for summary in latest.values():
+        user_turns, agent_turns = _turns(summary["num_turns"])
+        interactive = meta["interactive"] if meta["interactive"] is not None else user_turns > 0
+        stats = groups[(summary.get("task_type") or meta["category"], interactive)]
+        stats["n"] += 1
+        stats["score"] += summary.get("reward") or 0
+        stats["cost"] += summary.get("cost") or 0
+        stats["agent_turns"] += agent_turns
+        stats["tokens"] += summary["prompt_tokens"] + summary["completion_tokens"]
+        if summary.get("latency") is not None:
+            stats["latency"] += summary["latency"]
+            stats["timed"] += 1
+        if summary.get("llm_latency") is not None:
+            stats["llm_latency"] += summary["llm_latency"]
+            stats["query_latency"] += summary.get("query_latency") or 0
+            stats["traced"] += 1
+    return meta, dict(groups)
+
+
+def find_results(paths: List[str]) -> List[str]:
+    """Results files under `paths`; a journal is read instead of the JSON export next to it."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                found.extend(os.path.join(root, name) for name in names)
+        else:
+            found.append(path)
+    results = [p for p in found if parse_results_filename(p) is not None]
+    journals = set(results)
+    return sorted(p for p in results if p.endswith(".jsonl") or journal_path_for(p) not in journals)
+
+
+def aggregate(paths: List[str], workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Leaderboard rows per model x strategy x task x interactive mode, plus an `ALL` row per
+    model/strategy/mode. Files are summarized in parallel processes.
+    """
+    files = find_results(paths)
+    totals: Dict[Tuple[str, str, bool, str], Dict[str, float]] = defaultdict(lambda: dict.fromkeys(_STATS, 0))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for meta, groups in executor.map(summarize_file, files):
+            for (task, interactive), stats in groups.items():
+                for key in [(meta["model"], meta["strategy"], interactive, task), (meta["model"], meta["strategy"], interactive, "ALL")]:
+                    for stat, value in stats.items():
+                        totals[key][stat] += value
+    rows = []
+    for (model, strategy, interactive, task), stats in sorted(totals.items(), key=lambda kv: (kv[0][:3], kv[0][3] == "ALL", kv[0][3])):
+        n = stats["n"] or 1
+        rows.append({
+            "model": model,
+            "strategy": strategy,
+            "mode": "multi-turn" if interactive else "single-turn",
+            "task": task,
+            "n": stats["n"],
+            "accuracy": stats["score"] / n,
+            "cost": stats["cost"] / n,
+            "turns": stats["agent_turns"] / n,
+            "tokens": stats["tokens"] / n,
+            "latency": stats["latency"] / stats["timed"] if stats["timed"] else None,
+            "llm_latency": stats["llm_latency"] / stats["traced"] if stats["traced"] else None,
+            "query_latency": stats["query_latency"] / stats["traced"] if stats["traced"] else None,
+        })
+    return rows
+
+
+def format_leaderboard(rows: List[Dict[str, Any]]) -> str:
+    lines = [f"{'model':<36} {'strategy':<9} {'mode':<11} {'task':<36} {'n':>5} {'accuracy':>8} {'cost':>9} {'turns':>6} {'tokens':>9} {'latency':>8} {'llm':>8} {'query':>8}"]
+    for row in rows:
+        latency, llm_latency, query_latency = ("-" if row[key] is None else f"{row[key]:.1f}s" for key in ["latency", "llm_latency", "query_latency"])
+        lines.append(
+            f"{row['model']:<36} {row['strategy']:<9} {row['mode']:<11} {row['task']:<36} {row['n']:>5} "
+            f"{row['accuracy']:>8.1%} {row['cost']:>9.4f} {row['turns']:>6.1f} {row['tokens']:>9.0f} {latency:>8} {llm_latency:>8} {query_latency:>8}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    import argparse
+    import csv
+    import time
+    parser = argparse.ArgumentParser(description="Leaderboard of accuracy, cost, turns, tokens and latency (total, and LLM/query time of traced runs) from results files")
+    parser.add_argument("paths", nargs="+", help="Results files or directories searched recursively (e.g. results/shared/b2b)")
+    parser.add_argument("--workers", type=int, default=None, help="Processes reading files (default: CPU count)")
+    parser.add_argument("--csv", type=str, default=None, help="Also write the leaderboard to this CSV file")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = aggregate(args.paths, workers=args.workers)
+    print(format_leaderboard(rows))
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0]) if rows else [])
+            writer.writeheader()
+            writer.writerows(rows)
+    print(f"Aggregated {len(find_results(args.paths))} files in {time.perf_counter() - start:.1f}s" + ("" if ijson is not None else " (install ijson to stream them)"))
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+from typing import Any, Dict, Iterator, Optional
+
+
+def journal_path_for(ckpt_path: str) -> str:
+    """Return the path of the append-only journal backing a `results_*.json` checkpoint."""
+    root, _ = os.path.splitext(ckpt_path)
+    return root + ".jsonl"
+
+
+class CheckpointWriter(object):
+    """
+    Append-only JSONL checkpoint.
+
+    Every result is written as one JSON line and fsync'ed before `append` returns, so a crash
+    loses at most the record being written. Appends are serialized so the writer can be shared
+    between worker threads.
+    """
+
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+        # Terminate a torn trailing line from an interrupted run so the next record starts on its own line
+        if self._file.tell() > 0:
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    self._file.write("\n")
+
+    def append(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def iter_journal(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the records of a JSONL journal, skipping a torn trailing line left by a crash."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping malformed checkpoint line in {path}")
+
+
+def iter_results(path: str) -> Iterator[Dict[str, Any]]:
+    """Yield the records of a results file: a `results_*.json` list or a `.jsonl` journal."""
+    if path.endswith(".jsonl"):
+        yield from iter_journal(path)
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        yield from json.load(f)
+
+
+def load_checkpoint(ckpt_path: str) -> Dict[Any, Dict[str, Any]]:
+    """
+    Load completed results keyed by task_id.
+
+    Reads the JSONL journal when present and falls back to a legacy `results_*.json` file.
+    When a task_id occurs more than once the latest record wins.
+    """
+    journal_path = journal_path_for(ckpt_path)
+    completed: Dict[Any, Dict[str, Any]] = {}
+    if os.path.exists(journal_path):
+        for record in iter_journal(journal_path):
+            completed[record["task_id"]] = record
+    elif os.path.exists(ckpt_path):
+        with open(ckpt_path, "r") as f:
+            for record in json.load(f):
+                completed[record["task_id"]] = record
+    return completed
+
+
+def remove_checkpoint(ckpt_path: str) -> None:
+    for path in (ckpt_path, journal_path_for(ckpt_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def open_checkpoint(ckpt_path: str) -> CheckpointWriter:
+    """
+    Open the journal for appending.
+
+    A legacy JSON checkpoint without a journal is migrated first so that resumed runs
+    keep its results when the journal is compacted back to JSON.
+    """
+    journal_path = journal_path_for(ckpt_path)
+    migrate = not os.path.exists(journal_path) and os.path.exists(ckpt_path)
+    writer = CheckpointWriter(journal_path)
+    if migrate:
+        with open(ckpt_path, "r") as f:
+            for record in json.load(f):
+                writer.append(record)
+    return writer
+
+
+def compact_checkpoint(ckpt_path: str, output_path: Optional[str] = None) -> int:
+    """
+    Export the journal to the JSON list layout used by `results_*.json` files.
+
+    Records are deduplicated by task_id (latest wins) and keep the order in which tasks first
+    completed. The output is written to a temporary file and atomically renamed.
+    Returns the number of records written.
+    """
+    journal_path = journal_path_for(ckpt_path)
+    output_path = output_path or ckpt_path
+    if not os.path.exists(journal_path):
+        return 0
+    records: Dict[Any, Dict[str, Any]] = {}
+    for record in iter_journal(journal_path):
+        records[record["task_id"]] = record
+    tmp_path = output_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(list(records.values()), f, indent=2)
+    os.replace(tmp_path, output_path)
+    return len(records)
+
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Compact a JSONL results journal into the results_*.json layout")
+    parser.add_argument("ckpt_path", type=str, help="Path of the results_*.json checkpoint (the .jsonl journal is read from next to it)")
+    parser.add_argument("--output", type=str, default=None, help="Write to this path instead of the checkpoint path")
+    args = parser.parse_args()
+    n = compact_checkpoint(args.ckpt_path, args.output)
+    print(f"Wrote {n} results to {args.output or args.ckpt_path}")
@@ -0,0 +1,61 @@
+from typing import Any, Dict, List, Optional
+
+from crm_sandbox.results.checkpoint import CheckpointWriter, load_checkpoint, open_checkpoint
+
+# Key of the evaluator arguments recorded in a result whose scoring was deferred
+DEFERRED_KEY = "deferred_eval"
+
+
+def pending_evaluations(ckpt_path: str) -> List[Dict[str, Any]]:
+    """Latest results of the checkpoint journal that still wait for their evaluator call."""
+    return [record for record in load_checkpoint(ckpt_path).values() if record.get(DEFERRED_KEY)]
+
+
+def evaluate_deferred(ckpt_path: str, evaluator, writer: Optional[CheckpointWriter] = None, max_workers: int = 8) -> int:
+    """
+    Score every deferred result of a checkpoint with `Evaluator.evaluate_batch` and append the
+    scored records to the journal, where they supersede the pending ones. Results whose evaluation
+    failed stay pending for the next call. Returns the number of results scored.
+    """
+    records = pending_evaluations(ckpt_path)
+    if not records:
+        return 0
+    print(f"Evaluating {len(records)} deferred answers")
+    reward_infos = evaluator.evaluate_batch([record[DEFERRED_KEY] for record in records], max_workers=max_workers)
+    own_writer = writer is None
+    writer = writer or open_checkpoint(ckpt_path)
+    scored = 0
+    try:
+        for record, reward_info in zip(records, reward_infos):
+            if reward_info is None:
+                print("⏳", f"task_id={record['task_id']} (evaluation failed, still pending)")
+                continue
+            del record[DEFERRED_KEY]
+            record["reward"] = reward_info["reward"]
+            end_reason = record.get("agent_info", {}).get("end_reason")
+            if isinstance(end_reason, dict):
+                end_reason["parsed_answer"] = reward_info["parsed_answer"]
+            print("✅" if record["reward"] == 1 else "❌", f"task_id={record['task_id']}")
+            writer.append(record)
+            scored += 1
+    finally:
+        if own_writer:
+            writer.close()
+    return scored
+
+
+if __name__ == "__main__":
+    import argparse
+    from dotenv import load_dotenv
+    from crm_sandbox.env.env import Evaluator
+    from crm_sandbox.results.checkpoint import compact_checkpoint
+    parser = argparse.ArgumentParser(description="Score the deferred answers of a run started with --deferred_eval")
+    parser.add_argument("ckpt_path", type=str, help="Path of the results_*.json checkpoint (the .jsonl journal is read from next to it)")
+    parser.add_argument("--eval_model", type=str, required=True)
+    parser.add_argument("--llm_provider", type=str, required=True)
+    parser.add_argument("--eval_workers", type=int, default=8)
+    args = parser.parse_args()
+    load_dotenv()
+    n = evaluate_deferred(args.ckpt_path, Evaluator(model=args.eval_model, provider=args.llm_provider), max_workers=args.eval_workers)
+    compact_checkpoint(args.ckpt_path)
+    print(f"Scored {n} deferred answers in {args.ckpt_path}; {len(pending_evaluations(args.ckpt_path))} still pending")
@@ -0,0 +1,157 @@
+import gzip
+import hashlib
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+from crm_sandbox.results.aggregate import parse_results_filename
+from crm_sandbox.results.checkpoint import iter_results
+
+_USAGE_KEYS = ["prompt_tokens", "completion_tokens", "total_tokens", "cache_read_tokens", "cache_creation_tokens"]
+
+
+class TrajectoryStore(object):
+    """
+    Content-addressed store of gzipped trajectories: `<root>/<hash[:2]>/<hash>.json.gz`, keyed by
+    the SHA-256 of the trajectory's canonical JSON. Identical trajectories (e.g. a task exported
+    from a journal and from its JSON export) are stored once.
+    """
+
+    def __init__(self, root: str) -> None:
+        super().__init__()
+        self.root = root
+
+    @staticmethod
+    def key(traj: List[Dict[str, Any]]) -> str:
+        return hashlib.sha256(json.dumps(traj, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.json.gz")
+
+    def put(self, traj: List[Dict[str, Any]]) -> str:
+        key = self.key(traj)
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump(traj, f)
+            os.replace(tmp_path, path)
+        return key
+
+    def get(self, key: str) -> List[Dict[str, Any]]:
+        with gzip.open(self.path_for(key), "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+
+def _schema():
+    return pa.schema([
+        ("model", pa.string()),
+        ("strategy", pa.string()),
+        ("interactive", pa.bool_()),
+        ("task_id", pa.string()),
+        ("task_type", pa.string()),
+        ("gt_answer", pa.string()),
+        ("reward", pa.float64()),
+        ("reward_metrics", pa.string()),
+        ("end_reason_source", pa.string()),
+        ("end_reason_message", pa.string()),
+        ("end_reason_content", pa.string()),
+        ("parsed_answer", pa.string()),
+        ("total_cost", pa.float64()),
+        *[(key, pa.int64()) for key in _USAGE_KEYS],
+        ("user_turns", pa.int64()),
+        ("agent_turns", pa.int64()),
+        ("latency", pa.float64()),
+        ("traj_hash", pa.string()),
+        ("traj_messages", pa.int64()),
+    ])
+
+
+def _json_or_none(value: Any) -> Optional[str]:
+    return None if value is None else json.dumps(value)
+
+
+def result_row(record: Dict[str, Any], meta: Dict[str, Any], traj_hash: Optional[str]) -> Dict[str, Any]:
+    """The scalar fields of a result; lists and dicts (answers, fuzzy metrics) are JSON strings."""
+    agent_info = record.get("agent_info") or {}
+    usage = agent_info.get("usage") or {}
+    end_reason = agent_info.get("end_reason")
+    if not isinstance(end_reason, dict):
+        # failed tasks record the error at the top of agent_info
+        end_reason = agent_info
+    reward = record.get("reward")
+    num_turns = agent_info.get("num_turns")
+    if isinstance(num_turns, (list, tuple)) and len(num_turns) == 2:
+        user_turns, agent_turns = num_turns
+    else:
+        user_turns, agent_turns = None, num_turns
+    end_content = end_reason.get("content")
+    return {
+        "model": meta["model"],
+        "strategy": meta["strategy"],
+        "interactive": meta["interactive"] if meta["interactive"] is not None else bool(user_turns),
+        "task_id": str(record["task_id"]),
+        "task_type": record.get("task_type"),
+        "gt_answer": _json_or_none(record.get("gt_answer")),
+        # fuzzy_match rewards are dicts of metrics; F1 is the score
+        "reward": reward.get("f1") if isinstance(reward, dict) else reward,
+        "reward_metrics": _json_or_none(reward) if isinstance(reward, dict) else None,
+        "end_reason_source": end_reason.get("source"),
+        "end_reason_message": end_reason.get("message"),
+        "end_reason_content": end_content if isinstance(end_content, str) or end_content is None else str(end_content),
+        "parsed_answer": _json_or_none(end_reason.get("parsed_answer")),
+        "total_cost": agent_info.get("total_cost"),
+        **{key: sum(t for t in usage.get(key) or [] if t) if key in usage else None for key in _USAGE_KEYS},
+        "user_turns": user_turns,
+        "agent_turns": agent_turns,
+        "latency": agent_info.get("latency"),
+        "traj_hash": traj_hash,
+        "traj_messages": len(record.get("traj") or []),
+    }
+
+
+def export_results(paths: List[str], output_path: str, store: TrajectoryStore, row_group_size: int = 10000) -> int:
+    """
+    Write the scalar fields of the results in `paths` to a Parquet file and their trajectories to
+    `store`, referenced by the `traj_hash` column. Within a file, the latest record of a task
+    wins, as when a checkpoint is loaded. Returns the number of rows written.
+    """
+    if pa is None:
+        raise ImportError("Exporting results to Parquet requires pyarrow (pip install pyarrow)")
+    schema = _schema()
+    n_rows = 0
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    tmp_path = output_path + ".tmp"
+    with pq.ParquetWriter(tmp_path, schema, compression="zstd") as writer:
+        for path in paths:
+            meta = parse_results_filename(path) or {"model": None, "strategy": None, "interactive": None}
+            rows = {}
+            for record in iter_results(path):
+                traj = record.get("traj")
+                rows[record["task_id"]] = result_row(record, meta, store.put(traj) if traj else None)
+            rows = list(rows.values())
+            for start in range(0, len(rows), row_group_size):
+                writer.write_table(pa.Table.from_pylist(rows[start:start + row_group_size], schema=schema))
+            n_rows += len(rows)
+    os.replace(tmp_path, output_path)
+    return n_rows
+
+
+if __name__ == "__main__":
+    import argparse
+    from crm_sandbox.results.aggregate import find_results
+    parser = argparse.ArgumentParser(description="Export results to Parquet, with trajectories in a content-addressed store")
+    parser.add_argument("paths", nargs="+", help="Results files or directories searched recursively")
+    parser.add_argument("--output", type=str, required=True, help="Parquet file to write")
+    parser.add_argument("--traj_store", type=str, default=None, help="Trajectory store directory (default: trajectories/ next to the output)")
+    args = parser.parse_args()
+    store = TrajectoryStore(args.traj_store or os.path.join(os.path.dirname(os.path.abspath(args.output)), "trajectories"))
+    n = export_results(find_results(args.paths), args.output, store)
+    print(f"Wrote {n} results to {args.output}, trajectories to {store.root}")
@@ -0,0 +1,138 @@
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from crm_sandbox.agents.chat_agent import ChatAgent
+from crm_sandbox.results.aggregate import parse_results_filename
+from crm_sandbox.results.checkpoint import compact_checkpoint, iter_results, open_checkpoint, remove_checkpoint
+from crm_sandbox.results.deferred import DEFERRED_KEY
+
+# Strategies that `ToolEnv.calculate_reward` scores by strict comparison, without the evaluator
+TOOL_STRATEGIES = ["tool_call", "tool_call_flex"]
+
+
+def _submitted_answer(record: Dict[str, Any]) -> Optional[str]:
+    """The answer the agent submitted, or None if the run ended without one (those were never scored)."""
+    end_reason = record.get("agent_info", {}).get("end_reason")
+    if not isinstance(end_reason, dict) or end_reason.get("message") != "Submit action":
+        return None
+    return end_reason.get("content")
+
+
+def _action_trajectory(traj: List[Dict[str, Any]]) -> List[str]:
+    """Rebuild `ChatEnv.actions` contents from the agent messages of a trajectory."""
+    actions = []
+    for message in traj:
+        if message.get("role") != "assistant" or not isinstance(message.get("content"), str):
+            continue
+        action = ChatAgent.message_action_parser(message, None)
+        if action is not None:
+            actions.append(action["content"])
+    return actions
+
+
+def evaluation_for(record: Dict[str, Any], task: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    The `Evaluator.evaluate` arguments of a saved react/act result, or None when it cannot be
+    re-scored: the agent never submitted an answer or the task is unknown.
+    """
+    if record.get(DEFERRED_KEY):
+        return record[DEFERRED_KEY]
+    traj = record.get("traj") or []
+    proposed_answer = _submitted_answer(record)
+    if proposed_answer is None or task is None:
+        return None
+    return dict(
+        proposed_answer=proposed_answer,
+        gt_answer=record["gt_answer"] if isinstance(record["gt_answer"], list) else [record["gt_answer"]],
+        reward_metric=task["reward_metric"],
+        task_name=record.get("task_type") or task["task"],
+        action_trajectory=_action_trajectory(traj),
+    )
+
+
+def _batches(records: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    records = iter(records)
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+def rescore_results(paths: List[str], output_path: str, evaluator, tasks: Dict[Any, Dict[str, Any]], batch_size: int = 256, max_workers: int = 8) -> Dict[str, int]:
+    """
+    Recompute the rewards of saved results with `evaluator` and write them to `output_path`.
+
+    Records are streamed from `paths` in batches of `batch_size`, scored with
+    `Evaluator.evaluate_batch` (LLM calls go through the LLM cache when it is configured), and
+    journaled next to `output_path` before it is written in the `results_*.json` layout.
+    `tasks` maps task ids to dataset tasks and provides each task's reward metric. Records
+    that cannot be re-scored, or whose evaluation fails, are copied unchanged, as are whole
+    files of tool_call runs (scored by `ToolEnv` without the evaluator) and files whose
+    strategy cannot be read from a `results_<model>_<strategy>_...` name.
+    """
+    remove_checkpoint(output_path)
+    counts = {"results": 0, "rescored": 0, "failed": 0, "changed": 0, "old_reward": 0, "new_reward": 0}
+    with open_checkpoint(output_path) as writer:
+        for path in paths:
+            meta = parse_results_filename(path)
+            rescorable = meta is not None and meta["strategy"] not in TOOL_STRATEGIES
+            if not rescorable:
+                print(f"Copying {path} unchanged: " + ("unknown strategy" if meta is None else f"{meta['strategy']} results are not scored by the evaluator"))
+            for batch in _batches(iter_results(path), batch_size):
+                scored = [(record, evaluation_for(record, tasks.get(record["task_id"])) if rescorable else None) for record in batch]
+                items = [evaluation for _, evaluation in scored if evaluation is not None]
+                reward_infos = iter(evaluator.evaluate_batch(items, max_workers=max_workers))
+                for record, evaluation in scored:
+                    counts["results"] += 1
+                    counts["old_reward"] += record["reward"] == 1
+                    if evaluation is not None:
+                        reward_info = next(reward_infos)
+                        if reward_info is None:
+                            counts["failed"] += 1
+                        else:
+                            record.pop(DEFERRED_KEY, None)
+                            counts["rescored"] += 1
+                            counts["changed"] += reward_info["reward"] != record["reward"]
+                            record["reward"] = reward_info["reward"]
+                            record["agent_info"]["end_reason"]["parsed_answer"] = reward_info["parsed_answer"]
+                    counts["new_reward"] += record["reward"] == 1
+                    writer.append(record)
+                print(f"Re-scored {counts['rescored']}/{counts['results']} results")
+    compact_checkpoint(output_path)
+    return counts
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    from dotenv import load_dotenv
+    from crm_sandbox.agents.llm_cache import configure_llm_cache, get_llm_cache, CACHE_MODES, DEFAULT_CACHE_PATH
+    from crm_sandbox.data.assets import get_tasks
+    from crm_sandbox.env.env import Evaluator
+    parser = argparse.ArgumentParser(description="Recompute the rewards of saved results without re-running the agents")
+    parser.add_argument("results", nargs="+", help="results_*.json or results_*.jsonl files of one org")
+    parser.add_argument("--output", type=str, default=None, help="Output results file (default: <first input>_rescored.json)")
+    parser.add_argument("--org_type", type=str, default="b2b", choices=["original", "b2b", "b2c"])
+    parser.add_argument("--interactive", action="store_true", default=False, help="The results come from interactive tasks")
+    parser.add_argument("--eval_model", type=str, required=True)
+    parser.add_argument("--llm_provider", type=str, required=True)
+    parser.add_argument("--eval_workers", type=int, default=8)
+    parser.add_argument("--batch_size", type=int, default=256, help="Results read and scored at a time")
+    parser.add_argument("--llm_cache", type=str, default="readwrite", choices=CACHE_MODES, help="Evaluator calls are cached, so only changed prompts hit the API (default: %(default)s)")
+    parser.add_argument("--llm_cache_path", type=str, default=DEFAULT_CACHE_PATH)
+    args = parser.parse_args()
+    load_dotenv()
+
+    output_path = args.output or os.path.splitext(args.results[0])[0] + "_rescored.json"
+    if args.llm_cache != "bypass":
+        configure_llm_cache(path=args.llm_cache_path, mode=args.llm_cache)
+    tasks = {task["idx"]: task for task in get_tasks(args.org_type, interactive=args.interactive)}
+    counts = rescore_results(
+        args.results, output_path, Evaluator(model=args.eval_model, provider=args.llm_provider), tasks,
+        batch_size=args.batch_size, max_workers=args.eval_workers,
+    )
+    print(f"Wrote {counts['results']} results to {output_path}")
+    print(f"Re-scored {counts['rescored']} ({counts['failed']} failed), changed {counts['changed']} rewards; solved {counts['old_reward']} -> {counts['new_reward']}")
+    if get_llm_cache() is not None:
+        print(f"LLM cache: {get_llm_cache().stats()}")
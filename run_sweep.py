@@ -0,0 +1,296 @@
+from dotenv import load_dotenv
+import json, os, re, socket, subprocess, sys, time
+import argparse
+from datetime import datetime
+from typing import Dict, List, Optional
+from crm_sandbox.agents.utils import BEDROCK_MODELS_MAP, TOGETHER_MODELS_MAP, VERTEX_MODELS_MAP, ANTHROPIC_MODELS_MAP, CUSTOM_SERVER_MODELS_MAP
+from crm_sandbox.agents.rate_limiter import DEFAULT_RATE_LIMITS, FALLBACK_RATE_LIMIT
+
+ORIGINAL_TASK_CATEGORIES = [
+    "policy_violation_identification", "monthly_trend_analysis", "named_entity_disambiguation",
+    "best_region_identification", "handle_time", "knowledge_qa", "transfer_count", "case_routing",
+    "top_issue_identification",
+]
+PRO_TASK_CATEGORIES = ORIGINAL_TASK_CATEGORIES + [
+    "sales_amount_understanding", "lead_routing", "sales_cycle_understanding", "conversion_rate_comprehension",
+    "wrong_stage_rectification", "sales_insight_mining", "quote_approval", "lead_qualification",
+    "activity_priority", "invalid_config",
+    "private_customer_information", "internal_operation_data", "confidential_company_knowledge",
+]
+OPENAI_MODELS = ["o1-mini", "gpt-4o", "gpt-4-turbo"]
+
+# Cells running at once per provider; each cell is a run_tasks.py process with its own rate limiter
+DEFAULT_PROVIDER_CONCURRENCY = {"openai": 8, "anthropic": 2, "bedrock": 4, "together_ai": 4, "vertex_ai": 4, "custom_server": 4}
+CLAIM_HEARTBEAT = 60.0
+
+
+def infer_provider(model: str) -> str:
+    """Pick the provider of a model the same way the run_tasks_*.sh scripts do."""
+    if model in ANTHROPIC_MODELS_MAP or model.startswith("claude"):
+        return "anthropic"
+    if model in BEDROCK_MODELS_MAP:
+        return "bedrock"
+    if model in CUSTOM_SERVER_MODELS_MAP:
+        return "custom_server"
+    if model in OPENAI_MODELS or model.startswith("gpt") or model.startswith("o1"):
+        return "openai"
+    if model in TOGETHER_MODELS_MAP and (model.startswith("llama4") or model not in VERTEX_MODELS_MAP):
+        return "together_ai"
+    return "vertex_ai"
+
+
+def all_models() -> List[str]:
+    models = OPENAI_MODELS + [*BEDROCK_MODELS_MAP, *ANTHROPIC_MODELS_MAP, *TOGETHER_MODELS_MAP, *VERTEX_MODELS_MAP, *CUSTOM_SERVER_MODELS_MAP]
+    return list(dict.fromkeys(models))
+
+
+def _safe(name: str) -> str:
+    return re.sub(r"[^\w.-]", "_", name)
+
+
+def expand_matrix(models, org_types, interactive_modes, strategies, task_categories=None, eval_mode="aided", privacy_aware_prompt=False) -> List[Dict]:
+    """
+    Expand the sweep into run_tasks.py cells, dropping combinations run_tasks.py rejects
+    (tool_call only runs on the original org, interactive mode only with react on b2b/b2c).
+    A model can be given as "model:provider" to override the inferred provider.
+    """
+    cells = []
+    for model_spec in models:
+        model, _, provider = model_spec.rpartition(":")
+        if provider not in DEFAULT_PROVIDER_CONCURRENCY:
+            # Bedrock model names contain ":" themselves
+            model, provider = model_spec, infer_provider(model_spec)
+        for org_type in org_types:
+            categories = task_categories or (ORIGINAL_TASK_CATEGORIES if org_type == "original" else PRO_TASK_CATEGORIES)
+            for interactive in interactive_modes:
+                for strategy in strategies:
+                    if interactive and (org_type == "original" or strategy != "react"):
+                        continue
+                    if strategy.startswith("tool_call") and org_type != "original":
+                        continue
+                    for task_category in categories:
+                        if org_type == "original" and task_category not in ORIGINAL_TASK_CATEGORIES:
+                            continue
+                        cells.append({
+                            "model": model, "provider": provider, "org_type": org_type, "interactive": interactive,
+                            "strategy": strategy, "task_category": task_category, "eval_mode": eval_mode,
+                            "privacy_aware_prompt": privacy_aware_prompt,
+                        })
+    return cells
+
+
+def cell_dirs(cell: Dict, results_root: str = "results", logs_root: str = "logs"):
+    """Result and log directories of a cell, laid out like the run_tasks_*.sh scripts."""
+    group = f"{cell['org_type']}_interactive" if cell["interactive"] else cell["org_type"]
+    leaf = f"{cell['strategy']}_{cell['provider']}" + ("_privacy_aware" if cell["privacy_aware_prompt"] else "")
+    return os.path.join(results_root, group, leaf), os.path.join(logs_root, group, leaf)
+
+
+def cell_key(cell: Dict) -> str:
+    group = f"{cell['org_type']}_interactive" if cell["interactive"] else cell["org_type"]
+    privacy = "_privacy_aware" if cell["privacy_aware_prompt"] else ""
+    return _safe(f"{group}__{cell['strategy']}_{cell['provider']}{privacy}__{cell['model']}__{cell['task_category']}__{cell['eval_mode']}")
+
+
+def cell_command(cell: Dict, result_dir: str, extra_args: List[str]) -> List[str]:
+    command = [
+        sys.executable, "-u", "run_tasks.py",
+        "--model", cell["model"],
+        "--task_category", cell["task_category"],
+        "--agent_eval_mode", cell["eval_mode"],
+        "--log_dir", result_dir,
+        "--agent_strategy", cell["strategy"],
+        "--llm_provider", cell["provider"],
+        "--reuse_results",
+        "--privacy_aware_prompt", str(cell["privacy_aware_prompt"]).lower(),
+        "--org_type", cell["org_type"],
+    ]
+    if cell["interactive"]:
+        command.append("--interactive")
+    return command + extra_args
+
+
+class SweepQueue(object):
+    """
+    Done markers and claim files under `sweep_dir`, shared by every host running the same sweep.
+
+    A cell is claimed by creating `claims/<key>` with O_EXCL, so only one runner starts it. Running
+    cells touch their claim every minute; a claim older than `claim_ttl` seconds belongs to a dead
+    runner and is taken over. Finished cells get a `done/<key>` marker and are skipped afterwards.
+    """
+
+    def __init__(self, sweep_dir: str, claim_ttl: float = 1800.0) -> None:
+        super().__init__()
+        self.claims_dir = os.path.join(sweep_dir, "claims")
+        self.done_dir = os.path.join(sweep_dir, "done")
+        self.claim_ttl = claim_ttl
+        os.makedirs(self.claims_dir, exist_ok=True)
+        os.makedirs(self.done_dir, exist_ok=True)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+    def is_done(self, key: str) -> bool:
+        return os.path.exists(os.path.join(self.done_dir, key))
+
+    def claim(self, key: str) -> bool:
+        path = os.path.join(self.claims_dir, key)
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not self._break_stale_claim(path):
+                return False
+            return self.claim(key)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"owner": self.owner, "claimed_at": datetime.now().isoformat()}, f)
+        return True
+
+    def _break_stale_claim(self, path: str) -> bool:
+        try:
+            if time.time() - os.path.getmtime(path) < self.claim_ttl:
+                return False
+            # Renaming is atomic, so only one runner takes over a stale claim
+            os.rename(path, f"{path}.stale.{self.owner.replace(':', '_')}")
+            os.remove(f"{path}.stale.{self.owner.replace(':', '_')}")
+            return True
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
+
+    def heartbeat(self, key: str) -> None:
+        try:
+            os.utime(os.path.join(self.claims_dir, key))
+        except FileNotFoundError:
+            pass
+
+    def release(self, key: str) -> None:
+        try:
+            os.remove(os.path.join(self.claims_dir, key))
+        except FileNotFoundError:
+            pass
+
+    def mark_done(self, key: str, info: Dict) -> None:
+        with open(os.path.join(self.done_dir, key), "w") as f:
+            json.dump(info, f)
+
+
+def cell_rate_args(provider: str, concurrency: int, extra_args: List[str]) -> List[str]:
+    """Split the provider's default RPM/TPM budget between its concurrently running cells."""
+    rpm, tpm = DEFAULT_RATE_LIMITS.get(provider, FALLBACK_RATE_LIMIT)
+    args = []
+    if "--rpm" not in extra_args and rpm:
+        args += ["--rpm", str(rpm / concurrency)]
+    if "--tpm" not in extra_args and tpm:
+        args += ["--tpm", str(tpm / concurrency)]
+    return args
+
+
+def run_sweep(cells: List[Dict], queue: SweepQueue, max_parallel: int, provider_concurrency: Dict[str, int], extra_args: List[str], results_root: str = "results", logs_root: str = "logs", poll_interval: float = 1.0) -> Dict[str, List[str]]:
+    """Run the cells as run_tasks.py processes, at most `max_parallel` at once and within the per-provider limits."""
+    status = {"done": [], "failed": [], "skipped": [], "claimed_elsewhere": []}
+    pending = []
+    for cell in cells:
+        if queue.is_done(cell_key(cell)):
+            status["skipped"].append(cell_key(cell))
+        else:
+            pending.append(cell)
+    running: Dict[str, tuple] = {}
+    per_provider: Dict[str, int] = {}
+    last_heartbeat = time.time()
+    print(f"{len(pending)} cells to run, {len(status['skipped'])} already done")
+    while pending or running:
+        # Start as many cells as the global and per-provider limits allow
+        for cell in list(pending):
+            if len(running) >= max_parallel:
+                break
+            limit = provider_concurrency.get(cell["provider"], 4)
+            if per_provider.get(cell["provider"], 0) >= limit:
+                continue
+            pending.remove(cell)
+            key = cell_key(cell)
+            if queue.is_done(key) or not queue.claim(key):
+                status["claimed_elsewhere"].append(key)
+                continue
+            result_dir, log_dir = cell_dirs(cell, results_root, logs_root)
+            os.makedirs(result_dir, exist_ok=True)
+            os.makedirs(log_dir, exist_ok=True)
+            log_file = os.path.join(log_dir, f"run_{cell['model']}_{cell['strategy']}_{cell['task_category']}_{cell['eval_mode']}.log")
+            command = cell_command(cell, result_dir, extra_args + cell_rate_args(cell["provider"], limit, extra_args))
+            log = open(log_file, "w")
+            process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+            running[key] = (process, log, cell, time.time())
+            per_provider[cell["provider"]] = per_provider.get(cell["provider"], 0) + 1
+            print(f"Started {key} (pid {process.pid})")
+
+        time.sleep(poll_interval)
+        for key, (process, log, cell, started) in list(running.items()):
+            if process.poll() is None:
+                continue
+            log.close()
+            del running[key]
+            per_provider[cell["provider"]] -= 1
+            elapsed = time.time() - started
+            if process.returncode == 0:
+                queue.mark_done(key, {"cell": cell, "finished_at": datetime.now().isoformat(), "elapsed_s": round(elapsed, 1), "host": queue.owner})
+                status["done"].append(key)
+                print(f"Finished {key} in {elapsed:.0f}s")
+            else:
+                status["failed"].append(key)
+                print(f"Failed {key} with exit code {process.returncode} after {elapsed:.0f}s")
+            queue.release(key)
+        if time.time() - last_heartbeat > CLAIM_HEARTBEAT:
+            for key in running:
+                queue.heartbeat(key)
+            last_heartbeat = time.time()
+    return status
+
+
+def _parse_concurrency(value: Optional[str]) -> Dict[str, int]:
+    concurrency = dict(DEFAULT_PROVIDER_CONCURRENCY)
+    for item in (value or "").split(","):
+        if item.strip():
+            provider, _, limit = item.partition("=")
+            concurrency[provider.strip()] = int(limit)
+    return concurrency
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    parser = argparse.ArgumentParser(
+        description="Run a models x org types x interactive x task categories sweep of run_tasks.py. "
+                    "Unrecognized arguments (e.g. --workers 4 --llm_cache readwrite) are passed on to every run_tasks.py cell."
+    )
+    parser.add_argument("--models", type=str, default=None, help="Comma separated models, optionally as model:provider (default: every model in the *_MODELS_MAP tables)")
+    parser.add_argument("--org_types", type=str, default="b2b,b2c,original")
+    parser.add_argument("--interactive", type=str, default="both", choices=["off", "on", "both"])
+    parser.add_argument("--strategies", type=str, default="react")
+    parser.add_argument("--task_categories", type=str, default=None, help="Comma separated task categories (default: every category of each org type)")
+    parser.add_argument("--agent_eval_mode", type=str, default="aided", choices=["default", "aided"])
+    parser.add_argument("--privacy_aware_prompt", action="store_true")
+    parser.add_argument("--max_parallel", type=int, default=16, help="Maximum number of cells running at once on this host (default: %(default)s)")
+    parser.add_argument("--provider_concurrency", type=str, default=None, help="Per-provider cell limits, e.g. openai=8,anthropic=2")
+    parser.add_argument("--sweep_dir", type=str, default="sweeps/default", help="Done markers and claim files; point several hosts at the same shared directory to split a sweep")
+    parser.add_argument("--claim_ttl", type=float, default=1800.0, help="Seconds without a heartbeat after which another runner may take over a cell (default: %(default)s)")
+    parser.add_argument("--results_root", type=str, default="results")
+    parser.add_argument("--logs_root", type=str, default="logs")
+    parser.add_argument("--dry_run", action="store_true", help="Print the cells and exit")
+    args, run_tasks_args = parser.parse_known_args()
+
+    models = args.models.split(",") if args.models else all_models()
+    interactive_modes = {"off": [False], "on": [True], "both": [False, True]}[args.interactive]
+    cells = expand_matrix(
+        models, args.org_types.split(","), interactive_modes, args.strategies.split(","),
+        args.task_categories.split(",") if args.task_categories else None,
+        eval_mode=args.agent_eval_mode, privacy_aware_prompt=args.privacy_aware_prompt,
+    )
+    queue = SweepQueue(args.sweep_dir, claim_ttl=args.claim_ttl)
+    if args.dry_run:
+        for cell in cells:
+            print(("DONE " if queue.is_done(cell_key(cell)) else "TODO ") + " ".join(cell_command(cell, cell_dirs(cell, args.results_root)[0], run_tasks_args)[2:]))
+        print(f"{len(cells)} cells")
+        sys.exit(0)
+    start_time = datetime.now()
+    status = run_sweep(cells, queue, args.max_parallel, _parse_concurrency(args.provider_concurrency), run_tasks_args, args.results_root, args.logs_root)
+    print(f"Sweep finished in {datetime.now() - start_time}: " + ", ".join(f"{len(v)} {k}" for k, v in status.items()))
+    with open(os.path.join(args.sweep_dir, f"status_{start_time.strftime('%Y%m%d_%H%M%S')}_{_safe(queue.owner)}.json"), "w") as f:
+        json.dump(status, f, indent=2)
+    sys.exit(1 if status["failed"] else 0)
@@ -1,46 +1,43 @@
 from dotenv import load_dotenv
 import json, os
 from crm_sandbox.agents import ChatAgent, ToolCallAgent
+from crm_sandbox.agents.rate_limiter import configure_rate_limits
+from crm_sandbox.agents.llm_cache import configure_llm_cache, get_llm_cache, CACHE_MODES, DEFAULT_CACHE_PATH
+from crm_sandbox.agents.tracing import configure_tracing, TRACE_FORMATS
+from crm_sandbox.env.query_cache import configure_query_cache, get_query_cache
+from crm_sandbox.env.sessions import configure_session_manager, DEFAULT_POOL_MAXSIZE
 from crm_sandbox.agents.utils import BEDROCK_MODELS_MAP, TOGETHER_MODELS_MAP, VERTEX_MODELS_MAP, ANTHROPIC_MODELS_MAP, CUSTOM_SERVER_MODELS_MAP
-from crm_sandbox.data.assets import TASKS_ORIGINAL, SCHEMA_ORIGINAL, TASKS_B2B, TASKS_B2B_INTERACTIVE, TASKS_B2C, TASKS_B2C_INTERACTIVE, B2B_SCHEMA, B2C_SCHEMA, EXTERNAL_FACING_TASKS
-from crm_sandbox.env.env import ChatEnv, ToolEnv, InteractiveChatEnv
+from crm_sandbox.data.assets import get_tasks, get_schema, EXTERNAL_FACING_TASKS
+from crm_sandbox.env.env import ChatEnv, ToolEnv, InteractiveChatEnv, Evaluator
+from crm_sandbox.env.observation import OBSERVATION_FORMATS
+from crm_sandbox.env.pool import EnvPool
 from crm_sandbox.env import TOOLS, TOOLS_FULL
+from crm_sandbox.results.checkpoint import load_checkpoint, remove_checkpoint, open_checkpoint, compact_checkpoint
+from crm_sandbox.results.deferred import evaluate_deferred, DEFERRED_KEY
+from crm_sandbox.results.export import export_results, TrajectoryStore
 import traceback
 import argparse
 from datetime import datetime
 import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 def run():
     if not os.path.exists(args.log_dir):
         os.makedirs(args.log_dir)
     ckpt_path = f"{args.log_dir}/results_{args.model}_{args.agent_strategy}_{args.task_category}.json"
-    if args.org_type == "b2b":
-        TASKS_NATURAL = TASKS_B2B_INTERACTIVE if args.interactive else TASKS_B2B
-        SCHEMA = B2B_SCHEMA
-    elif args.org_type == "b2c":
-        TASKS_NATURAL = TASKS_B2C_INTERACTIVE if args.interactive else TASKS_B2C
-        SCHEMA = B2C_SCHEMA
-    else:
-        # the original CRMArena
-        TASKS_NATURAL = TASKS_ORIGINAL
-        SCHEMA = SCHEMA_ORIGINAL
-    
-    if args.task_category == "all":
-        selected_tasks = TASKS_NATURAL
-    elif "," in args.task_category:
-        selected_tasks = [task for task in TASKS_NATURAL if task["task"] in args.task_category.split(",")]
-    else:
-        selected_tasks = [task for task in TASKS_NATURAL if task["task"] == args.task_category]
+    # Only the split of the selected org (and the selected task categories) is loaded
+    task_categories = None if args.task_category == "all" else args.task_category.split(",")
+    selected_tasks = get_tasks(args.org_type, interactive=args.interactive, task_categories=task_categories)
+    SCHEMA = get_schema(args.org_type)
         
     # Load checkpoint if it exists
     completed_tasks = {}
     
-    if os.path.exists(ckpt_path):
-        if args.reuse_results:
-            with open(ckpt_path, 'r') as f:
-                completed_tasks = {task['task_id']: task for task in json.load(f)}
-        else:
-            os.remove(ckpt_path)
+    if args.reuse_results:
+        completed_tasks = load_checkpoint(ckpt_path)
+    else:
+        remove_checkpoint(ckpt_path)
             
     print(f"Loaded {len(selected_tasks)} tasks")
     start_time = datetime.now()
@@ -75,56 +72,70 @@ def run():
             return agent_model
     
     eval_model = get_evaluation_model(args.llm_provider, args.model)
+    if args.llm_cache != "bypass":
+        configure_llm_cache(path=args.llm_cache_path, mode=args.llm_cache, max_entries=args.llm_cache_max_entries, max_age_days=args.llm_cache_max_age_days)
+    if args.query_cache:
+        configure_query_cache(ttl=args.query_cache_ttl, max_entries=args.query_cache_max_entries)
+    if args.trace_dir:
+        os.makedirs(args.trace_dir, exist_ok=True)
+        configure_tracing(f"{args.trace_dir}/traces_{args.model}_{args.agent_strategy}_{args.task_category}.jsonl", fmt=args.trace_format)
+    if args.workers > DEFAULT_POOL_MAXSIZE:
+        # one pooled connection per concurrent worker
+        configure_session_manager(pool_maxsize=args.workers)
+    if args.rpm is not None or args.tpm is not None:
+        configure_rate_limits(args.llm_provider, args.model, rpm=args.rpm, tpm=args.tpm)
     print(f"Using evaluation model: {eval_model} with provider: {args.llm_provider}")
     
-    if args.agent_strategy in ["act", "react"]:
-        if args.interactive:
-            if args.agent_strategy == "act":
-                raise ValueError(
-                    "Interactive mode is only supported for the 'react' strategy. "
-                    "'act' strategy cannot be used with --interactive."
+    def build_env():
+        """Create a fresh environment instance for the selected strategy."""
+        if args.agent_strategy in ["act", "react"]:
+            if args.interactive:
+                if args.agent_strategy == "act":
+                    raise ValueError(
+                        "Interactive mode is only supported for the 'react' strategy. "
+                        "'act' strategy cannot be used with --interactive."
+                    )
+                # This implies agent_strategy is "react" if interactive is True
+                
+                return InteractiveChatEnv(tasks=selected_tasks, max_user_turns=args.max_user_turns, user_model=eval_model, user_provider=args.llm_provider, org_type=args.org_type, local_snapshot=args.local_snapshot, max_obs_rows=args.max_obs_rows, max_obs_chars=args.max_obs_chars, obs_format=args.obs_format, deferred_eval=args.deferred_eval)
+            else: # Not interactive, both 'act' and 'react' are fine
+                return ChatEnv(tasks=selected_tasks, user_model=eval_model, user_provider=args.llm_provider, org_type=args.org_type, local_snapshot=args.local_snapshot, max_obs_rows=args.max_obs_rows, max_obs_chars=args.max_obs_chars, obs_format=args.obs_format, deferred_eval=args.deferred_eval)
+        elif args.agent_strategy == "tool_call":
+            if args.interactive:
+                raise NotImplementedError(
+                    f"Interactive mode is not supported for the '{args.agent_strategy}' strategy."
                 )
-            # This implies agent_strategy is "react" if interactive is True
-            
-            env = InteractiveChatEnv(tasks=selected_tasks, max_user_turns=args.max_user_turns, user_model=eval_model, user_provider=args.llm_provider, org_type=args.org_type)
-        else: # Not interactive, both 'act' and 'react' are fine
-            env = ChatEnv(tasks=selected_tasks, user_model=eval_model, user_provider=args.llm_provider, org_type=args.org_type)
-    elif args.agent_strategy == "tool_call":
-        if args.interactive:
-            raise NotImplementedError(
-                f"Interactive mode is not supported for the '{args.agent_strategy}' strategy."
-            )
-        if args.org_type != "original":
-            raise NotImplementedError(
-                f"The '{args.agent_strategy}' strategy is only supported for the 'original' org_type (CRMArena), "
-                f"not '{args.org_type}'."
-            )
-        env = ToolEnv(tools=TOOLS, tasks=selected_tasks, org_type=args.org_type)
-    elif args.agent_strategy == "tool_call_flex":
-        if args.interactive:
-            raise NotImplementedError(
-                f"Interactive mode is not supported for the '{args.agent_strategy}' strategy."
-            )
-        if args.org_type != "original":
-            raise NotImplementedError(
-                f"The '{args.agent_strategy}' strategy is only supported for the 'original' org_type (CRMArena), "
-                f"not '{args.org_type}'."
-            )
-        env = ToolEnv(tools=TOOLS_FULL, tasks=selected_tasks, org_type=args.org_type)
-    else:
-        # Fallback for unknown strategies, though argparse choices should prevent this.
-        raise ValueError(f"Unsupported agent_strategy: {args.agent_strategy}")
-    for idx, task in selected_tasks.items():
-        # Skip tasks that have already been completed
-        if idx in completed_tasks:
-            print(f"Skipping task {idx} (already completed)")
-            continue
+            if args.org_type != "original":
+                raise NotImplementedError(
+                    f"The '{args.agent_strategy}' strategy is only supported for the 'original' org_type (CRMArena), "
+                    f"not '{args.org_type}'."
+                )
+            return ToolEnv(tools=TOOLS, tasks=selected_tasks, org_type=args.org_type, local_snapshot=args.local_snapshot, obs_format=args.obs_format)
+        elif args.agent_strategy == "tool_call_flex":
+            if args.interactive:
+                raise NotImplementedError(
+                    f"Interactive mode is not supported for the '{args.agent_strategy}' strategy."
+                )
+            if args.org_type != "original":
+                raise NotImplementedError(
+                    f"The '{args.agent_strategy}' strategy is only supported for the 'original' org_type (CRMArena), "
+                    f"not '{args.org_type}'."
+                )
+            return ToolEnv(tools=TOOLS_FULL, tasks=selected_tasks, org_type=args.org_type, local_snapshot=args.local_snapshot, obs_format=args.obs_format)
+        else:
+            # Fallback for unknown strategies, though argparse choices should prevent this.
+            raise ValueError(f"Unsupported agent_strategy: {args.agent_strategy}")
+
+    ckpt_writer = open_checkpoint(ckpt_path)
+
+    def build_agent(env, task):
+        """Create a fresh agent for a single task."""
         if task["task"] in EXTERNAL_FACING_TASKS:
             agent_type = "external"
         else:
             agent_type = "internal"
         if args.agent_strategy in ["react"]:
-            agent = ChatAgent(
+            return ChatAgent(
                 model=args.model,
                 schema_obj=SCHEMA,
                 eval_mode=args.agent_eval_mode,
@@ -133,25 +144,25 @@ def run():
                 provider=args.llm_provider,
                 interactive=args.interactive,
                 agent_type=agent_type,
-                privacy_aware_prompt=args.privacy_aware_prompt
+                privacy_aware_prompt=args.privacy_aware_prompt,
+                prompt_caching=args.prompt_caching,
+                context_budget=args.context_budget
             )
         else:
             
-            agent = ToolCallAgent(
+            return ToolCallAgent(
                 model=args.model,
                 tools=env.tools_info,
                 schema_obj=SCHEMA,
                 eval_mode=args.agent_eval_mode,
                 max_turns=args.max_turns,
                 strategy=args.agent_strategy,
-                provider=args.llm_provider
-            )
-        print(f"Running task {idx}")
-        try:
-            reward = agent.act(
-                env,
-                idx
+                provider=args.llm_provider,
+                prompt_caching=args.prompt_caching
             )
+
+    def build_result(idx, task, agent, reward=0, error=None, env=None):
+        if error is None:
             result = {
                 "task_id": idx,
                 "task_type": task["task"],
@@ -160,32 +171,131 @@ def run():
                 "agent_info": agent.info,
                 "traj": agent.get_messages(),
             }
-        except Exception as e:
-            traceback.print_exc()
-            result = {
-                "task_id": idx,
-                "task_type": task["task"],
-                "gt_answer": task["answer"],
-                "reward": 0,
-                "agent_info": {
-                    "source": "api",
-                    "content": "Error: " + str(e)
-                },
-                "traj": agent.get_messages(),
-            }
+            if getattr(env, "pending_evaluation", None) is not None:
+                # scored after the run by evaluate_deferred
+                result[DEFERRED_KEY] = env.pending_evaluation
+            return result
+        return {
+            "task_id": idx,
+            "task_type": task["task"],
+            "gt_answer": task["answer"],
+            "reward": 0,
+            "agent_info": {
+                "source": "api",
+                "content": "Error: " + str(error)
+            },
+            "traj": agent.get_messages(),
+        }
+
+    def save_result(idx, result):
         print(
-            "✅" if result["reward"] == 1 else "❌",
+            "⏳" if DEFERRED_KEY in result else "✅" if result["reward"] == 1 else "❌",
             f"task_id={idx}"
         )
         print("-----")
-        data_res = []
-        if os.path.exists(ckpt_path):
-            with open(ckpt_path, "r") as f:
-                data_res = json.load(f)
-        with open(ckpt_path, "w") as f:
-            json.dump(data_res + [result], f, indent=2)
+        # Appends are serialized by the writer, so concurrent workers can share it
+        ckpt_writer.append(result)
+
+    def run_task(env, idx, task):
+        """Run a single task with its own agent and append the result to the checkpoint."""
+        agent = build_agent(env, task)
+        print(f"Running task {idx}")
+        start = time.monotonic()
+        try:
+            reward = agent.act(
+                env,
+                idx
+            )
+            result = build_result(idx, task, agent, reward, env=env)
+        except Exception as e:
+            traceback.print_exc()
+            result = build_result(idx, task, agent, error=e)
+        result["agent_info"]["latency"] = round(time.monotonic() - start, 3)
+        save_result(idx, result)
         time.sleep(args.task_delay)
+        return result
+
+    async def arun_task(env, idx, task):
+        """Async counterpart of `run_task` driving the agent through `aact`."""
+        agent = build_agent(env, task)
+        print(f"Running task {idx}")
+        start = time.monotonic()
+        try:
+            reward = await agent.aact(
+                env,
+                idx
+            )
+            result = build_result(idx, task, agent, reward, env=env)
+        except Exception as e:
+            traceback.print_exc()
+            result = build_result(idx, task, agent, error=e)
+        result["agent_info"]["latency"] = round(time.monotonic() - start, 3)
+        save_result(idx, result)
+        await asyncio.sleep(args.task_delay)
+        return result
+
+    def run_pooled_task(pool, idx, task):
+        with pool.lease() as env:
+            result = run_task(env, idx, task)
+            if result["agent_info"].get("source") == "api":
+                # the task raised; make sure the env (and its Salesforce session) still works before reuse
+                pool.suspect(env)
+        return result
+
+    async def arun_all(pool, pending_tasks):
+        # Conversations are multiplexed on one event loop; each in-flight task checks out its own env
+        async def run_one(idx, task):
+            async with pool.alease() as env:
+                result = await arun_task(env, idx, task)
+                if result["agent_info"].get("source") == "api":
+                    pool.suspect(env)
+            return result
+
+        await asyncio.gather(*(run_one(idx, task) for idx, task in pending_tasks))
+
+    pending_tasks = []
+    for idx, task in selected_tasks.items():
+        # Skip tasks that have already been completed
+        if idx in completed_tasks:
+            print(f"Skipping task {idx} (already completed)")
+            continue
+        pending_tasks.append((idx, task))
+
+    try:
+        if pending_tasks:
+            # Envs are built (and logged in) up front and reused across tasks; they hold per-task
+            # state (current task, actions, user simulator messages), so each is used by one task at a time
+            pool = EnvPool(build_env, size=max(1, min(args.workers, len(pending_tasks))))
+            if args.use_async:
+                print(f"Running {len(pending_tasks)} tasks on the event loop with {args.workers} concurrent conversations")
+                asyncio.run(arun_all(pool, pending_tasks))
+            elif args.workers <= 1:
+                for idx, task in pending_tasks:
+                    run_pooled_task(pool, idx, task)
+            else:
+                print(f"Running {len(pending_tasks)} tasks with {args.workers} workers")
+                with ThreadPoolExecutor(max_workers=args.workers) as executor:
+                    futures = [executor.submit(run_pooled_task, pool, idx, task) for idx, task in pending_tasks]
+                    for future in as_completed(futures):
+                        # Task failures are recorded as results; anything raised here is a setup error
+                        future.result()
+            print(f"Env pool stats: {pool.stats()}")
+        if args.deferred_eval:
+            # also picks up answers left unscored by an interrupted run resumed with --reuse_results
+            evaluate_deferred(ckpt_path, Evaluator(model=eval_model, provider=args.llm_provider), writer=ckpt_writer, max_workers=args.eval_workers)
+    finally:
+        ckpt_writer.close()
+        # Export the journal to the results_*.json layout used by --reuse_results and downstream tooling
+        compact_checkpoint(ckpt_path)
+    if args.export_parquet:
+        parquet_path = os.path.splitext(ckpt_path)[0] + ".parquet"
+        n = export_results([ckpt_path], parquet_path, TrajectoryStore(f"{args.log_dir}/trajectories"))
+        print(f"Exported {n} results to {parquet_path}")
     end_time = datetime.now()
+    if get_llm_cache() is not None:
+        print(f"LLM cache stats: {get_llm_cache().stats()}")
+    if get_query_cache() is not None:
+        print(f"Query cache stats: {get_query_cache().stats()}")
     print(f"Finished evaluation at {end_time}")
     
 if __name__ == "__main__":
@@ -274,9 +384,103 @@ if __name__ == "__main__":
     parser.add_argument(
         "--task_delay",
         type=float,
-        default=1.0,
-        help="Delay in seconds between tasks to avoid rate limiting (default: 1.0)"
+        default=0.0,
+        help="Extra delay in seconds between tasks; LLM calls are already paced by the rate limiter (default: 0.0)"
+    )
+    parser.add_argument(
+        "--rpm",
+        type=float,
+        default=None,
+        help="Requests-per-minute budget for the agent model (default: per-provider default)"
+    )
+    parser.add_argument(
+        "--tpm",
+        type=float,
+        default=None,
+        help="Tokens-per-minute budget for the agent model (default: per-provider default)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of tasks to run concurrently, each worker with its own agent and env (default: 1)"
+    )
+    parser.add_argument(
+        "--llm_cache",
+        type=str,
+        default="bypass",
+        choices=CACHE_MODES,
+        help="Persistent LLM response cache for agent, user simulator and evaluator calls (default: %(default)s)"
+    )
+    parser.add_argument("--llm_cache_path", type=str, default=DEFAULT_CACHE_PATH)
+    parser.add_argument("--llm_cache_max_entries", type=int, default=None, help="Evict least recently used entries beyond this count")
+    parser.add_argument("--llm_cache_max_age_days", type=float, default=None, help="Evict entries older than this many days")
+    parser.add_argument(
+        "--prompt_caching",
+        action="store_true",
+        help="Mark the static system prompt (instructions and schema) as a cacheable prefix for Anthropic, Bedrock and Vertex Claude models"
+    )
+    parser.add_argument(
+        "--obs_format",
+        type=str,
+        default=None,
+        choices=OBSERVATION_FORMATS,
+        help="Encoding of query results shown to the agent (default: repr, or csv with --max_obs_rows/--max_obs_chars)"
+    )
+    parser.add_argument(
+        "--context_budget",
+        type=int,
+        default=None,
+        help="Estimated token budget of the react/act agent context; older query outputs and turns are elided beyond it (default: unbounded)"
+    )
+    parser.add_argument(
+        "--max_obs_rows",
+        type=int,
+        default=None,
+        help="Show query results as a table of at most this many rows; the agent pages through the rest with NEXT <cursor> (default: full result)"
+    )
+    parser.add_argument(
+        "--max_obs_chars",
+        type=int,
+        default=None,
+        help="Cap the characters of each query result shown to the agent, paging the rest like --max_obs_rows (default: no cap)"
+    )
+    parser.add_argument(
+        "--deferred_eval",
+        action="store_true",
+        help="Record answers that need the LLM evaluator and score them all concurrently after the run"
+    )
+    parser.add_argument("--eval_workers", type=int, default=8, help="Concurrent evaluator calls with --deferred_eval (default: %(default)s)")
+    parser.add_argument(
+        "--export_parquet",
+        action="store_true",
+        help="Also export the results to results_*.parquet, with trajectories stored in <log_dir>/trajectories (requires pyarrow)",
+    )
+    parser.add_argument(
+        "--local_snapshot",
+        type=str,
+        default=None,
+        help="Run queries against a local SQLite snapshot of the org instead of the live Salesforce org"
+    )
+    parser.add_argument(
+        "--query_cache",
+        action="store_true",
+        help="Cache SOQL/SOSL results in memory, shared by all workers (the org is read-only during evaluation)"
+    )
+    parser.add_argument("--query_cache_ttl", type=float, default=3600.0, help="Seconds before a cached query result expires (default: %(default)s)")
+    parser.add_argument("--query_cache_max_entries", type=int, default=10000, help="Maximum number of cached query results (default: %(default)s)")
+    parser.add_argument(
+        "--use_async",
+        action="store_true",
+        help="Drive agents with aact on a single asyncio event loop; --workers sets the number of concurrent conversations"
+    )
+    parser.add_argument(
+        "--trace_dir",
+        type=str,
+        default=None,
+        help="Write the spans of every task (turns, LLM calls, queries, evaluator and user simulator) to a traces_*.jsonl file in this directory"
     )
+    parser.add_argument("--trace_format", type=str, default="jsonl", choices=TRACE_FORMATS, help="One JSON line per span, or one OTLP/JSON request per task (default: %(default)s)")
     parser.add_argument("--log_dir", type=str, default="logs")
     args = parser.parse_args()
     print(args)
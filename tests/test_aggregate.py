@@ -0,0 +1,31 @@
+import json
+
+import pytest
+
+from crm_sandbox.results.aggregate import aggregate, parse_results_filename
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("results_gpt-4o_react_all.json", {"model": "gpt-4o", "strategy": "react", "category": "all", "interactive": None}),
+    ("results_gpt-4o_act_all.jsonl", {"model": "gpt-4o", "strategy": "act", "category": "all", "interactive": None}),
+    ("results_gpt-4o_tool_call_all.json", {"model": "gpt-4o", "strategy": "tool_call", "category": "all", "interactive": None}),
+    ("results_gpt-4o_tool_call_flex_all.json", {"model": "gpt-4o", "strategy": "tool_call_flex", "category": "all", "interactive": None}),
+    (
+        "results/shared/b2b/results_o1-2024-12-17_react_wrong_stage_rectification_interactive-False.json",
+        {"model": "o1-2024-12-17", "strategy": "react", "category": "wrong_stage_rectification", "interactive": False},
+    ),
+    ("leaderboard.json", None),
+])
+def test_parse_results_filename(name, expected):
+    assert parse_results_filename(name) == expected
+
+
+def test_aggregate_skips_unreadable_files(tmp_path):
+    record = {"task_id": 0, "task_type": "case_routing", "reward": 1, "agent_info": {"total_cost": 0.5, "num_turns": 2}}
+    (tmp_path / "results_gpt-4o_react_all.json").write_text(json.dumps([record]))
+    # a Git LFS pointer in place of a results file
+    (tmp_path / "results_gpt-4o_act_all.json").write_text("version https://git-lfs.github.com/spec/v1\noid sha256:0\nsize 1\n")
+
+    rows = aggregate([str(tmp_path)], workers=1)
+
+    assert [(row["strategy"], row["task"], row["n"], row["accuracy"]) for row in rows] == [("react", "case_routing", 1, 1.0), ("react", "ALL", 1, 1.0)]
@@ -0,0 +1,56 @@
+import pytest
+
+from crm_sandbox.agents.chat_agent import ChatAgent
+from crm_sandbox.agents.context import OBSERVATION_PREFIX, ContextManager, SlidingWindowContext
+
+SCHEMA = [{"object": "Account", "fields": {"Id": "id", "Name": "name"}}]
+SYSTEM = {"role": "system", "content": "You are a Salesforce agent."}
+QUERY = {"role": "user", "content": "Which account has the most cases?"}
+HEADS = {
+    "system_and_query": [SYSTEM, QUERY],
+    # models without a system role get the system prompt and the query in one message
+    "query_only": [{"role": "user", "content": SYSTEM["content"] + "\n\n" + QUERY["content"]}],
+}
+
+
+def add_turns(context, n):
+    for i in range(n):
+        context.append({"role": "assistant", "content": f"<execute>SELECT Id FROM Account LIMIT {i}</execute>"})
+        context.append({"role": "user", "content": OBSERVATION_PREFIX + "001" * 400})
+
+
+@pytest.mark.parametrize("layout", HEADS)
+def test_sliding_window_fits_budget(layout):
+    head = HEADS[layout]
+    full = ContextManager()
+    full.reset(head)
+    add_turns(full, 10)
+    context = SlidingWindowContext(budget=1500)
+    context.reset(head)
+    add_turns(context, 10)
+
+    assert context.elided_observations > 0
+    assert context.summarized_turns > 0
+    # the summary lines may go slightly past the budget
+    assert context.total_tokens < 1600 < full.total_tokens
+    # the head keeps its place; the summary is appended to the task query, the last head message
+    assert context.messages[:len(head) - 1] == head[:-1]
+    query = context.messages[len(head) - 1]
+    assert query["content"].startswith(head[-1]["content"])
+    assert "Summary of your earlier turns" in query["content"]
+    assert [m["role"] for m in context.messages[len(head):]] == ["assistant", "user"] * ((len(context.messages) - len(head)) // 2)
+
+
+@pytest.mark.parametrize("model", ["gpt-4o", "o1-mini"])
+def test_chat_agent_context_budget(model):
+    agent = ChatAgent(schema_obj=SCHEMA, model=model, provider="openai", context_budget=3000)
+    agent.reset({"query": QUERY["content"], "metadata": {"required": ""}})
+    for i in range(10):
+        agent._safe_add_message("assistant", f"<execute>SELECT Id FROM Account LIMIT {i}</execute>")
+        agent._safe_add_message("user", OBSERVATION_PREFIX + "001" * 400)
+
+    stats = agent.context.stats()
+    assert stats["summarized_turns"] > 0
+    assert stats["context_tokens"] < 3100
+    # the trajectory keeps the full conversation
+    assert len(agent.messages) == len(agent.context.messages) + 2 * stats["summarized_turns"]
@@ -0,0 +1,32 @@
+import pytest
+
+from crm_sandbox.env.extractors import extract_answer
+
+
+@pytest.mark.parametrize("text, task_name, expected", [
+    ("The Case ID is 500Wt00000DDGkXIAX.", "case_routing", ["500Wt00000DDGkXIAX"]),
+    ("None", "case_routing", ["None"]),
+    ("June and July", "monthly_trend_analysis", ["June", "July"]),
+    ("May", "monthly_trend_analysis", ["May"]),
+    ("New York and CA", "best_region_identification", ["NY", "CA"]),
+    ("Budget, Authority", "lead_qualification", ["Budget", "Authority"]),
+    ("The opportunity stage is Discovery.", "wrong_stage_rectification", ["Discovery"]),
+])
+def test_bare_answers(text, task_name, expected):
+    assert extract_answer(text, task_name) == expected
+
+
+@pytest.mark.parametrize("text, task_name", [
+    # the verb "may" is not a month
+    ("It may be June", "monthly_trend_analysis"),
+    ("june", "monthly_trend_analysis"),
+    # alternatives are hedged answers, not several answers
+    ("NY or CA", "best_region_identification"),
+    ("Budget or Authority", "lead_qualification"),
+    ("The lead does not meet Budget", "lead_qualification"),
+    ("we need a Timeline", "lead_qualification"),
+    ("The deal is closed; move it to Negotiation", "wrong_stage_rectification"),
+    ("OR", "best_region_identification"),
+])
+def test_ambiguous_answers_go_to_the_llm(text, task_name):
+    assert extract_answer(text, task_name) is None
@@ -0,0 +1,85 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+from crm_sandbox.env.local_sandbox import LocalSalesforceConnector, create_object_table, date_literal_range, insert_records
+
+TODAY = date(2025, 5, 25)
+
+
+@pytest.fixture
+def sandbox(tmp_path):
+    db_path = str(tmp_path / "snapshot.db")
+    conn = sqlite3.connect(db_path)
+    create_object_table(conn, "User", [{"name": "Id", "type": "id"}, {"name": "Name", "type": "string"}])
+    create_object_table(conn, "Account", [
+        {"name": "Id", "type": "id"},
+        {"name": "Name", "type": "string"},
+        {"name": "OwnerId", "type": "reference", "referenceTo": ["User"], "relationshipName": "Owner"},
+        {"name": "ShippingState", "type": "string"},
+    ])
+    create_object_table(conn, "Case", [
+        {"name": "Id", "type": "id"},
+        {"name": "AccountId", "type": "reference", "referenceTo": ["Account"], "relationshipName": "Account"},
+        {"name": "Status", "type": "picklist"},
+        {"name": "CreatedDate", "type": "datetime"},
+        {"name": "IsEscalated", "type": "boolean"},
+    ])
+    insert_records(conn, "User", [{"Id": "005A", "Name": "Ann"}, {"Id": "005B", "Name": "Bob"}])
+    insert_records(conn, "Account", [
+        {"Id": "001A", "Name": "Acme", "OwnerId": "005A", "ShippingState": "NY"},
+        {"Id": "001B", "Name": "Beta", "OwnerId": "005B", "ShippingState": "CA"},
+    ])
+    insert_records(conn, "Case", [
+        {"Id": "500A", "AccountId": "001A", "Status": "Closed", "CreatedDate": "2025-03-01T10:00:00Z", "IsEscalated": True},
+        {"Id": "500B", "AccountId": "001A", "Status": "New", "CreatedDate": "2025-05-10T10:00:00.000+0000", "IsEscalated": False},
+        {"Id": "500C", "AccountId": "001B", "Status": "Closed", "CreatedDate": "2025-05-20T12:00:00+02:00", "IsEscalated": False},
+    ])
+    conn.commit()
+    conn.close()
+    return LocalSalesforceConnector(db_path, today=TODAY)
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT Id, Account.Owner.Name FROM Case WHERE Status = 'Closed' ORDER BY Id", [
+        {"Id": "500A", "Account": {"Owner": {"Name": "Ann"}}},
+        {"Id": "500C", "Account": {"Owner": {"Name": "Bob"}}},
+    ]),
+    ("SELECT Id FROM Account WHERE Id IN (SELECT AccountId FROM Case WHERE IsEscalated = true)", [{"Id": "001A"}]),
+    ("SELECT Id FROM Account WHERE Id NOT IN (SELECT AccountId FROM Case WHERE Status = 'New')", [{"Id": "001B"}]),
+    ("SELECT Id FROM Case WHERE Id NOT IN ('500A') AND Status LIKE 'Clo%'", [{"Id": "500C"}]),
+    ("SELECT Id FROM Case WHERE CreatedDate >= 2025-05-01T00:00:00Z ORDER BY Id", [{"Id": "500B"}, {"Id": "500C"}]),
+    ("SELECT Id FROM Case WHERE CreatedDate = LAST_N_DAYS:30 ORDER BY Id", [{"Id": "500B"}, {"Id": "500C"}]),
+    ("SELECT Id FROM Case WHERE CreatedDate = THIS_MONTH ORDER BY Id DESC LIMIT 1", [{"Id": "500C"}]),
+    ("SELECT AccountId, COUNT(Id) cnt FROM Case GROUP BY AccountId HAVING COUNT(Id) > 1", [{"AccountId": "001A", "cnt": 2}]),
+    (
+        "SELECT CALENDAR_MONTH(CreatedDate) month, COUNT(Id) FROM Case GROUP BY CALENDAR_MONTH(CreatedDate) ORDER BY CALENDAR_MONTH(CreatedDate)",
+        [{"month": 3, "expr0": 1}, {"month": 5, "expr0": 2}],
+    ),
+    ("SELECT Id FROM Case ORDER BY Id LIMIT 1 OFFSET 1", [{"Id": "500B"}]),
+    ("FIND {Acme} IN NAME FIELDS RETURNING Account(Id, Name)", [{"Id": "001A", "Name": "Acme"}]),
+])
+def test_queries(sandbox, query, expected):
+    assert sandbox.run_query(query) == (expected, 1)
+
+
+def test_count_only_returns_no_records(sandbox):
+    assert sandbox.run_query("SELECT COUNT() FROM Case") == ([], 1)
+
+
+@pytest.mark.parametrize("query, error_code", [
+    ("SELECT Id, Foo FROM Case", "INVALID_FIELD"),
+    ("SELECT Id, Account.Foo FROM Case", "INVALID_FIELD"),
+    ("SELECT Id FROM Widget", "INVALID_TYPE"),
+    ("SELECT Id FROM Case WHERE", "MALFORMED_QUERY"),
+])
+def test_errors(sandbox, query, error_code):
+    message, status = sandbox.run_query(query)
+    assert status == 0
+    assert message.startswith(f"{error_code}: ")
+
+
+def test_date_literal_range():
+    assert date_literal_range("LAST_N_DAYS:30", TODAY) == (date(2025, 4, 25), date(2025, 5, 26))
+    assert date_literal_range("THIS_MONTH", TODAY) == (date(2025, 5, 1), date(2025, 6, 1))
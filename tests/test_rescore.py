@@ -0,0 +1,42 @@
+import json
+
+from crm_sandbox.results.checkpoint import iter_results
+from crm_sandbox.results.rescore import rescore_results
+
+TASKS = {i: {"task": "case_routing", "reward_metric": "exact_match"} for i in range(3)}
+
+
+class FakeEvaluator(object):
+    def __init__(self):
+        self.items = []
+
+    def evaluate_batch(self, items, max_workers=8):
+        self.items.extend(items)
+        return [{"reward": 1, "parsed_answer": ["005A"]} for _ in items]
+
+
+def result(task_id, answer):
+    # a direct answer: no tool or observation messages in the trajectory
+    return {
+        "task_id": task_id,
+        "task_type": "case_routing",
+        "gt_answer": ["005A"],
+        "reward": 0,
+        "agent_info": {"end_reason": {"source": "agent", "message": "Submit action", "content": answer}},
+        "traj": [{"role": "user", "content": "Which agent?"}, {"role": "assistant", "content": f"<respond>{answer}</respond>"}],
+    }
+
+
+def test_rescore_skips_tool_call_files(tmp_path):
+    paths = []
+    for task_id, strategy in enumerate(["react", "tool_call", "tool_call_flex"]):
+        path = tmp_path / f"results_gpt-4o_{strategy}_all.json"
+        path.write_text(json.dumps([result(task_id, "005A.")]))
+        paths.append(str(path))
+    evaluator = FakeEvaluator()
+
+    counts = rescore_results(paths, str(tmp_path / "rescored.json"), evaluator, TASKS)
+
+    assert len(evaluator.items) == 1
+    assert counts["results"] == 3 and counts["rescored"] == 1
+    assert [record["reward"] for record in iter_results(str(tmp_path / "rescored.json"))] == [1, 0, 0]